@@ -1,9 +1,28 @@
 import streamlit as st
 import pandas as pd
-from datetime import datetime, date, timedelta
+import numpy as np
+from datetime import datetime, date, timedelta, timezone
+import bisect
 import calendar
+import concurrent.futures
+import math
 import json
+import html
+import io
+import os
+import re
+import hashlib
+import heapq
+import urllib.error
+import urllib.request
+import uuid
+import time
+import threading
+import sqlite3
+from dataclasses import dataclass, field, fields, replace
+from enum import Enum
 from streamlit_gsheets import GSheetsConnection
+from PIL import Image
 
 # --- KONFIGURACJA POCZĄTKOWA ---
 st.set_page_config(page_title="NQPaneksu Journal", layout="wide", initial_sidebar_state="collapsed")
@@ -57,8 +76,16 @@ themes = {
 current_theme = themes[st.session_state.theme]
 
 # --- INJECT CSS ---
-st.markdown(f"""
-    <style>
+def minify_css(css):
+    css = re.sub(r"/\*.*?\*/", "", css, flags=re.S)
+    return re.sub(r"\s*([{};,>])\s*", r"\1", re.sub(r"\s+", " ", css)).strip()
+
+
+@st.cache_resource
+def theme_css(theme_name):
+    # Formatowany i minifikowany raz na motyw (na proces)
+    theme = themes[theme_name]
+    return minify_css(f"""
     @import url('https://fonts.googleapis.com/css2?family=Syne:wght@400;600;700;800&family=DM+Sans:opsz,wght@9..40,300;9..40,400;9..40,500;9..40,600;9..40,700&family=DM+Mono:wght@300;400;500&display=swap');
 
     * {{ font-family: 'DM Sans', -apple-system, sans-serif !important; }}
@@ -72,49 +99,49 @@ st.markdown(f"""
 
     /* Layout */
     .block-container {{ padding-top: 0.85rem; padding-bottom: 0rem; max-width: 98%; }}
-    .stApp {{ background-color: {current_theme['bg_app']}; color: {current_theme['text_primary']}; }}
+    .stApp {{ background-color: {theme['bg_app']}; color: {theme['text_primary']}; }}
 
     /* Scrollbar */
     ::-webkit-scrollbar {{ width: 5px; height: 5px; }}
     ::-webkit-scrollbar-track {{ background: transparent; }}
-    ::-webkit-scrollbar-thumb {{ background: {current_theme['border']}; border-radius: 10px; }}
-    ::-webkit-scrollbar-thumb:hover {{ background: {current_theme['accent']}; }}
+    ::-webkit-scrollbar-thumb {{ background: {theme['border']}; border-radius: 10px; }}
+    ::-webkit-scrollbar-thumb:hover {{ background: {theme['accent']}; }}
 
     /* Aktywny przycisk nawigacyjny */
     button[kind="primary"] {{
-        background: linear-gradient(135deg, {current_theme['accent']} 0%, {current_theme['accent']}bb 100%) !important;
+        background: linear-gradient(135deg, {theme['accent']} 0%, {theme['accent']}bb 100%) !important;
         border: none !important;
         color: #ffffff !important;
         font-family: 'Syne', sans-serif !important;
         font-weight: 700 !important;
         letter-spacing: 0.3px !important;
-        box-shadow: 0 4px 20px {current_theme['accent']}45 !important;
+        box-shadow: 0 4px 20px {theme['accent']}45 !important;
         transition: all 0.2s !important;
     }}
     button[kind="primary"]:hover {{
-        box-shadow: 0 6px 28px {current_theme['accent']}65 !important;
+        box-shadow: 0 6px 28px {theme['accent']}65 !important;
         transform: translateY(-1px) !important;
     }}
 
     /* Kontener menu nawigacyjnego */
     div.element-container:has(.nav-marker) + div.element-container > div[data-testid="stHorizontalBlock"] {{
-        background: {current_theme['menu_bg']};
+        background: {theme['menu_bg']};
         padding: 10px 16px;
         border-radius: 16px;
-        border: 1px solid {current_theme['border']};
-        border-bottom: 2px solid {current_theme['accent']};
-        box-shadow: {current_theme['card_shadow']};
+        border: 1px solid {theme['border']};
+        border-bottom: 2px solid {theme['accent']};
+        box-shadow: {theme['card_shadow']};
         margin-bottom: 22px;
     }}
 
     /* Metryki */
     div[data-testid="stMetric"] {{
-        background: {current_theme['bg_metric']};
+        background: {theme['bg_metric']};
         padding: 12px 14px !important;
         border-radius: 12px !important;
-        border: 1px solid {current_theme['border']};
-        color: {current_theme['text_primary']};
-        box-shadow: {current_theme['card_shadow']};
+        border: 1px solid {theme['border']};
+        color: {theme['text_primary']};
+        box-shadow: {theme['card_shadow']};
         transition: transform 0.2s, box-shadow 0.2s;
         position: relative;
         overflow: hidden;
@@ -124,7 +151,7 @@ st.markdown(f"""
         position: absolute;
         top: 0; left: 0; right: 0;
         height: 2px;
-        background: linear-gradient(90deg, {current_theme['accent']}, transparent);
+        background: linear-gradient(90deg, {theme['accent']}, transparent);
         border-radius: 12px 12px 0 0;
     }}
     div[data-testid="stMetric"]:hover {{
@@ -136,7 +163,7 @@ st.markdown(f"""
         font-size: 1.35rem !important;
         font-weight: 500 !important;
         padding-bottom: 0px !important;
-        color: {current_theme['text_primary']} !important;
+        color: {theme['text_primary']} !important;
         letter-spacing: -1px;
     }}
     [data-testid="stMetricLabel"] {{
@@ -144,18 +171,18 @@ st.markdown(f"""
         font-weight: 600 !important;
         text-transform: uppercase;
         letter-spacing: 0.9px;
-        color: {current_theme['text_secondary']} !important;
+        color: {theme['text_secondary']} !important;
     }}
 
     /* Tekst */
-    h1, h2, h3, h4, p, span, div, label {{ color: {current_theme['text_primary']}; }}
-    .stMarkdown p {{ color: {current_theme['text_primary']} !important; }}
+    h1, h2, h3, h4, p, span, div, label {{ color: {theme['text_primary']}; }}
+    .stMarkdown p {{ color: {theme['text_primary']} !important; }}
 
     /* Przyciski */
     div[data-testid="stButton"] button {{
-        border: 1px solid {current_theme['border']};
-        background-color: {current_theme['bg_card']};
-        color: {current_theme['text_primary']};
+        border: 1px solid {theme['border']};
+        background-color: {theme['bg_card']};
+        color: {theme['text_primary']};
         font-weight: 500;
         font-size: 0.84rem;
         letter-spacing: 0.1px;
@@ -164,7 +191,7 @@ st.markdown(f"""
         transition: all 0.18s;
     }}
     div[data-testid="stButton"] button:hover {{
-        border-color: {current_theme['accent']};
+        border-color: {theme['accent']};
         box-shadow: 0 4px 16px rgba(0,0,0,0.18);
         transform: translateY(-1px);
     }}
@@ -178,6 +205,14 @@ st.markdown(f"""
         padding: 0 !important;
     }}
 
+    .st-key-refresh_data button {{
+        border-radius: 50% !important;
+        width: 42px !important;
+        height: 42px !important;
+        margin-left: auto !important;
+        padding: 0 !important;
+    }}
+
     /* Fullscreen na obrazkach */
     [data-testid="stImage"] {{ overflow: visible !important; position: relative !important; }}
     button[title="View fullscreen"] {{
@@ -193,7 +228,7 @@ st.markdown(f"""
     }}
     button[title="View fullscreen"]:hover {{
         background-color: rgba(0,0,0,0.9) !important;
-        border-color: {current_theme['accent']} !important;
+        border-color: {theme['accent']} !important;
         transform: scale(1.05);
     }}
     button[title="View fullscreen"] svg {{ fill: white !important; width: 1.2rem !important; height: 1.2rem !important; }}
@@ -203,11 +238,11 @@ st.markdown(f"""
         height: 80px; width: 100%;
         border-radius: 10px; padding: 6px 8px;
         display: flex; flex-direction: column; justify-content: space-between;
-        border: 1px solid {current_theme['border']};
+        border: 1px solid {theme['border']};
         transition: border-color 0.15s, box-shadow 0.15s;
         box-sizing: border-box;
-        background-color: {current_theme['bg_card']};
-        box-shadow: {current_theme['card_shadow']};
+        background-color: {theme['bg_card']};
+        box-shadow: {theme['card_shadow']};
     }}
     .weekly-summary-title {{
         font-size: 0.6em; text-transform: uppercase;
@@ -219,37 +254,41 @@ st.markdown(f"""
         line-height: 1.2; text-align: center; letter-spacing: -0.5px;
     }}
 
-    /* === CALENDAR CELLS === */
-    /* Ukryj przycisk Streamlit - kliknięcie proxy-owane przez JS z .day-card */
-    div[data-testid="column"]:has(.day-card) div[data-testid="stButton"] {{
-        height: 0 !important;
-        overflow: hidden !important;
-        padding: 0 !important;
-        margin: 0 !important;
+    /* === CALENDAR GRID === */
+    .cal-grid {{
+        display: grid;
+        grid-template-columns: repeat(7, minmax(0, 1fr));
+        gap: 6px;
+    }}
+    .cal-head {{
+        text-align: center; font-weight: 700; font-size: 0.85em;
+        color: {theme['text_secondary']};
     }}
 
     /* Karta dnia - kursor i hover */
-    div[data-testid="column"]:has(.day-card) .day-card {{
+    .cal-grid .day-card[data-date] {{
         cursor: pointer !important;
     }}
-    div[data-testid="column"]:has(.day-card):hover .day-card {{
-        border-color: {current_theme['accent']} !important;
-        box-shadow: 0 0 0 2px {current_theme['accent']}33 !important;
+    .cal-grid .day-card[data-date]:hover {{
+        border-color: {theme['accent']} !important;
+        box-shadow: 0 0 0 2px {theme['accent']}33 !important;
     }}
+    .cal-heatmap rect[data-date] {{ cursor: pointer; }}
+    .cal-heatmap rect[data-date]:hover {{ stroke: {theme['accent']}; stroke-width: 2; }}
 
     div[data-testid="column"] {{ padding: 3px !important; }}
 
     /* Highlight box */
     .highlight-box {{
-        background-color: {'rgba(124,91,246,0.07)' if st.session_state.theme == 'Dark' else '#f8f5ff'};
+        background-color: {'rgba(124,91,246,0.07)' if theme_name == 'Dark' else '#f8f5ff'};
         padding: 12px 14px;
         border-radius: 9px;
-        border-left: 3px solid {current_theme['accent']};
-        border-top: 1px solid {current_theme['border']};
-        border-right: 1px solid {current_theme['border']};
-        border-bottom: 1px solid {current_theme['border']};
+        border-left: 3px solid {theme['accent']};
+        border-top: 1px solid {theme['border']};
+        border-right: 1px solid {theme['border']};
+        border-bottom: 1px solid {theme['border']};
         margin-bottom: 10px;
-        color: {current_theme['text_primary']};
+        color: {theme['text_primary']};
         white-space: pre-wrap;
         font-size: 0.9rem;
         line-height: 1.55;
@@ -257,14 +296,14 @@ st.markdown(f"""
 
     /* Expander */
     .streamlit-expanderHeader {{
-        background-color: {current_theme['bg_card']};
-        color: {current_theme['text_primary']};
+        background-color: {theme['bg_card']};
+        color: {theme['text_primary']};
         border-radius: 10px;
-        border: 1px solid {current_theme['border']};
+        border: 1px solid {theme['border']};
         font-weight: 500;
     }}
     [data-testid="stExpander"] {{
-        border: 1px solid {current_theme['border']} !important;
+        border: 1px solid {theme['border']} !important;
         border-radius: 12px !important;
         overflow: hidden;
     }}
@@ -272,147 +311,2120 @@ st.markdown(f"""
     /* Inputy, selecty */
     div[data-baseweb="select"] > div, div[data-baseweb="input"] > div,
     div[data-baseweb="base-input"], input, textarea, select {{
-        background-color: {current_theme['input_bg']} !important;
-        color: {current_theme['text_primary']} !important;
-        border-color: {current_theme['border']} !important;
+        background-color: {theme['input_bg']} !important;
+        color: {theme['text_primary']} !important;
+        border-color: {theme['border']} !important;
         border-radius: 8px !important;
     }}
     div[data-baseweb="select"] svg, div[data-baseweb="input"] svg {{
-        fill: {current_theme['text_secondary']} !important;
+        fill: {theme['text_secondary']} !important;
     }}
 
     /* Linia podziału */
-    hr {{ border-color: {current_theme['border']} !important; opacity: 0.7; }}
+    hr {{ border-color: {theme['border']} !important; opacity: 0.7; }}
 
     /* Alerty / info boxy */
     div[data-testid="stAlert"] {{ border-radius: 10px !important; }}
-    </style>
-""", unsafe_allow_html=True)
-
-# --- CALENDAR CLICK via JS (img onerror = guaranteed DOM access) ---
-st.markdown("""
-<img src="x" onerror="
-(function(){
-  function bindCards(){
-    document.querySelectorAll('.day-card:not([data-nav])').forEach(function(card){
-      card.setAttribute('data-nav','1');
-      card.addEventListener('click',function(){
-        var col=this.closest('[data-testid=column]');
-        if(!col) return;
-        var btn=col.querySelector('[data-testid=stButton] button');
-        if(btn) btn.click();
-      });
-    });
-  }
-  new MutationObserver(function(){bindCards();}).observe(document.body,{childList:true,subtree:true});
-  [0,100,300,700,1500].forEach(function(t){setTimeout(bindCards,t);});
-})();
-" style="display:none">
-""", unsafe_allow_html=True)
+""")
+
+
+# Arkusz motywu żyje w <head> strony, poza drzewem elementów przebiegu, więc nie musi być wysyłany co rerun
+THEME_JS = """
+export default function(component) {
+    const { data } = component;
+    if (!data.css) return;
+    let style = document.getElementById('journal-theme');
+    if (!style) {
+        style = document.createElement('style');
+        style.id = 'journal-theme';
+        document.head.appendChild(style);
+    }
+    style.textContent = data.css;
+}
+"""
+theme_component = st.components.v2.component("journal_theme", js=THEME_JS)
+
+
+def inject_theme_css(theme_name):
+    # ~6 KB CSS idzie tylko w pierwszym przebiegu sesji (nowa karta = nowa sesja) i po przełączeniu motywu;
+    # w pozostałych rerunach komponent dostaje samą nazwę motywu, a przeglądarka trzyma poprzedni arkusz
+    changed = st.session_state.get('injected_theme') != theme_name
+    st.session_state.injected_theme = theme_name
+    theme_component(data={"theme": theme_name, "css": theme_css(theme_name) if changed else None}, key="theme_css")
+
+
+inject_theme_css(st.session_state.theme)
+
+# --- USTAWIENIA PRZECHOWYWANIA ---
+def storage_setting(name, default):
+    # [journal] w .streamlit/secrets.toml: backend = "gsheets" | "sqlite", sqlite_path, sheets_mirror
+    try:
+        return st.secrets.get("journal", {}).get(name, default)
+    except Exception:
+        return default
+
+
+STORAGE_BACKEND = storage_setting("backend", "gsheets")
+SHEETS_MIRROR = STORAGE_BACKEND == "gsheets" or bool(storage_setting("sheets_mirror", False))
 
 # --- GOOGLE SHEETS CONNECTION ---
-conn = st.connection("gsheets", type=GSheetsConnection)
+conn = st.connection("gsheets", type=GSheetsConnection) if SHEETS_MIRROR else None
 
 
-def load_data_from_gsheets():
+SHEET_COLUMNS = ['trade_id', 'date', 'asset', 'direction', 'time', 'trade_type', 'account_type', 'outcome', 'pnl', 'rr',
+                 'general_notes', 'mood', 'interfered', 'interfered_how', 'htf_desc', 'htf_keypoints',
+                 'htf_links', 'ltf_desc', 'ltf_keypoints', 'ltf_links', 'checklist',
+                 'is_backtest', 'notes', 'model_mistakes', 'mental_mistakes', 'confluences', 'deleted', 'updated_at']
+
+# Kompaktowanie (pełny zapis arkusza) dopiero gdy nagrobków jest dużo
+COMPACT_MIN_TOMBSTONES = 20
+COMPACT_TOMBSTONE_RATIO = 0.2
+
+
+def new_trade_id():
+    return uuid.uuid4().hex
+
+
+def legacy_trade_id(position, row):
+    return hashlib.sha1(f"{position}|{'|'.join(row)}".encode()).hexdigest()[:32]
+
+
+# Wersja wiersza (updated_at): czas UTC z mikrosekundami, porównywalny jako tekst.
+# Format bez myślników i dwukropków, żeby arkusz (USER_ENTERED) nie zamienił go na datę.
+VERSION_FORMAT = '%Y%m%dT%H%M%S.%fZ'
+
+
+def new_version():
+    return datetime.now(timezone.utc).strftime(VERSION_FORMAT)
+
+
+def version_before(version, seconds):
+    # High-water mark cofnięty o zapas (przesunięcie zegarów); nieczytelna wersja = od początku
     try:
-        df = conn.read(ttl=0)
-        df = df.fillna("")
-        if df.empty: return []
-        data = df.to_dict(orient="records")
-        processed_data = []
-        for row in data:
-            if isinstance(row.get('htf_links'), str) and row['htf_links']:
-                row['htf_links'] = row['htf_links'].split('|||')
-            else:
-                row['htf_links'] = []
-            if isinstance(row.get('ltf_links'), str) and row['ltf_links']:
-                row['ltf_links'] = row['ltf_links'].split('|||')
-            else:
-                row['ltf_links'] = []
-            if isinstance(row.get('checklist'), str) and row['checklist']:
-                try:
-                    row['checklist'] = json.loads(row['checklist'])
-                except:
-                    row['checklist'] = [False] * 6
-            else:
-                row['checklist'] = [False] * 6
+        return (datetime.strptime(version, VERSION_FORMAT) - timedelta(seconds=seconds)).strftime(VERSION_FORMAT)
+    except ValueError:
+        return ""
 
-            try:
-                pnl_str = str(row.get('pnl', 0)).replace(',', '.')
-                row['pnl'] = float(pnl_str) if pnl_str else 0.0
-            except:
-                row['pnl'] = 0.0
 
-            try:
-                rr_str = str(row.get('rr', 0)).replace(',', '.')
-                row['rr'] = float(rr_str) if rr_str else 0.0
-            except:
-                row['rr'] = 0.0
+TRUTHY_VALUES = ['true', '1', '1.0', 't', 'y', 'yes']
 
-            row['account_type'] = row.get('account_type') if row.get('account_type') else 'Funded'
 
-            bt_val = row.get('is_backtest', False)
-            if isinstance(bt_val, str):
-                row['is_backtest'] = bt_val.strip().lower() in ['true', '1', '1.0', 't', 'y', 'yes']
-            else:
-                row['is_backtest'] = bool(bt_val)
+def is_truthy(val):
+    if isinstance(val, str):
+        return val.strip().lower() in TRUTHY_VALUES
+    return bool(val)
 
-            row['notes'] = row.get('notes', "")
-            row['model_mistakes'] = row.get('model_mistakes', "")
-            row['mental_mistakes'] = row.get('mental_mistakes', "")
 
-            if isinstance(row.get('confluences'), str) and row.get('confluences'):
-                try:
-                    row['confluences'] = json.loads(row['confluences'])
-                except:
-                    row['confluences'] = []
-            else:
-                if not isinstance(row.get('confluences'), list):
-                    row['confluences'] = []
+# --- MODEL TRANSAKCJI ---
+class TradeEnum(str, Enum):
+    # Jak StrEnum (dopiero Python 3.11): str() i f-stringi dają samą wartość, np. do arkusza i etykiet UI
+    def __str__(self):
+        return self.value
 
-            if row.get('date'): row['date'] = str(row['date'])
-            processed_data.append(row)
-        return processed_data
-    except Exception as e:
+
+class Direction(TradeEnum):
+    LONG = "Long"
+    SHORT = "Short"
+    BOTH = "Both"
+    NO_TRADE = "No Trade"
+
+
+class Outcome(TradeEnum):
+    WIN = "Win"
+    LOSS = "Loss"
+    BREAKEVEN = "Breakeven"
+    NO_TRADE = "No Trade"
+
+
+class AccountType(TradeEnum):
+    FUNDED = "Funded"
+    EVALUATION = "Evaluation"
+    BACKTESTING = "Backtesting"
+
+
+# Stare pola formularza - prawie zawsze puste, więc trzymane poza głównym rekordem (Trade.legacy)
+LEGACY_FIELDS = ('general_notes', 'mood', 'interfered', 'interfered_how', 'htf_desc', 'htf_keypoints',
+                 'ltf_desc', 'ltf_keypoints')
+LEGACY_DEFAULTS = {'interfered': "No"}
+
+
+def parse_number(val):
+    if isinstance(val, (int, float)) and not isinstance(val, bool):
+        return float(val)
+    text = str(val).strip().replace(',', '.')
+    return float(text) if text else 0.0
+
+
+def parse_date(val):
+    if isinstance(val, datetime):
+        return val.date()
+    if isinstance(val, date):
+        return val
+    try:
+        return date.fromisoformat(str(val).strip()[:10])
+    except ValueError:
+        return None
+
+
+def parse_enum(enum_cls, val, default):
+    if val is None or str(val).strip() == "":
+        return default
+    try:
+        return enum_cls(str(val).strip())
+    except ValueError:
+        # Nieznana wartość zostaje dosłownie, żeby zapis zwrotny niczego nie zgubił
+        return str(val)
+
+
+def decode_links(raw):
+    return raw.split('|||') if raw else []
+
+
+def decode_json_list(raw):
+    try:
+        parsed = json.loads(raw) if raw else []
+    except ValueError:
         return []
+    return parsed if isinstance(parsed, list) else []
+
+
+# Pola trzymane jako surowy tekst z arkusza i dekodowane dopiero przy pierwszym odczycie (np. szczegóły transakcji)
+LAZY_DECODERS = {'htf_links': decode_links, 'ltf_links': decode_links,
+                 'checklist': lambda raw: decode_json_list(raw) or [False] * 6,
+                 'confluences': decode_json_list}
+
+
+def lazy_value(val):
+    return val if isinstance(val, (list, str)) else ""
+
+
+@dataclass(slots=True)
+class Trade:
+    # Typowany rekord transakcji; t['pnl'] / t.get('notes') działają jak na dawnym dict-cie
+    trade_id: str
+    date: date | None
+    asset: str = ""
+    direction: Direction | str = Direction.LONG
+    time: str = ""
+    trade_type: str = ""
+    account_type: AccountType | str = AccountType.FUNDED
+    outcome: Outcome | str = Outcome.WIN
+    pnl: float = 0.0
+    rr: float = 0.0
+    is_backtest: bool = False
+    notes: str = ""
+    model_mistakes: str = ""
+    mental_mistakes: str = ""
+    htf_links: list | str = ""  # str = jeszcze nie zdekodowane (LAZY_DECODERS)
+    ltf_links: list | str = ""
+    checklist: list | str = ""
+    confluences: list | str = ""
+    updated_at: str = ""  # wersja wiersza w źródle (new_version); "" = wiersz sprzed wersjonowania
+    has_notes: bool = False
+    legacy: dict | None = None
+
+    @classmethod
+    def from_row(cls, row):
+        # Jedyne miejsce walidacji schematu: wiersz z arkusza, SQLite albo formularza -> Trade
+        legacy = {k: str(row[k]) for k in LEGACY_FIELDS
+                  if row.get(k) not in (None, "") and str(row[k]) != LEGACY_DEFAULTS.get(k)}
+        try:
+            pnl = parse_number(row.get('pnl', 0))
+        except ValueError:
+            pnl = 0.0
+        try:
+            rr = parse_number(row.get('rr', 0))
+        except ValueError:
+            rr = 0.0
+        return cls(
+            trade_id=str(row.get('trade_id') or ""),
+            date=parse_date(row.get('date', "")),
+            asset=str(row.get('asset', "")),
+            direction=parse_enum(Direction, row.get('direction'), Direction.LONG),
+            time=str(row.get('time', "")),
+            trade_type=str(row.get('trade_type', "")),
+            account_type=parse_enum(AccountType, row.get('account_type'), AccountType.FUNDED),
+            outcome=parse_enum(Outcome, row.get('outcome'), Outcome.WIN),
+            pnl=pnl,
+            rr=rr,
+            is_backtest=is_truthy(row.get('is_backtest', False)),
+            notes=str(row.get('notes', "")),
+            model_mistakes=str(row.get('model_mistakes', "")),
+            mental_mistakes=str(row.get('mental_mistakes', "")),
+            htf_links=lazy_value(row.get('htf_links')),
+            ltf_links=lazy_value(row.get('ltf_links')),
+            checklist=lazy_value(row.get('checklist')),
+            confluences=lazy_value(row.get('confluences')),
+            updated_at=str(row.get('updated_at') or ""),
+            legacy=legacy or None,
+        )
+
+    def __getitem__(self, key):
+        if key in LEGACY_FIELDS:
+            return (self.legacy or {}).get(key, LEGACY_DEFAULTS.get(key, ""))
+        if key in LAZY_DECODERS:
+            value = getattr(self, key)
+            if isinstance(value, str):
+                value = LAZY_DECODERS[key](value)
+                setattr(self, key, value)
+            return value
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key) from None
+
+    def __setitem__(self, key, value):
+        if key in LEGACY_FIELDS:
+            if self.legacy is None:
+                self.legacy = {}
+            self.legacy[key] = value
+        else:
+            setattr(self, key, value)
+
+    def __contains__(self, key):
+        return key in LEGACY_FIELDS or key in TRADE_FIELDS
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def copy(self):
+        lazy = {k: v if isinstance(v, str) else list(v) for k, v in ((k, getattr(self, k)) for k in LAZY_DECODERS)}
+        return replace(self, legacy=dict(self.legacy) if self.legacy else None, **lazy)
+
+
+TRADE_FIELDS = frozenset(f.name for f in fields(Trade))
+DIRECTION_OPTIONS = [d.value for d in Direction]
+OUTCOME_OPTIONS = [o.value for o in Outcome]
+ASSET_OPTIONS = ["NQ", "MNQ", "ES", "MES", "XAUUSD"]
+
+
+def option_index(options, value):
+    # Wartość spoza listy (np. stary wpis z arkusza) nie wywraca formularza
+    return options.index(value) if value in options else 0
+
+
+def as_trade(trade):
+    return trade if isinstance(trade, Trade) else Trade.from_row(trade)
+
+
+# --- PARSOWANIE KOLUMNOWE (arkusz / SQLite -> Trade) ---
+ENUM_COLUMNS = {'direction': (Direction, Direction.LONG), 'account_type': (AccountType, AccountType.FUNDED),
+                'outcome': (Outcome, Outcome.WIN)}
+MAX_LOAD_WARNINGS = 200
+
+
+def _text_column(df, col):
+    if col not in df.columns:
+        return pd.Series("", index=df.index, dtype=object)
+    return df[col].astype(str).str.strip()
+
+
+def _report(warnings, col, raw, bad, problem):
+    for pos, value in raw[bad].items():
+        if len(warnings) >= MAX_LOAD_WARNINGS:
+            return
+        warnings.append(f"Wiersz {pos + 2}, {col}: {value!r} - {problem}")
+
+
+def _number_column(df, col, warnings):
+    raw = _text_column(df, col).str.replace(',', '.', regex=False)
+    values = pd.to_numeric(raw, errors='coerce')
+    _report(warnings, col, raw, values.isna() & (raw != ""), "nie jest liczbą, przyjęto 0")
+    return values.fillna(0.0).astype(float)
+
+
+def _enum_column(df, col):
+    enum_cls, default = ENUM_COLUMNS[col]
+    raw = _text_column(df, col)
+    lookup = {m.value: m for m in enum_cls}
+    lookup[""] = default
+    # Nieznane wartości zostają dosłownie (jak w Trade.from_row); lista, bo Series zamieniłaby członków enuma na str
+    return [lookup.get(value, value) for value in raw.tolist()]
+
+
+def trades_from_frame(df, warnings):
+    # Cała ramka parsowana kolumnami (pandas) zamiast wiersz po wierszu; indeks ramki = pozycja wiersza w źródle.
+    # Pola JSON / linki zostają surowym tekstem i są dekodowane dopiero przy pierwszym odczycie (Trade.__getitem__).
+    raw_dates = _text_column(df, 'date')
+    dates = pd.to_datetime(raw_dates.str.slice(0, 10), format='%Y-%m-%d', errors='coerce')
+    _report(warnings, 'date', raw_dates, dates.isna() & (raw_dates != ""), "nieprawidłowa data")
+    date_values = dates.dt.date.astype(object).where(dates.notna(), None)
+
+    lazy = {}
+    for col in LAZY_DECODERS:
+        raw = _text_column(df, col)
+        if col in ('checklist', 'confluences'):
+            # Tani test struktury zamiast json.loads dla każdego wiersza
+            bad = (raw != "") & ~(raw.str.startswith('[') & raw.str.endswith(']'))
+            _report(warnings, col, raw, bad, "to nie jest lista JSON, pominięto")
+            raw = raw.where(~bad, "")
+        lazy[col] = raw
+
+    legacy = [None] * len(df)
+    legacy_cols = [c for c in LEGACY_FIELDS if c in df.columns]
+    if legacy_cols:
+        legacy_text = df[legacy_cols].astype(str).apply(lambda s: s.str.strip())
+        filled = (legacy_text != "") & (legacy_text != pd.Series(LEGACY_DEFAULTS).reindex(legacy_cols).fillna(""))
+        for pos in np.flatnonzero(filled.any(axis=1).to_numpy()):
+            row_filled = filled.iloc[pos]
+            legacy[pos] = legacy_text.iloc[pos][row_filled].to_dict()
+
+    columns = [
+        _text_column(df, 'trade_id'), date_values, _text_column(df, 'asset'), _enum_column(df, 'direction'),
+        _text_column(df, 'time'), _text_column(df, 'trade_type'), _enum_column(df, 'account_type'),
+        _enum_column(df, 'outcome'), _number_column(df, 'pnl', warnings), _number_column(df, 'rr', warnings),
+        _text_column(df, 'is_backtest').str.lower().isin(TRUTHY_VALUES), _text_column(df, 'notes'),
+        _text_column(df, 'model_mistakes'), _text_column(df, 'mental_mistakes'),
+        lazy['htf_links'], lazy['ltf_links'], lazy['checklist'], lazy['confluences'], _text_column(df, 'updated_at'),
+    ]
+    columns = [c if isinstance(c, list) else c.tolist() for c in columns]
+    return [Trade(*values, False, leg) for values, leg in zip(zip(*columns), legacy)]
+
+
+def empty_sheet_meta():
+    # Metadane arkusza potrzebne do zapisu przyrostowego (pozycja i wersja wiersza per trade_id, nagrobki,
+    # zgodność nagłówka); version = najnowsze updated_at w arkuszu
+    return {"rows": 0, "tombstones": 0, "schema_ok": False, "row_of": {}, "version_of": {}, "version": "",
+            "warnings": []}
+
+
+def load_data_from_gsheets():
+    # Błąd odczytu leci dalej (load_with_retry) - pusta lista wyglądałaby jak pusty dziennik
+    meta = empty_sheet_meta()
+    df = conn.read(ttl=0)
+    df = df.fillna("")
+    meta["rows"] = len(df)
+    meta["schema_ok"] = list(df.columns) == SHEET_COLUMNS
+    if df.empty: return [], meta
+    df = df.reset_index(drop=True)
+    deleted = _text_column(df, 'deleted').str.lower().isin(TRUTHY_VALUES)
+    meta["tombstones"] = int(deleted.sum())
+    meta["version"] = _text_column(df, 'updated_at').max()
+    df = df[~deleted]
+    ids = _text_column(df, 'trade_id')
+    missing = ids == ""
+    if missing.any():
+        # Stare wiersze bez ID dostają ID z pozycji i treści wiersza - każdy odczyt da te same, więc zmiany sesji
+        # pasują do wierszy ze świeżego odczytu; pełny zapis przy najbliższej zmianie utrwali je w arkuszu
+        ids[missing] = [legacy_trade_id(pos, row) for pos, row in df[missing].astype(str).iterrows()]
+        df = df.assign(trade_id=ids)
+        meta["schema_ok"] = False
+    trades = trades_from_frame(df, meta["warnings"])
+    meta["row_of"] = {t.trade_id: sheet_row for t, sheet_row in zip(trades, df.index)}
+    meta["version_of"] = {t.trade_id: t.updated_at for t in trades}
+    return trades, meta
+
+
+# --- WYNIK ODCZYTU (dane + diagnostyka) ---
+LOAD_RETRIES = 3
+LOAD_RETRY_DELAY = 0.5  # s; kolejne próby po 0.5 s i 1 s
+
+
+@dataclass
+class LoadResult:
+    trades: list = field(default_factory=list)
+    warnings: list = field(default_factory=list)
+    latency: float = 0.0  # s, łącznie z ponowieniami
+    attempts: int = 0
+    error: str | None = None
+
+    @property
+    def ok(self):
+        return self.error is None
+
+
+def load_with_retry(read):
+    # read() -> (trades, warnings); błędy przejściowe ponawiamy z wykładniczym opóźnieniem
+    started = time.time()
+    error = None
+    for attempt in range(1, LOAD_RETRIES + 1):
+        try:
+            trades, warnings = read()
+            return LoadResult(trades, warnings, time.time() - started, attempt)
+        except Exception as e:
+            error = str(e) or type(e).__name__
+            if attempt < LOAD_RETRIES:
+                time.sleep(LOAD_RETRY_DELAY * 2 ** (attempt - 1))
+    return LoadResult([], [], time.time() - started, LOAD_RETRIES, error)
+
+
+def serialize_trade(trade, deleted=False):
+    # Kolejność kluczy = kolejność kolumn arkusza (_sheet_values zapisuje wartości pozycyjnie)
+    new_row = {col: getattr(trade, col) if col in LAZY_DECODERS else trade.get(col, "") for col in SHEET_COLUMNS}
+    new_row['date'] = trade['date'].isoformat() if trade['date'] else ""
+    for col in ('direction', 'account_type', 'outcome'):
+        new_row[col] = str(new_row[col])
+    for col in LAZY_DECODERS:
+        value = getattr(trade, col)
+        # Pole, którego nikt nie odczytał, wraca do arkusza w niezmienionej postaci
+        if not isinstance(value, str):
+            value = "|||".join(value) if col.endswith('_links') else json.dumps(value)
+        new_row[col] = value
+    new_row['is_backtest'] = bool(new_row['is_backtest'])
+    new_row['deleted'] = deleted
+    return new_row
 
 
 def save_all_data(data):
-    columns = ['date', 'asset', 'direction', 'time', 'trade_type', 'account_type', 'outcome', 'pnl', 'rr',
-               'general_notes', 'mood', 'interfered', 'interfered_how', 'htf_desc', 'htf_keypoints',
-               'htf_links', 'ltf_desc', 'ltf_keypoints', 'ltf_links', 'checklist',
-               'is_backtest', 'notes', 'model_mistakes', 'mental_mistakes', 'confluences']
     if not data:
-        df = pd.DataFrame(columns=columns)
-        conn.update(data=df)
-        return
-    data_to_save = []
-    for row in data:
-        new_row = row.copy()
-        new_row['htf_links'] = "|||".join(row.get('htf_links', []))
-        new_row['ltf_links'] = "|||".join(row.get('ltf_links', []))
-        new_row['checklist'] = json.dumps(row.get('checklist', [False] * 6))
-        new_row['confluences'] = json.dumps(row.get('confluences', []))
-
-        for col in columns:
-            if col not in new_row:
-                new_row[col] = "" if col not in ['is_backtest', 'confluences', 'checklist', 'htf_links',
-                                                 'ltf_links'] else False if col == 'is_backtest' else []
-
-        new_row['is_backtest'] = bool(new_row.get('is_backtest', False))
-        data_to_save.append(new_row)
-
-    df = pd.DataFrame(data_to_save)
-    df = df[columns]
+        df = pd.DataFrame(columns=SHEET_COLUMNS)
+    else:
+        df = pd.DataFrame([serialize_trade(row) for row in data], columns=SHEET_COLUMNS)
     conn.update(data=df)
+    # Po pełnym zapisie arkusz jest zwarty: pozycje wierszy = kolejność listy, brak nagrobków
+    meta = empty_sheet_meta()
+    meta.update(rows=len(data), schema_ok=True, row_of={row['trade_id']: i for i, row in enumerate(data)},
+                version_of={row['trade_id']: row.get('updated_at', "") for row in data},
+                version=max((row.get('updated_at', "") for row in data), default=""))
+    return meta
+
+
+# --- KONTROLA WERSJI (optimistic concurrency) ---
+def check_versions(op, trades, bases, versions):
+    # Zmiana przechodzi tylko, gdy wiersz w źródle ma wersję, na której ją oparto (bases: trade_id -> updated_at,
+    # None = nowa transakcja). Zmiany innych wierszy z innego urządzenia nie przeszkadzają; ten sam wiersz = konflikt.
+    # bases=None wyłącza kontrolę (lustro powtarza tylko zapis, który już przeszedł w głównym backendzie).
+    if bases is None:
+        return list(trades), []
+    accepted, conflicts = [], []
+    for t in trades:
+        current = versions.get(t.trade_id)
+        if op == 'delete':
+            if current is None:
+                continue  # usunięta także w źródle
+        elif t.updated_at and current == t.updated_at:
+            continue  # ponowienie zapisu, który już doszedł
+        if current == bases.get(t.trade_id) and (op == 'insert' or current is not None):
+            accepted.append(t)
+        else:
+            conflicts.append(t.trade_id)
+    return accepted, conflicts
+
+
+def merge_changes(trades, op, changed):
+    # Zmiany nakładane na świeżo odczytany stan źródła - pełny zapis nie gubi wierszy dopisanych gdzie indziej
+    by_id = {t.trade_id: t for t in trades}
+    for t in changed:
+        if op == 'delete':
+            by_id.pop(t.trade_id, None)
+        else:
+            by_id[t.trade_id] = t
+    return list(by_id.values())
+
+
+# --- ZAPIS PRZYROSTOWY (append / patch / tombstone) ---
+def _get_worksheet():
+    # Zapis po wierszach wymaga klienta Service Account (gspread); publiczny arkusz obsługuje tylko pełny update
+    try:
+        return conn.client._select_worksheet()
+    except Exception:
+        return None
+
+
+def _column_letter(index):
+    letters = ""
+    index += 1
+    while index:
+        index, rem = divmod(index - 1, 26)
+        letters = chr(ord('A') + rem) + letters
+    return letters
+
+
+def _column_range(col):
+    letter = _column_letter(SHEET_COLUMNS.index(col))
+    return f"{letter}2:{letter}"
+
+
+SHEET_LAST_COLUMN = _column_letter(len(SHEET_COLUMNS) - 1)
+# Surowe wartości zamiast sformatowanych (locale arkusza: "100,5", "1 234,00 zł"); daty jako tekst, nie numer seryjny
+SHEET_RENDER_OPTIONS = dict(value_render_option="UNFORMATTED_VALUE", date_time_render_option="FORMATTED_STRING")
+
+
+def _sheet_cell(value):
+    # USER_ENTERED jak w gspread_dataframe._cellrepr: '=...' nie może zostać formułą, a wiodący apostrof
+    # (zjadany przez Sheets) trzeba podwoić, żeby tekst wrócił z arkusza bez zmian
+    if isinstance(value, str) and value.startswith(("=", "'")):
+        return "'" + value
+    return value
+
+
+def _sheet_values(row, deleted=False):
+    return [_sheet_cell(value) for value in serialize_trade(row, deleted).values()]
 
 
-if 'all_trades' not in st.session_state:
+def _row_blocks(positions):
+    # Sąsiednie wiersze łączymy w jeden zakres
+    blocks = []
+    for pos in sorted(positions):
+        if blocks and pos == blocks[-1][-1] + 1:
+            blocks[-1].append(pos)
+        else:
+            blocks.append([pos])
+    return blocks
+
+
+def _patch_rows(ws, trades, row_of, deleted=False):
+    # Wszystkie zakresy idą jednym batch_update
+    by_row = {row_of[t['trade_id']]: t for t in trades}
+    ws.batch_update([{"range": f"A{blk[0] + 2}", "values": [_sheet_values(by_row[pos], deleted) for pos in blk]}
+                     for blk in _row_blocks(by_row)], value_input_option="USER_ENTERED")
+
+
+def read_sheet_versions(ws):
+    # Kontrola wersji przed każdym zapisem: nagłówek + kolumny trade_id / deleted / updated_at zamiast całego arkusza.
+    # Pozycje wierszy też są świeże - inne urządzenie mogło w międzyczasie dopisać wiersze albo skompaktować arkusz.
+    header, *columns = ws.batch_get(["1:1"] + [_column_range(c) for c in ('trade_id', 'deleted', 'updated_at')],
+                                    **SHEET_RENDER_OPTIONS)
+    meta = empty_sheet_meta()
+    meta["schema_ok"] = bool(header) and list(header[0]) == SHEET_COLUMNS
+    if not meta["schema_ok"]:
+        return meta
+    meta["rows"] = max(map(len, columns))
+    ids, deleted, versions = ([str(row[0]) if row else "" for row in col] + [""] * (meta["rows"] - len(col))
+                              for col in columns)
+    for pos, (trade_id, is_deleted, version) in enumerate(zip(ids, deleted, versions)):
+        meta["version"] = max(meta["version"], version)
+        if is_truthy(is_deleted):
+            meta["tombstones"] += 1
+        elif trade_id:
+            meta["row_of"][trade_id] = pos
+            meta["version_of"][trade_id] = version
+        else:
+            meta["schema_ok"] = False  # wiersz bez ID - uzupełni go dopiero pełny odczyt i zapis
+    return meta
+
+
+def fetch_sheet_rows(ws, positions, warnings):
+    # Tylko wskazane wiersze (jedno batch_get), parsowane tym samym kodem co pełny odczyt;
+    # indeks ramki = pozycja w arkuszu, więc ostrzeżenia wskazują właściwe wiersze
+    blocks = _row_blocks(positions)
+    if not blocks:
+        return []
+    values = ws.batch_get([f"A{blk[0] + 2}:{SHEET_LAST_COLUMN}{blk[-1] + 2}" for blk in blocks],
+                          **SHEET_RENDER_OPTIONS)
+    rows = [list(row) + [""] * (len(SHEET_COLUMNS) - len(row)) for block in values for row in block]
+    index = [pos for blk, block in zip(blocks, values) for pos in blk[:len(block)]]
+    return trades_from_frame(pd.DataFrame(rows, columns=SHEET_COLUMNS, index=index).fillna(""), warnings)
+
+
+class SheetsRepository:
+    # Google Sheets: nowe wiersze dopisywane, edycje patchowane, usunięcia jako nagrobki (kolumna 'deleted').
+    # Każdy zapis zaczyna się od kontroli wersji; wiersze w konflikcie nie są zapisywane, tylko zwracane.
+    # Pełny zapis (kompaktowanie, brak klienta gspread, stary nagłówek) zawsze na świeżo odczytanym arkuszu.
+    # Jeden obiekt na proces - zapisy z sesji i z wątku zapisu serializuje lock.
+    name = "gsheets"
+
+    def __init__(self):
+        self.meta = None
+        self.last_load = None
+        self.lock = threading.RLock()
+
+    def _read(self):
+        trades, self.meta = load_data_from_gsheets()
+        return trades, self.meta['warnings']
+
+    def load(self):
+        with self.lock:
+            self.last_load = load_with_retry(self._read)
+        return self.last_load
+
+    def save_all(self, trades):
+        with self.lock:
+            self.meta = save_all_data(trades)
+
+    def _sync(self):
+        ws = _get_worksheet()
+        try:
+            self.meta = read_sheet_versions(ws) if ws is not None else None
+        except Exception:
+            # Np. arkusz sprzed kolumny updated_at (zakres poza siatką) - zostaje pełny odczyt
+            self.meta = None
+        return ws if self.meta is not None and self.meta['schema_ok'] else None
+
+    def _needs_rewrite(self, op, trades):
+        if op == 'update':
+            # Lustro (bez kontroli wersji) może patchować wiersz, którego w arkuszu jeszcze nie ma
+            return any(t.trade_id not in self.meta['row_of'] for t in trades)
+        if op == 'delete':
+            tombstones = self.meta['tombstones'] + len(trades)
+            return tombstones >= max(COMPACT_MIN_TOMBSTONES, COMPACT_TOMBSTONE_RATIO * self.meta['rows'])
+        return False
+
+    def write(self, op, trades, bases=None):
+        # -> {trade_id: aktualna wersja w arkuszu (None = usunięta)} dla zmian odrzuconych przez kontrolę wersji
+        with self.lock:
+            ws = self._sync()
+            remote = None
+            if ws is None:
+                remote, self.meta = load_data_from_gsheets()
+            trades, conflicts = check_versions(op, trades, bases, self.meta['version_of'])
+            if remote is None and trades and self._needs_rewrite(op, trades):
+                remote, self.meta = load_data_from_gsheets()
+            if remote is not None:
+                if trades:
+                    self.meta = save_all_data(merge_changes(remote, op, trades))
+            elif op == 'insert':
+                ws.append_rows([_sheet_values(t) for t in trades], value_input_option="USER_ENTERED")
+            elif trades:
+                _patch_rows(ws, trades, self.meta['row_of'], deleted=op == 'delete')
+            return self._theirs(ws, remote, conflicts)
+
+    def _theirs(self, ws, remote, conflicts):
+        if not conflicts:
+            return {}
+        if remote is None:
+            row_of = self.meta['row_of']
+            remote = fetch_sheet_rows(ws, [row_of[tid] for tid in conflicts if tid in row_of], self.meta['warnings'])
+        by_id = {t.trade_id: t for t in remote}
+        return {tid: by_id.get(tid) for tid in conflicts}
+
+    def changes_since(self, version):
+        # Wiersze z updated_at > version i zbiór żywych id (usunięcia = brakujące id).
+        # Czytane są 3 kolumny i tylko zmienione wiersze; None = arkusz wymaga pełnego odczytu.
+        with self.lock:
+            ws = self._sync()
+            if ws is None:
+                return None
+            row_of, versions = self.meta['row_of'], self.meta['version_of']
+            changed = fetch_sheet_rows(ws, [row_of[tid] for tid, v in versions.items() if v > version],
+                                       self.meta['warnings'])
+            return changed, set(versions), self.meta['version']
+
+
+# --- LOKALNA BAZA SQLITE ---
+SQL_COLUMNS = [c for c in SHEET_COLUMNS if c != 'deleted']
+SQL_TYPES = {'trade_id': "TEXT PRIMARY KEY", 'date': "TEXT NOT NULL", 'pnl': "REAL", 'rr': "REAL",
+             'is_backtest': "INTEGER NOT NULL DEFAULT 0", 'updated_at': "TEXT NOT NULL DEFAULT ''"}
+SQL_INSERT = f"INSERT INTO trades ({', '.join(SQL_COLUMNS)}) VALUES ({', '.join('?' * len(SQL_COLUMNS))})"
+SQL_CHUNK = 500  # id na jedno zapytanie IN (...)
+
+
+def sql_in_chunks(trade_ids):
+    # -> (kawałek id, "?, ?, ...") - IN (...) po SQL_CHUNK, poniżej limitu parametrów jednego zapytania SQLite
+    for i in range(0, len(trade_ids), SQL_CHUNK):
+        chunk = trade_ids[i:i + SQL_CHUNK]
+        yield chunk, ', '.join('?' * len(chunk))
+
+
+def _sqlite_connection(path):
+    db = sqlite3.connect(path, check_same_thread=False)
+    db.row_factory = sqlite3.Row
+    db.execute("PRAGMA journal_mode=WAL")
+    column_defs = ', '.join(f"{c} {SQL_TYPES.get(c, 'TEXT')}" for c in SQL_COLUMNS)
+    db.execute(f"CREATE TABLE IF NOT EXISTS trades ({column_defs})")
+    existing = {row[1] for row in db.execute("PRAGMA table_info(trades)")}
+    for c in SQL_COLUMNS:
+        if c not in existing:
+            # Baza sprzed nowej kolumny (np. updated_at) - migracja w miejscu
+            db.execute(f"ALTER TABLE trades ADD COLUMN {c} {SQL_TYPES.get(c, 'TEXT')}")
+    db.execute("CREATE INDEX IF NOT EXISTS idx_trades_date ON trades(date)")
+    db.execute("CREATE INDEX IF NOT EXISTS idx_trades_bt_acc_date ON trades(is_backtest, account_type, date)")
+    db.execute("CREATE INDEX IF NOT EXISTS idx_trades_updated_at ON trades(updated_at)")
+    db.commit()
+    return db
+
+
+class SQLiteRepository:
+    # Lokalna baza z indeksami i zapisem po wierszach; arkusz (mirror) opcjonalnie dostaje te same zmiany.
+    # Kontrola wersji i zapis idą w jednej transakcji z blokadą zapisu (BEGIN IMMEDIATE), więc dwie karty / procesy
+    # nie nadpiszą sobie wiersza.
+    name = "sqlite"
+
+    def __init__(self, path, mirror=None):
+        self.db = _sqlite_connection(path)
+        self.lock = threading.Lock()
+        self.mirror = mirror
+        self.mirror_stale = False
+        self.last_load = None
+
+    def _values(self, trade):
+        row = serialize_trade(trade)
+        row['is_backtest'] = int(row['is_backtest'])
+        return [row[c] for c in SQL_COLUMNS]
+
+    def _select(self, where="", params=()):
+        df = pd.read_sql_query(f"SELECT * FROM trades {where} ORDER BY rowid", self.db, params=params)
+        warnings = []
+        return trades_from_frame(df.fillna(""), warnings), warnings
+
+    def _read(self):
+        with self.lock:
+            return self._select()
+
+    def load(self):
+        result = load_with_retry(self._read)
+        if result.ok and not result.trades and self.mirror is not None:
+            # Pierwsze uruchomienie: import istniejącego dziennika z arkusza
+            result = self.mirror.load()
+            if result.ok and result.trades:
+                self._replace(result.trades)
+        self.last_load = result
+        return result
+
+    def _replace(self, trades):
+        with self.lock, self.db:
+            self.db.execute("DELETE FROM trades")
+            self.db.executemany(SQL_INSERT, [self._values(t) for t in trades])
+
+    def _mirror(self, op, trades):
+        if self.mirror is None or not trades:
+            return
+        try:
+            if self.mirror_stale:
+                # Lokalna baza jest źródłem prawdy; po wcześniejszym błędzie arkusz wyrównujemy pełnym zapisem
+                self.mirror.save_all(self._read()[0])
+                self.mirror_stale = False
+            else:
+                self.mirror.write(op, trades, None)
+        except Exception:
+            self.mirror_stale = True
+
+    def _versions(self, trade_ids):
+        versions = {}
+        for chunk, marks in sql_in_chunks(trade_ids):
+            rows = self.db.execute(f"SELECT trade_id, updated_at FROM trades WHERE trade_id IN ({marks})", chunk)
+            versions.update((row[0], row[1]) for row in rows)
+        return versions
+
+    def write(self, op, trades, bases=None):
+        # -> {trade_id: aktualna wersja w bazie (None = usunięta)} dla zmian odrzuconych przez kontrolę wersji
+        with self.lock, self.db:
+            # sqlite3 sam otwiera transakcję dopiero przy pierwszym INSERT/UPDATE/DELETE - bez jawnego BEGIN IMMEDIATE
+            # inny proces mógłby zapisać wiersz między odczytem wersji a naszym zapisem
+            self.db.execute("BEGIN IMMEDIATE")
+            trades, conflicts = check_versions(op, trades, bases, self._versions([t.trade_id for t in trades]))
+            if op == 'insert':
+                self.db.executemany(SQL_INSERT, [self._values(t) for t in trades])
+            elif op == 'update':
+                assignments = ', '.join(f"{c} = ?" for c in SQL_COLUMNS[1:])
+                self.db.executemany(f"UPDATE trades SET {assignments} WHERE trade_id = ?",
+                                    [self._values(t)[1:] + [t['trade_id']] for t in trades])
+            else:
+                self.db.executemany("DELETE FROM trades WHERE trade_id = ?", [(t['trade_id'],) for t in trades])
+            by_id = {}
+            for chunk, marks in sql_in_chunks(conflicts):
+                by_id.update((t.trade_id, t) for t in self._select(f"WHERE trade_id IN ({marks})", chunk)[0])
+            theirs = {tid: by_id.get(tid) for tid in conflicts}
+        self._mirror(op, trades)
+        return theirs
+
+    def changes_since(self, version):
+        # Wiersze z updated_at > version (indeks idx_trades_updated_at) i zbiór żywych id
+        with self.lock:
+            changed = self._select("WHERE updated_at > ?", (version,))[0]
+            live = {row[0] for row in self.db.execute("SELECT trade_id FROM trades")}
+            latest = self.db.execute("SELECT MAX(updated_at) FROM trades").fetchone()[0] or ""
+        return changed, live, latest
+
+
+@st.cache_resource
+def get_repository():
+    if STORAGE_BACKEND == "sqlite":
+        return SQLiteRepository(storage_setting("sqlite_path", "journal.db"),
+                                mirror=SheetsRepository() if SHEETS_MIRROR else None)
+    return SheetsRepository()
+
+
+# --- KOLEJKA ZAPISU W TLE (write-behind) ---
+WRITE_DEBOUNCE = 0.5  # s; seria szybkich zmian trafia do backendu jednym przebiegiem
+WRITE_MAX_BACKOFF = 60  # s
+
+
+def coalesce_op(prev, op):
+    # insert+update -> insert, insert+delete -> nic do zapisania, update+(update|delete) -> nowsza operacja
+    if prev is None:
+        return op
+    if prev == 'insert':
+        return None if op == 'delete' else 'insert'
+    return op
+
+
+class WriteQueue:
+    # Kolejka żyje w procesie (cache_resource), więc rerun sesji w trakcie zapisu niczego nie gubi
+    def __init__(self, repo):
+        self.repo = repo
+        self.pending = {}  # trade_id -> (op, trade, store, base); base = updated_at, na którym oparto zmianę
+        self.conflicts = {}  # trade_id -> (op, moja wersja, wersja w źródle | None, store)
+        self.in_flight = 0
+        self.failures = 0
+        self.last_error = None
+        self.listeners = []  # wywoływane (w wątku zapisu) po każdym udanym przebiegu
+        self.cond = threading.Condition()
+        self.thread = threading.Thread(target=self._run, name="journal-write-behind", daemon=True)
+        self.thread.start()
+
+    def submit(self, op, trades, store, bases=None):
+        bases = bases or {}
+        with self.cond:
+            self._merge(self.pending, [(t['trade_id'], (op, t, store, bases.get(t['trade_id']))) for t in trades])
+            self.cond.notify_all()
+
+    @staticmethod
+    def _merge(target, items):
+        for trade_id, (op, trade, store, base) in items:
+            prev = target.get(trade_id)
+            merged = coalesce_op(prev[0] if prev else None, op)
+            if merged is None:
+                target.pop(trade_id, None)
+            else:
+                # Bazą zostaje wersja z pierwszej niezapisanej zmiany - tylko ją zna źródło
+                target[trade_id] = (merged, trade, store, prev[3] if prev else base)
+
+    def status(self):
+        # (zaległe operacje, kolejne błędy, ostatni błąd, odrzucone konflikty)
+        with self.cond:
+            return len(self.pending) + self.in_flight, self.failures, self.last_error, len(self.conflicts)
+
+    def wait_idle(self, timeout=None):
+        # Przy powtarzających się błędach nie czekamy - kolejka i tak nie opróżni się szybko
+        with self.cond:
+            return self.cond.wait_for(lambda: (not self.pending and not self.in_flight) or self.failures, timeout)
+
+    def unsynced_ids(self):
+        # Transakcje z lokalną zmianą, której źródło jeszcze nie ma - odświeżanie ich nie nadpisuje
+        with self.cond:
+            return set(self.pending) | set(self.conflicts)
+
+    def conflict_list(self):
+        with self.cond:
+            return list(self.conflicts.items())
+
+    def resolve(self, trade_id, keep_mine):
+        # Moja wersja: zapis ponawiany na bazie aktualnej wersji ze źródła; wersja ze źródła: zmiana porzucona
+        with self.cond:
+            conflict = self.conflicts.pop(trade_id, None)
+        if conflict is None or not keep_mine:
+            return conflict
+        op, mine, theirs, store = conflict
+        if op != 'delete':
+            op = 'update' if theirs is not None else 'insert'
+        # Nowy znacznik, żeby wygrana wersja była widoczna dla odświeżania innych sesji
+        mine.updated_at = new_version()
+        self.submit(op, [mine], store, {trade_id: theirs.updated_at if theirs is not None else None})
+        return conflict
+
+    def adopt(self, store):
+        # Zmiany zrobione na zbiorze wczytanym z błędem (complete=False) przenosimy na świeży, pełny zbiór,
+        # żeby sesja widziała je razem z danymi ze źródła
+        adopted = 0
+        with self.cond:
+            for trade_id, (op, trade, old_store, base) in list(self.pending.items()):
+                if old_store.complete or old_store is store:
+                    continue
+                adopted += 1
+                if op == 'delete':
+                    store.remove(trade_id)
+                elif trade_id in store:
+                    store.update(trade_id, trade)
+                else:
+                    store.add(trade)
+                self.pending[trade_id] = (op, trade, store, base)
+        return adopted
+
+    def _flush(self, batch):
+        # Grupy operacji idą osobno; udane grupy znikają z batcha, żeby ponowienie nie zdublowało wierszy
+        for op in ('insert', 'update', 'delete'):
+            items = [(tid, item) for tid, item in batch.items() if item[0] == op]
+            if not items:
+                continue
+            conflicts = self.repo.write(op, [item[1] for _, item in items], {tid: item[3] for tid, item in items})
+            with self.cond:
+                for tid, item in items:
+                    if tid in conflicts:
+                        self.conflicts[tid] = (op, item[1], conflicts[tid], item[2])
+            for tid, _ in items:
+                del batch[tid]
+
+    def _run(self):
+        while True:
+            with self.cond:
+                self.cond.wait_for(lambda: self.pending)
+            time.sleep(WRITE_DEBOUNCE)
+            with self.cond:
+                batch, self.pending = self.pending, {}
+                self.in_flight = len(batch)
+            try:
+                self._flush(batch)
+            except Exception as e:
+                with self.cond:
+                    # Nieudane operacje wracają przed nowsze zmiany tych samych transakcji
+                    retry = dict(batch)
+                    self._merge(retry, self.pending.items())
+                    self.pending = retry
+                    self.in_flight = 0
+                    self.failures += 1
+                    self.last_error = str(e) or type(e).__name__
+                    backoff = min(WRITE_MAX_BACKOFF, 2 ** self.failures)
+                time.sleep(backoff)
+                continue
+            with self.cond:
+                self.in_flight = 0
+                self.failures = 0
+                self.last_error = None
+                self.cond.notify_all()
+            for listener in self.listeners:
+                listener()
+
+
+@st.cache_resource
+def get_write_queue():
+    return WriteQueue(get_repository())
+
+
+repository = get_repository()
+write_queue = get_write_queue()
+
+
+# --- MAGAZYN TRANSAKCJI (trade_id -> trade) ---
+def _has_items(value):
+    # Działa na surowym tekście (bez dekodowania pól leniwych) i na zdekodowanej liście
+    if isinstance(value, str):
+        return value.replace('|||', '').strip() not in ("", "[]")
+    return any(str(item).strip() for item in value)
+
+
+def trade_has_notes(t):
+    return bool(str(t.get('notes', '')).strip()
+                or str(t.get('model_mistakes', '')).strip()
+                or str(t.get('mental_mistakes', '')).strip()
+                or _has_items(t.confluences)
+                or str(t.get('general_notes', '')).strip()
+                or str(t.get('htf_desc', '')).strip()
+                or str(t.get('ltf_desc', '')).strip()
+                or _has_items(t.htf_links)
+                or _has_items(t.ltf_links))
+
+
+DERIVED_MAX_DELTA = 256  # zmian nanoszonych przyrostowo; powyżej (i > 1/4 zbioru) struktury budujemy od nowa
+# Diagnostyka: po każdym przebiegu agregaty przyrostowe porównywane z przeliczeniem od zera (kosztowne)
+VERIFY_AGGREGATES = bool(storage_setting("verify_aggregates", False))
+
+
+class TradeStore:
+    # Dict zachowuje kolejność wstawiania, więc trades() odpowiada kolejności wierszy w arkuszu.
+    # version rośnie przy każdej zmianie; dane pochodne z apply(old, new) dostają tylko zmienione transakcje,
+    # pozostałe (agregaty, statystyki) są przy nowej wersji budowane od nowa.
+    def __init__(self, trades=(), complete=True, synced_version=""):
+        self.by_id = {t.trade_id: t for t in map(as_trade, trades)}
+        # complete=False: odczyt się nie udał, więc zbiór może być niepełny
+        self.complete = complete
+        for t in self.by_id.values():
+            t.has_notes = trade_has_notes(t)
+        # High-water mark: najnowsze updated_at ze źródła, które sesja już zna - od niego liczy się delta
+        self.synced_version = synced_version
+        self.version = 0
+        self._derived = {}
+        self._builders = {}
+        self._derived_version = 0
+        self._changes = []  # (stara, nowa) od ostatniego derived(); None = brak transakcji
+
+    def __len__(self):
+        return len(self.by_id)
+
+    def __contains__(self, trade_id):
+        return trade_id in self.by_id
+
+    def get(self, trade_id):
+        return self.by_id.get(trade_id)
+
+    def trades(self):
+        return list(self.by_id.values())
+
+    def add(self, trade):
+        trade = as_trade(trade)
+        if not trade.trade_id:
+            trade.trade_id = new_trade_id()
+        trade.has_notes = trade_has_notes(trade)
+        self._log(self.by_id.get(trade.trade_id), trade)
+        self.by_id[trade.trade_id] = trade
+        self.version += 1
+        return trade
+
+    def update(self, trade_id, trade):
+        trade = as_trade(trade)
+        trade.trade_id = trade_id
+        trade.has_notes = trade_has_notes(trade)
+        self._log(self.by_id.get(trade_id), trade)
+        self.by_id[trade_id] = trade
+        self.version += 1
+        return trade
+
+    def remove(self, trade_id):
+        trade = self.by_id.pop(trade_id, None)
+        if trade is not None:
+            self._log(trade, None)
+            self.version += 1
+        return trade
+
+    def _log(self, old, new):
+        if self._derived:
+            self._changes.append((old, new))
+
+    def derived(self, name, build):
+        # Struktury pochodne (indeksy, agregaty) budujemy raz; po zmianach zbioru te z apply(old, new) aktualizujemy
+        # w miejscu (koszt ~ liczba zmian), resztę odrzucamy. Przy bardzo dużej delcie taniej zbudować od nowa.
+        if self._derived_version != self.version:
+            incremental = len(self._changes) <= max(DERIVED_MAX_DELTA, len(self.by_id) // 4)
+            self._derived = {k: v for k, v in self._derived.items() if incremental and hasattr(v, 'apply')}
+            for structure in self._derived.values():
+                for old, new in self._changes:
+                    structure.apply(old, new)
+            self._changes = []
+            self._derived_version = self.version
+        if name not in self._derived:
+            # Silniki analityczne (uses_frame) dostają wspólną kolumnową ramkę zamiast budować własną
+            frame = self.derived('trade_frame', TradeFrame) if getattr(build, 'uses_frame', False) else None
+            self._derived[name] = build(self.trades()) if frame is None else build(self.trades(), frame)
+            self._builders[name] = build
+        return self._derived[name]
+
+    def check_derived(self):
+        # Test spójności: struktury aktualizowane przyrostowo vs przeliczone od zera -> nazwy rozbieżnych
+        mismatched = []
+        for name, build in list(self._builders.items()):
+            structure = self.derived(name, build)
+            if not hasattr(structure, 'snapshot'):
+                continue
+            trades = self.trades()
+            fresh = build(trades, TradeFrame(trades)) if getattr(build, 'uses_frame', False) else build(trades)
+            if structure.snapshot() != fresh.snapshot():
+                mismatched.append(name)
+        return mismatched
+
+    def reset_derived(self):
+        self._derived = {}
+        self._changes = []
+
+
+def build_notes_feed(trades):
+    # Id transakcji z notatkami, od najnowszych, osobno dla live i backtestu
+    feed = {False: [], True: []}
+    for t in sorted((t for t in trades if t.has_notes), key=lambda x: x.date or date.min, reverse=True):
+        feed[t.is_backtest].append(t.trade_id)
+    return feed
+
+
+# --- WYSZUKIWANIE W NOTATKACH (indeks odwrócony) ---
+SEARCH_FIELDS = {"Notes": 'notes', "Model Mistakes": 'model_mistakes', "Mental Mistakes": 'mental_mistakes',
+                 "General Notes": 'general_notes', "HTF Description": 'htf_desc', "LTF Description": 'ltf_desc'}
+SEARCH_ALL_FIELDS = "All fields"
+SEARCH_TOKEN = re.compile(r"\w+")
+SEARCH_PREFIX_WEIGHT = 0.5  # słowo dopasowane tylko prefiksem waży mniej niż całe słowo
+SEARCH_MAX_EXPANSIONS = 200  # terminów na jeden prefiks (np. "a"); przy większej liczbie - najczęstsze
+
+
+def search_tokens(text):
+    return SEARCH_TOKEN.findall(str(text).lower())
+
+
+class NotesIndex:
+    # termin -> {trade_id: {pole: liczba wystąpień}}; posortowany słownik terminów daje dopasowanie prefiksem
+    # przez bisect. apply(old, new) przeindeksowuje tylko zmienioną transakcję.
+    def __init__(self, trades):
+        self.postings = {}
+        self.docs = {}  # trade_id -> terminy transakcji (do wyjęcia z indeksu przy zmianie)
+        self.dates = {}
+        for t in trades:
+            self._add(t, sort=False)
+        self.terms = sorted(self.postings)
+
+    def _add(self, t, sort=True):
+        doc = {}
+        for col in SEARCH_FIELDS.values():
+            for term in search_tokens(t[col]):
+                counts = doc.setdefault(term, {})
+                counts[col] = counts.get(col, 0) + 1
+        if not doc:
+            return
+        self.docs[t.trade_id] = list(doc)
+        self.dates[t.trade_id] = t.date or date.min
+        for term, counts in doc.items():
+            if term not in self.postings:
+                self.postings[term] = {}
+                if sort:
+                    bisect.insort(self.terms, term)
+            self.postings[term][t.trade_id] = counts
+
+    def _remove(self, trade_id):
+        self.dates.pop(trade_id, None)
+        for term in self.docs.pop(trade_id, ()):
+            postings = self.postings[term]
+            del postings[trade_id]
+            if not postings:
+                del self.postings[term]
+                del self.terms[bisect.bisect_left(self.terms, term)]
+
+    def apply(self, old, new):
+        if old is not None:
+            self._remove(old.trade_id)
+        if new is not None:
+            self._add(new)
+
+    def _prefixed(self, token):
+        start = bisect.bisect_left(self.terms, token)
+        return self.terms[start:bisect.bisect_left(self.terms, token + "\U0010ffff", start)]
+
+    def _expand(self, token):
+        # Krótki prefiks może pasować do tysięcy słów: zostaje samo słowo i SEARCH_MAX_EXPANSIONS terminów
+        # z największą liczbą transakcji (pokrywają najwięcej wyników); UI pokazuje zawężenie (truncated)
+        terms = self._prefixed(token)
+        if len(terms) > SEARCH_MAX_EXPANSIONS:
+            terms = heapq.nlargest(SEARCH_MAX_EXPANSIONS, terms,
+                                   key=lambda term: (term == token, len(self.postings[term])))
+        return terms
+
+    def truncated(self, query):
+        # -> [(słowo zapytania, liczba pasujących terminów)] dla prefiksów zawężonych w _expand
+        counts = ((token, len(self._prefixed(token))) for token in dict.fromkeys(search_tokens(query)))
+        return [(token, count) for token, count in counts if count > SEARCH_MAX_EXPANSIONS]
+
+    def search(self, query, col=None):
+        # -> trade_id od najlepszego: każde słowo zapytania musi pasować (całe albo jako prefiks);
+        # wynik = suma tf * idf po dopasowanych terminach, remis - nowsza transakcja wyżej
+        scores = None
+        n = max(len(self.docs), 1)
+        for token in dict.fromkeys(search_tokens(query)):
+            token_scores = {}
+            for term in self._expand(token):
+                postings = self.postings[term]
+                weight = (1.0 if term == token else SEARCH_PREFIX_WEIGHT) * math.log(1 + n / len(postings))
+                for trade_id, counts in postings.items():
+                    tf = counts.get(col, 0) if col else sum(counts.values())
+                    if tf:
+                        token_scores[trade_id] = token_scores.get(trade_id, 0.0) + weight * tf
+            scores = token_scores if scores is None else {
+                trade_id: score + token_scores[trade_id] for trade_id, score in scores.items() if trade_id in token_scores}
+            if not scores:
+                return []
+        if scores is None:
+            return []
+        return sorted(scores, key=lambda trade_id: (-scores[trade_id], -self.dates[trade_id].toordinal()))
+
+    def snapshot(self):
+        return self.postings, self.terms
+
+
+# --- INDEKS HISTORII (filtry i sortowanie) ---
+HISTORY_SORTS = {"Date (Newest)": ('date', True), "Date (Oldest)": ('date', False),
+                 "PnL (High -> Low)": ('pnl', True), "PnL (Low -> High)": ('pnl', False)}
+HISTORY_CATEGORIES = ('asset', 'outcome', 'account_type')
+HISTORY_CACHE_SIZE = 64  # zapamiętanych zestawów filtrów
+
+
+class HistoryIndex:
+    # Budowany raz na wersję magazynu: permutacje posortowane po dacie i PnL oraz kody wartości asset / outcome /
+    # account_type. Zmiana filtra lub sortowania to tylko maski i wycinki tych tablic; wynik per krotka filtrów
+    # zapamiętany. Pozycje = kolejność trades() (numer #N w historii).
+    def __init__(self, trades):
+        self.ids = [t.trade_id for t in trades]
+        days = np.array([t.date.toordinal() if t.date else -1 for t in trades], dtype=np.int64)
+        pnl = np.array([float(t.pnl) for t in trades], dtype=float)
+        self.order = {'date': np.argsort(days, kind='stable'), 'pnl': np.argsort(pnl, kind='stable')}
+        self.sorted_days = days[self.order['date']]
+        self.codes, self.values = {}, {}
+        for col in HISTORY_CATEGORIES:
+            codes, uniques = pd.factorize(pd.Series([str(t[col]) for t in trades], dtype=object))
+            self.codes[col] = codes
+            self.values[col] = {value: code for code, value in enumerate(uniques)}
+        self._cache = {}
+
+    def options(self, col):
+        return list(self.values[col])
+
+    def date_bounds(self):
+        dated = self.sorted_days[self.sorted_days >= 0]
+        return (date.fromordinal(int(dated[0])), date.fromordinal(int(dated[-1]))) if len(dated) else None
+
+    def query(self, filters, date_from, date_to, sort):
+        # filters: kolumna -> wybrane wartości (puste = bez filtra); date_from / date_to: zakres włącznie
+        # (None = bez filtra - wtedy także transakcje bez daty). -> pozycje w kolejności sortowania.
+        key = (tuple(tuple(sorted(filters.get(col, ()))) for col in HISTORY_CATEGORIES), date_from, date_to, sort)
+        if key not in self._cache:
+            if len(self._cache) >= HISTORY_CACHE_SIZE:
+                self._cache.clear()
+            keep = np.ones(len(self.ids), dtype=bool)
+            for col, selected in filters.items():
+                if selected:
+                    keep &= np.isin(self.codes[col], [self.values[col][v] for v in selected if v in self.values[col]])
+            if date_from is not None:
+                lo = np.searchsorted(self.sorted_days, date_from.toordinal(), side='left')
+                hi = np.searchsorted(self.sorted_days, date_to.toordinal(), side='right')
+                in_range = np.zeros(len(self.ids), dtype=bool)
+                in_range[self.order['date'][lo:hi]] = True
+                keep &= in_range
+            col, descending = HISTORY_SORTS[sort]
+            order = self.order[col][::-1] if descending else self.order[col]
+            self._cache[key] = order[keep[order]]
+        return self._cache[key]
+
+
+# --- INDEKS DZIENNY (agregaty per dzień / tydzień / miesiąc / rok) ---
+EMPTY_AGG = {"pnl": 0.0, "rr": 0.0, "trades": 0, "entries": 0, "no_trade": False, "ids": ()}
+
+
+def _merge_agg(index, key, pnl, rr, trades, entries, ids=()):
+    agg = index.get(key)
+    if agg is None:
+        agg = index[key] = {"pnl": 0.0, "rr": 0.0, "trades": 0, "entries": 0, "no_trade": False, "ids": []}
+    agg['pnl'] += pnl
+    agg['rr'] += rr
+    agg['trades'] += trades
+    agg['entries'] += entries
+    # Wpisy "No Trade" to entries - trades, więc flaga zostaje poprawna także po odjęciu transakcji
+    agg['no_trade'] = agg['entries'] > agg['trades']
+    agg['ids'].extend(ids)
+    return agg
+
+
+class DailyIndex:
+    # Klucz dnia: (date, is_backtest, account_type); account_type=None oznacza wszystkie konta.
+    # Tygodnie kluczowane poniedziałkiem, miesiące (rok, miesiąc), lata rokiem - wszystko z jednego przebiegu.
+    def __init__(self, trades):
+        self.days = {}
+        for t in trades:
+            if t.date is None:
+                continue
+            is_no_trade = t.direction == Direction.NO_TRADE
+            for acc in (t.account_type, None):
+                _merge_agg(self.days, (t.date, t.is_backtest, acc), t.pnl, t.rr, 0 if is_no_trade else 1, 1,
+                           (t.trade_id,))
+
+        self.weeks, self.months, self.years = {}, {}, {}
+        for (d, is_bt, acc), agg in self.days.items():
+            parts = (agg['pnl'], agg['rr'], agg['trades'], agg['entries'])
+            _merge_agg(self.weeks, (d - timedelta(days=d.weekday()), is_bt, acc), *parts)
+            _merge_agg(self.months, (d.year, d.month, is_bt, acc), *parts)
+            _merge_agg(self.years, (d.year, is_bt, acc), *parts)
+
+    def _buckets(self, t):
+        d = t.date
+        for acc in (t.account_type, None):
+            yield self.days, (d, t.is_backtest, acc)
+            yield self.weeks, (d - timedelta(days=d.weekday()), t.is_backtest, acc)
+            yield self.months, (d.year, d.month, t.is_backtest, acc)
+            yield self.years, (d.year, t.is_backtest, acc)
+
+    def apply(self, old, new):
+        # Zmiana jednej transakcji: stara wersja odjęta, nowa dodana - tylko w jej kubełkach (dzień/tydzień/miesiąc/rok)
+        new_days = {key for index, key in self._buckets(new) if index is self.days} if new and new.date else set()
+        for t, sign in ((old, -1), (new, 1)):
+            if t is None or t.date is None:
+                continue
+            parts = (sign * t.pnl, sign * t.rr, sign * (t.direction != Direction.NO_TRADE), sign)
+            for index, key in self._buckets(t):
+                agg = _merge_agg(index, key, *parts)
+                if index is self.days:
+                    # Edycja w obrębie tego samego dnia zachowuje kolejność wpisów
+                    if sign < 0 and key not in new_days:
+                        agg['ids'].remove(t.trade_id)
+                    elif sign > 0 and t.trade_id not in agg['ids']:
+                        agg['ids'].append(t.trade_id)
+                if agg['entries'] <= 0:
+                    del index[key]
+
+    def snapshot(self):
+        # Porównywalny stan (test spójności z przeliczeniem od zera); kolejność wpisów dnia bez znaczenia
+        return [{k: (round(a['pnl'], 6), round(a['rr'], 6), a['trades'], a['entries'], a['no_trade'], sorted(a['ids']))
+                 for k, a in index.items()} for index in (self.days, self.weeks, self.months, self.years)]
+
+    def day(self, d, is_bt, acc=None):
+        return self.days.get((d, is_bt, acc), EMPTY_AGG)
+
+    def week(self, monday, is_bt, acc=None):
+        return self.weeks.get((monday, is_bt, acc), EMPTY_AGG)
+
+    def month(self, year, month, is_bt, acc=None):
+        return self.months.get((year, month, is_bt, acc), EMPTY_AGG)
+
+    def year(self, year, is_bt, acc=None):
+        return self.years.get((year, is_bt, acc), EMPTY_AGG)
+
+
+# --- CACHE DANYCH (wspólny dla wszystkich sesji i kart) ---
+DATA_CACHE_TTL = 600  # s; starszy snapshot nowa sesja najpierw dociąga zmianami ze źródła (changes_since)
+SYNC_LOOKBACK = 120  # s; zapas na przesunięcie zegarów między urządzeniami - scalanie i tak pomija znane wersje
+AUTO_REFRESH = float(storage_setting("auto_refresh", 0))  # s; 0 = odświeżanie tylko przyciskiem 🔄
+
+
+@st.cache_resource
+def _shared_dataset():
+    # trades: trade_id -> Trade; synced_version: high-water mark (najnowsze updated_at odczytane ze źródła)
+    return {"trades": None, "synced_version": "", "loaded_at": 0.0, "lock": threading.Lock()}
+
+
+def dataset_is_cached():
+    shared = _shared_dataset()
+    return shared['trades'] is not None and time.time() - shared['loaded_at'] <= DATA_CACHE_TTL
+
+
+# --- SNAPSHOT NA DYSKU (zimny start) ---
+# Sparsowany zbiór w formacie Arrow IPC: nowy proces mapuje plik do pamięci zamiast czytać cały arkusz przez API,
+# a ze źródłem uzgadnia się deltą od wersji snapshotu dopiero po wyrenderowaniu strony. Samo mapowanie jest
+# natychmiastowe; koszt to zamiana kolumn na rekordy Trade (trades_from_frame), ok. 0.4-0.7 s przy 50k wierszy.
+SNAPSHOT_PATH = storage_setting("snapshot_path", ".journal_snapshot.arrow" if STORAGE_BACKEND == "gsheets" else "")
+SNAPSHOT_COLUMNS = [c for c in SHEET_COLUMNS if c != 'deleted']
+SNAPSHOT_DEBOUNCE = 2  # s; seria zapisów = jeden snapshot
+
+
+def write_snapshot(path, trades, version):
+    import pyarrow as pa
+    df = pd.DataFrame([serialize_trade(t) for t in trades], columns=SHEET_COLUMNS)[SNAPSHOT_COLUMNS].astype(str)
+    table = pa.Table.from_pandas(df, preserve_index=False).replace_schema_metadata(
+        {'version': version, 'backend': repository.name})
+    tmp = f"{path}.tmp"
+    with pa.OSFile(tmp, 'wb') as sink, pa.ipc.new_file(sink, table.schema) as writer:
+        writer.write_table(table)
+    os.replace(tmp, path)  # czytelnik widzi stary albo nowy plik, nigdy niedopisany
+
+
+def read_snapshot(path):
+    # -> (transakcje, wersja) albo None (brak pliku, inny backend, stary układ kolumn)
+    import pyarrow as pa
+    try:
+        with pa.memory_map(path) as source:
+            table = pa.ipc.open_file(source).read_all()
+            meta = table.schema.metadata or {}
+            if meta.get(b'backend') != repository.name.encode() or table.column_names != SNAPSHOT_COLUMNS:
+                return None
+            df = table.to_pandas()
+    except (OSError, pa.ArrowInvalid):
+        return None
+    return trades_from_frame(df, []), meta.get(b'version', b"").decode()
+
+
+class SnapshotWriter:
+    # Zapis w tle, tylko gdy kolejka zapisu nie ma niczego niezapisanego - inaczej snapshot zawierałby zmiany,
+    # których źródło nie zna, a delta od jego wersji by ich nie cofnęła
+    def __init__(self, path, shared, queue):
+        self.path = path
+        self.shared = shared
+        self.queue = queue
+        self.pending = False
+        self.cond = threading.Condition()
+        self.thread = threading.Thread(target=self._run, name="journal-snapshot", daemon=True)
+        self.thread.start()
+
+    def schedule(self):
+        with self.cond:
+            self.pending = True
+            self.cond.notify_all()
+
+    def _run(self):
+        while True:
+            with self.cond:
+                self.cond.wait_for(lambda: self.pending)
+                self.pending = False
+            time.sleep(SNAPSHOT_DEBOUNCE)
+            with self.shared['lock']:
+                if self.shared['trades'] is None or self.queue.status()[0] or self.queue.unsynced_ids():
+                    continue  # kolejny udany zapis zaplanuje snapshot ponownie
+                trades, version = list(self.shared['trades'].values()), self.shared['synced_version']
+            try:
+                write_snapshot(self.path, trades, version)
+            except Exception:
+                pass  # snapshot to tylko przyspieszenie startu; następny zapis spróbuje ponownie
+
+
+@st.cache_resource
+def get_snapshot_writer():
+    if not SNAPSHOT_PATH:
+        return None
+    writer = SnapshotWriter(SNAPSHOT_PATH, _shared_dataset(), write_queue)
+    write_queue.listeners.append(writer.schedule)
+    return writer
+
+
+snapshot_writer = get_snapshot_writer()
+
+
+def schedule_snapshot():
+    if snapshot_writer is not None:
+        snapshot_writer.schedule()
+
+
+def fetch_delta(since, local, keep=()):
+    # Zmiany źródła od wersji `since` względem lokalnej kopii (trade_id -> Trade): (nowsze wiersze, usunięte id).
+    # Transakcje z niezapisaną lokalną zmianą (keep) zostają - rozstrzygnie je kontrola wersji przy zapisie.
+    # None = backend nie umie podać delty, potrzebny pełny odczyt.
+    delta = repository.changes_since(version_before(since, SYNC_LOOKBACK))
+    if delta is None:
+        return None
+    changed, live_ids, version = delta
+    upserts = [t for t in changed if t.trade_id not in keep
+               and (t.trade_id not in local or local[t.trade_id].updated_at != t.updated_at)]
+    removed = [tid for tid in local if tid not in live_ids and tid not in keep]
+    return upserts, removed, max(since, version)
+
+
+def load_trades_cached(force=False):
+    # -> (transakcje, high-water mark); transakcje None = odczyt się nie udał i nie ma wcześniejszej kopii.
+    # Po nieudanym odświeżeniu zostaje poprzedni snapshot.
+    shared = _shared_dataset()
+    with shared['lock']:
+        result = None
+        if shared['trades'] is None and not force and SNAPSHOT_PATH:
+            snapshot = read_snapshot(SNAPSHOT_PATH)
+            if snapshot is not None:
+                # Zimny start z dysku: dane od razu, uzgodnienie ze źródłem po renderze (reconcile_cold_start)
+                trades, version = snapshot
+                shared.update(trades={t.trade_id: t for t in trades}, synced_version=version, loaded_at=time.time())
+                st.session_state.reconcile_pending = True
+        if shared['trades'] is not None and not force and not dataset_is_cached():
+            # Stary snapshot: zamiast całego arkusza tylko wiersze zmienione od jego wersji
+            write_queue.wait_idle(timeout=30)
+            try:
+                delta = fetch_delta(shared['synced_version'], shared['trades'], write_queue.unsynced_ids())
+            except Exception:
+                delta = None
+            if delta is not None:
+                upserts, removed, shared['synced_version'] = delta
+                _patch_snapshot(shared, upserts, removed)
+                shared['loaded_at'] = time.time()
+                schedule_snapshot()
+        if force or not dataset_is_cached():
+            # Najpierw domykamy zaległe zapisy, inaczej świeży odczyt nie zawierałby ostatnich zmian
+            write_queue.wait_idle(timeout=30)
+            result = repository.load()
+            if result.ok:
+                shared.update(trades={t.trade_id: t for t in result.trades}, loaded_at=time.time(),
+                              synced_version=max((t.updated_at for t in result.trades), default=""))
+                schedule_snapshot()
+        st.session_state.load_result = result
+        if shared['trades'] is None:
+            return None, ""
+        return [t.copy() for t in shared['trades'].values()], shared['synced_version']
+
+
+def load_trade_store(force=False):
+    trades, synced_version = load_trades_cached(force)
+    store = TradeStore(trades or [], complete=trades is not None, synced_version=synced_version)
+    st.session_state.trade_store = store
+    if store.complete and write_queue.adopt(store):
+        publish_dataset(store.trades())
+
+
+def _patch_snapshot(shared, changed, removed):
+    for t in changed:
+        shared['trades'][t.trade_id] = t.copy()
+    for trade_id in removed:
+        shared['trades'].pop(trade_id, None)
+
+
+def publish_dataset(changed=(), removed=(), synced_version=""):
+    # Zmiany sesji nanosimy na wspólny snapshot wiersz po wierszu - koszt zależy od liczby zmian, nie od dziennika.
+    # Rozłączne zmiany z wielu kart składają się same; konflikty tego samego wiersza rozstrzyga kontrola wersji.
+    # synced_version: zmiany pochodzą z delty źródła, więc snapshot zna je do tej wersji.
+    shared = _shared_dataset()
+    with shared['lock']:
+        if shared['trades'] is not None:
+            _patch_snapshot(shared, changed, removed)
+            shared['synced_version'] = max(shared['synced_version'], synced_version)
+    schedule_snapshot()
+
+
+def sync_trade_store():
+    # Delta od high-water mark sesji nanoszona na magazyn (i przyrostowo na agregaty).
+    # -> liczba zmian albo None, gdy potrzebny pełny odczyt.
+    store = st.session_state.trade_store
+    if not store.complete:
+        return None
+    write_queue.wait_idle(timeout=30)
+    delta = fetch_delta(store.synced_version, store.by_id, write_queue.unsynced_ids())
+    if delta is None:
+        return None
+    upserts, removed, store.synced_version = delta
+    for t in upserts:
+        if t.trade_id in store:
+            store.update(t.trade_id, t)
+        else:
+            store.add(t)
+    for trade_id in removed:
+        store.remove(trade_id)
+    publish_dataset(upserts, removed, store.synced_version)
+    st.session_state.load_result = None
+    return len(upserts) + len(removed)
+
+
+def refresh_data():
     with st.spinner("Ładowanie bazy danych..."):
-        st.session_state.all_trades = load_data_from_gsheets()
+        try:
+            synced = sync_trade_store()
+        except Exception:
+            synced = None
+        if synced is None:
+            load_trade_store(force=True)
+
+
+def reconcile_cold_start():
+    # Po starcie ze snapshotu z dysku strona jest już wysłana; delta od jego wersji (albo pełny odczyt, gdy
+    # backend jej nie poda) i rerun tylko wtedy, gdy źródło ma coś nowego
+    if not st.session_state.pop('reconcile_pending', False):
+        return
+    try:
+        synced = sync_trade_store()
+    except Exception:
+        synced = None
+    if synced is None:
+        load_trade_store(force=True)
+        st.rerun()
+    if synced:
+        st.rerun()
 
-all_trades = st.session_state.all_trades
+
+@st.fragment(run_every=AUTO_REFRESH or None)
+def render_auto_refresh():
+    # Odświeżanie w tle: co AUTO_REFRESH s tylko delta; pełny rerun strony wyłącznie gdy coś przyszło
+    if write_queue.status()[0]:
+        return
+    try:
+        synced = sync_trade_store()
+    except Exception:
+        return
+    if synced:
+        st.rerun()
+
+
+def add_trade(trade):
+    add_trades([trade])
+
+
+def add_trades(trades):
+    # Cała partia (np. import) idzie do źródła jedną operacją insert - jeden append / jedna transakcja
+    store = st.session_state.trade_store
+    version = new_version()
+    added = [store.add(t) for t in trades]
+    for t in added:
+        t.updated_at = version
+    write_queue.submit('insert', added, store)
+    publish_dataset(added)
+    return added
+
+
+def replace_trade(trade_id, trade):
+    # Wersja, na której oparto edycję, jedzie z zapisem - źródło odrzuci ją, jeśli ktoś zmienił wiersz w międzyczasie
+    store = st.session_state.trade_store
+    old = store.get(trade_id)
+    updated = store.update(trade_id, trade)
+    updated.updated_at = new_version()
+    write_queue.submit('update', [updated], store, {trade_id: old.updated_at if old is not None else None})
+    publish_dataset([updated])
+
+
+# --- IMPORT BACKTESTU (CSV / Parquet) ---
+IMPORT_CHUNK = 5000  # wierszy na kawałek - plik nie jest wczytywany w całości
+IMPORT_REQUIRED = ('date', 'pnl')
+# Treść transakcji do deduplikacji: bez id, wersji i pól, które import i tak nadpisuje
+IMPORT_HASH_FIELDS = [c for c in SHEET_COLUMNS if c in TRADE_FIELDS
+                      and c not in ('trade_id', 'updated_at', 'is_backtest', 'account_type', 'checklist')]
+
+
+def content_value(trade, col):
+    # Wartość pola w postaci jak w arkuszu - transakcja z dziennika i ten sam wiersz z pliku dają ten sam tekst
+    value = trade[col]
+    if col == 'date':
+        return value.isoformat() if value else ""
+    if col in LAZY_DECODERS:
+        # Przez postać zdekodowaną: "" i "[]" w arkuszu to ta sama pusta lista
+        return "|||".join(value) if col.endswith('_links') else (json.dumps(value) if value else "")
+    if col in ('pnl', 'rr'):
+        return repr(float(value))
+    return str(value)
+
+
+def trade_content_hashes(trades):
+    # 64-bitowy hash treści per transakcja, liczony kolumnowo (pd.util.hash_pandas_object)
+    frame = pd.DataFrame({col: [content_value(t, col) for t in trades] for col in IMPORT_HASH_FIELDS},
+                         columns=IMPORT_HASH_FIELDS)
+    return pd.util.hash_pandas_object(frame, index=False).to_numpy()
+
+
+def iter_import_chunks(source, name):
+    # -> (ramka tekstowa, postęp 0..1); source = plik z uploadu (st.file_uploader), czytany kawałkami
+    if name.lower().endswith('.parquet'):
+        import pyarrow.parquet as pq
+        parquet = pq.ParquetFile(source)
+        total, done = max(parquet.metadata.num_rows, 1), 0
+        for batch in parquet.iter_batches(batch_size=IMPORT_CHUNK):
+            df = batch.to_pandas().fillna("").astype(str)
+            df.index = pd.RangeIndex(done, done + len(df))  # numery wierszy w ostrzeżeniach jak w całym pliku
+            done += len(df)
+            yield df, done / total
+    else:
+        total = max(source.size, 1)
+        with pd.read_csv(source, dtype=str, keep_default_na=False, chunksize=IMPORT_CHUNK) as reader:
+            for df in reader:
+                handles = getattr(reader, 'handles', None)
+                yield df, min(handles.handle.tell() / total, 1.0) if handles is not None else 1.0
+
+
+def import_rejects(df, warnings):
+    # Wiersze, których nie da się zaimportować bez zgadywania: pnl pusty / nie-liczba albo nieznany kierunek.
+    # trades_from_frame przyjąłby tu 0 / dosłowny tekst - w imporcie taki wiersz jest odrzucany, nie poprawiany.
+    pnl = _text_column(df, 'pnl').str.replace(',', '.', regex=False)
+    bad_pnl = pd.to_numeric(pnl, errors='coerce').isna()
+    _report(warnings, 'pnl', pnl, bad_pnl, "nie jest liczbą, wiersz odrzucony")
+    direction = _text_column(df, 'direction')
+    bad_direction = (direction != "") & ~direction.isin(DIRECTION_OPTIONS)
+    _report(warnings, 'direction', direction, bad_direction & ~bad_pnl, "nieznany kierunek, wiersz odrzucony")
+    return bad_pnl | bad_direction
+
+
+@dataclass
+class ImportResult:
+    rows: int = 0
+    added: list = field(default_factory=list)
+    duplicates: int = 0
+    rejected: int = 0
+    warnings: list = field(default_factory=list)
+    error: str | None = None
+
+
+def parse_import_file(source, name, existing, progress=None):
+    # Walidacja kolumnowa (trades_from_frame), odrzucenie wierszy bez daty, z błędnym pnl lub kierunkiem
+    # (import_rejects), deduplikacja po hashu treści - względem dziennika i wewnątrz pliku. Hash służy tylko do
+    # deduplikacji - każdy nowy wiersz dostaje świeże id, więc ponowny import nie nadpisze transakcji edytowanej
+    # po poprzednim imporcie (ani id z pliku).
+    result = ImportResult()
+    seen = set(trade_content_hashes([t for t in existing if t.is_backtest]).tolist())
+    try:
+        for df, done in iter_import_chunks(source, name):
+            if result.rows == 0:
+                missing = [c for c in IMPORT_REQUIRED if c not in df.columns]
+                if missing:
+                    result.error = f"Brak wymaganych kolumn: {', '.join(missing)}"
+                    return result
+            result.rows += len(df)
+            df = df.assign(is_backtest="True", account_type=AccountType.BACKTESTING.value, updated_at="")
+            chunk = trades_from_frame(df[~import_rejects(df, result.warnings)], result.warnings)
+            valid = [t for t in chunk if t.date is not None]
+            result.rejected += len(df) - len(valid)
+            for t, h in zip(valid, trade_content_hashes(valid).tolist()):
+                if h in seen:
+                    result.duplicates += 1
+                    continue
+                seen.add(h)
+                t.trade_id = new_trade_id()
+                result.added.append(t)
+            if progress is not None:
+                progress(done, result)
+    except Exception as e:
+        result.error = str(e) or type(e).__name__
+    return result
+
+
+if 'trade_store' not in st.session_state:
+    if dataset_is_cached():
+        load_trade_store()
+    else:
+        with st.spinner("Ładowanie bazy danych..."):
+            load_trade_store()
+
+trade_store = st.session_state.trade_store
+# --- SILNIK STATYSTYK (kolumnowa ramka transakcji) ---
+FRAME_CATEGORIES = ['asset', 'direction', 'trade_type', 'account_type', 'outcome']
+STAT_DIMENSIONS = {"Account": "account_type", "Asset": "asset", "Direction": "direction", "Type": "trade_type",
+                   "Month": "month"}
+STAT_AGGREGATES = dict(net_pnl=('pnl', 'sum'), rr=('rr', 'sum'), trades=('is_valid', 'sum'), entries=('pnl', 'size'),
+                       wins=('is_win', 'sum'), losses=('is_loss', 'sum'), gross_profit=('win_pnl', 'sum'),
+                       gross_loss=('loss_pnl', 'sum'))
+
+
+def build_trade_frame(trades):
+    columns = ['trade_id', 'date', 'pnl', 'rr', 'is_backtest'] + FRAME_CATEGORIES
+    df = pd.DataFrame({col: [t[col] for t in trades] for col in columns}, columns=columns)
+    for col in ('direction', 'account_type', 'outcome'):
+        df[col] = df[col].astype(str)
+    df['date'] = pd.to_datetime(df['date'], errors='coerce')
+    df['month'] = df['date'].dt.strftime('%Y-%m')
+    for col in FRAME_CATEGORIES:
+        df[col] = df[col].fillna("").astype('category')
+    df['pnl'] = df['pnl'].astype(float)
+    df['rr'] = df['rr'].fillna(0.0).astype(float)
+    df['is_backtest'] = df['is_backtest'].astype(bool)
+    df['is_valid'] = df['direction'] != 'No Trade'
+    df['is_win'] = df['pnl'] > 0
+    df['is_loss'] = df['pnl'] < 0
+    df['win_pnl'] = df['pnl'].where(df['is_win'], 0.0)
+    df['loss_pnl'] = -df['pnl'].where(df['is_loss'], 0.0)
+    return df
+
+
+class TradeFrame:
+    # Kolumnowa ramka transakcji wspólna dla silników analitycznych - build_trade_frame raz na odczyt zbioru.
+    # apply(old, new) tylko zbiera zmiany; przy pierwszym odczycie .frame zmienione i usunięte wiersze wypadają,
+    # nowe wersje dochodzą jednym concat. 'seq' = pozycja w magazynie (edycja ją zachowuje), więc po sortowaniu
+    # kolejność wierszy jest ta sama co w ramce zbudowanej od zera.
+    def __init__(self, trades):
+        self._frame = build_trade_frame(trades)
+        self._frame['seq'] = np.arange(len(self._frame))
+        self.seq_of = dict(zip(self._frame['trade_id'], range(len(self._frame))))
+        self.next_seq = len(self._frame)
+        self._pending = {}  # trade_id -> nowa wersja (None = usunięta)
+
+    def apply(self, old, new):
+        self._pending[(new if new is not None else old).trade_id] = new
+
+    @property
+    def frame(self):
+        if self._pending:
+            kept = self._frame[~self._frame['trade_id'].isin(list(self._pending))]
+            added = [t for t in self._pending.values() if t is not None]
+            for trade_id, t in self._pending.items():
+                if t is None:
+                    self.seq_of.pop(trade_id, None)
+                elif trade_id not in self.seq_of:
+                    self.seq_of[trade_id] = self.next_seq
+                    self.next_seq += 1
+            if added:
+                patch = build_trade_frame(added)
+                patch['seq'] = [self.seq_of[t.trade_id] for t in added]
+                kept = pd.concat([kept, patch], ignore_index=True)
+                for col in FRAME_CATEGORIES:
+                    kept[col] = kept[col].astype('category')  # concat różnych kategorii daje object
+            self._frame = kept.sort_values('seq', ignore_index=True)
+            self._pending = {}
+        return self._frame
+
+    def snapshot(self):
+        return self.frame.drop(columns='seq').astype(str).values.tolist()
+
+
+def finish_stats(agg):
+    # Wskaźniki pochodne liczone wektorowo z sum (działa dla jednego wiersza i dla całego groupby)
+    out = agg.copy()
+    out['win_rate'] = (out['wins'] / out['trades'].where(out['trades'] > 0) * 100).fillna(0.0)
+    out['avg_win'] = (out['gross_profit'] / out['wins'].where(out['wins'] > 0)).fillna(0.0)
+    out['avg_loss'] = (out['gross_loss'] / out['losses'].where(out['losses'] > 0)).fillna(0.0)
+    out['profit_factor'] = np.where(out['gross_loss'] > 0,
+                                    out['gross_profit'] / out['gross_loss'].where(out['gross_loss'] > 0),
+                                    np.where(out['gross_profit'] > 0, float('inf'), 0.0))
+    return out
+
+
+STAT_FIELDS = list(STAT_AGGREGATES)
+STAT_COUNT_FIELDS = ['trades', 'entries', 'wins', 'losses']
+
+
+def trade_stat_values(t):
+    # Wkład jednej transakcji w sumy STAT_AGGREGATES (te same definicje co kolumny build_trade_frame)
+    pnl, rr = float(t.pnl), float(t.rr or 0.0)
+    return [pnl, rr, int(t.direction != Direction.NO_TRADE), 1, int(pnl > 0), int(pnl < 0), max(pnl, 0.0), max(-pnl, 0.0)]
+
+
+def trade_dimension(t, dimension):
+    if dimension == 'month':
+        return t.date.strftime('%Y-%m') if t.date else None
+    return str(t[dimension])
+
+
+class StatsEngine:
+    # Sumy STAT_AGGREGATES w kubełkach: groups[(is_backtest, account_type | None, wymiar | None)][wartość];
+    # wymiar None = podsumowanie (headline). Start: groupby na kolumnowej ramce, potem apply(old, new) odejmuje
+    # i dodaje wkład jednej transakcji w jej kilkunastu kubełkach, a gotowe tabele unieważnia tylko dla jej filtrów.
+    uses_frame = True
+
+    def __init__(self, trades, frame):
+        frame = frame.frame
+        self.groups = {}
+        for keys in (['is_backtest', 'account_type'], ['is_backtest']):
+            for dimension in [None] + list(STAT_DIMENSIONS.values()):
+                grouped = frame.groupby(keys + ([dimension] if dimension else []), observed=True).agg(**STAT_AGGREGATES)
+                grouped = grouped.astype({f: int for f in STAT_COUNT_FIELDS})
+                for key, sums in zip(grouped.index, grouped.itertuples(index=False)):
+                    key = key if isinstance(key, tuple) else (key,)
+                    acc = key[1] if len(keys) == 2 else None
+                    value = key[-1] if dimension else None
+                    self.groups.setdefault((bool(key[0]), acc, dimension), {})[value] = list(sums)
+        # Liczba wpisów per dzień - metryka "Days" bez przebiegu po transakcjach
+        self.day_counts = {}
+        for t in trades:
+            if t.date is not None:
+                for acc in (str(t.account_type), None):
+                    counts = self.day_counts.setdefault((t.is_backtest, acc), {})
+                    counts[t.date] = counts.get(t.date, 0) + 1
+        self._cache = {}
+
+    def _buckets(self, t):
+        for acc in (str(t.account_type), None):
+            yield (t.is_backtest, acc, None), None
+            for dimension in STAT_DIMENSIONS.values():
+                value = trade_dimension(t, dimension)
+                if value is not None:
+                    yield (t.is_backtest, acc, dimension), value
+
+    def apply(self, old, new):
+        for t, sign in ((old, -1), (new, 1)):
+            if t is None:
+                continue
+            values = [sign * v for v in trade_stat_values(t)]
+            for group_key, value in self._buckets(t):
+                group = self.groups.setdefault(group_key, {})
+                sums = group.setdefault(value, [0] * len(STAT_FIELDS))
+                for i, v in enumerate(values):
+                    sums[i] += v
+                if sums[STAT_FIELDS.index('entries')] <= 0:
+                    del group[value]
+            for acc in (str(t.account_type), None):
+                if t.date is not None:
+                    counts = self.day_counts.setdefault((t.is_backtest, acc), {})
+                    counts[t.date] = counts.get(t.date, 0) + sign
+                    if counts[t.date] <= 0:
+                        del counts[t.date]
+                # Klucze cache kończą się filtrem (is_backtest, account_type)
+                self._cache = {k: v for k, v in self._cache.items() if k[-2:] != (t.is_backtest, acc)}
+
+    def headline(self, is_bt, acc=None):
+        key = ('headline', is_bt, acc)
+        if key not in self._cache:
+            sums = self.groups.get((is_bt, acc, None), {}).get(None, [0] * len(STAT_FIELDS))
+            stats = finish_stats(pd.DataFrame([sums], columns=STAT_FIELDS)).iloc[0].to_dict()
+            stats['days'] = len(self.day_counts.get((is_bt, acc), ()))
+            self._cache[key] = stats
+        return self._cache[key]
+
+    def breakdown(self, dimension, is_bt, acc=None):
+        key = ('breakdown', dimension, is_bt, acc)
+        if key not in self._cache:
+            group = self.groups.get((is_bt, acc, dimension), {})
+            table = pd.DataFrame(list(group.values()), index=pd.Index(list(group), name=dimension), columns=STAT_FIELDS)
+            self._cache[key] = finish_stats(table.sort_index())
+        return self._cache[key]
+
+    def snapshot(self):
+        # Porównywalny stan (test spójności z przeliczeniem od zera)
+        return ({k: {v: [round(x, 6) for x in sums] for v, sums in group.items()} for k, group in self.groups.items()
+                 if group}, {k: counts for k, counts in self.day_counts.items() if counts})
+
+
+# --- KRZYWA KAPITAŁU I DRAWDOWN ---
+EQUITY_WINDOWS = [10, 20, 50]  # okna kroczące (liczba transakcji)
+EQUITY_MAX_POINTS = 600  # punktów na wykresie po próbkowaniu min/max
+
+
+class EquityEngine:
+    # Ramka transakcji posortowana po dacie (stabilnie - w obrębie dnia kolejność wpisów). Krzywa kapitału,
+    # drawdown i okna kroczące liczone operacjami kumulacyjnymi (cumsum / cummax / rolling) raz na filtr.
+    # Źródłem jest wspólna TradeFrame; zmiana transakcji unieważnia tylko krzywe jej filtrów.
+    uses_frame = True
+
+    def __init__(self, trades, frame):
+        self.source = frame
+        self._frame = None
+        self._cache = {}
+
+    @property
+    def frame(self):
+        if self._frame is None:
+            frame = self.source.frame
+            frame = frame[frame['is_valid'] & frame['date'].notna()]
+            self._frame = frame.sort_values('date', kind='stable').reset_index(drop=True)
+        return self._frame
+
+    def apply(self, old, new):
+        self._frame = None
+        for t in (old, new):
+            if t is not None:
+                self._cache = {k: v for k, v in self._cache.items()
+                               if k[0] != t.is_backtest or k[1] not in (None, str(t.account_type))}
+
+    def curve(self, is_bt, acc=None, window=20):
+        # -> (ramka: date, equity, drawdown, dd_days, win_rate, profit_factor; podsumowanie)
+        key = (is_bt, acc, window)
+        if key not in self._cache:
+            mask = self.frame['is_backtest'] == is_bt
+            if acc is not None:
+                mask &= self.frame['account_type'] == acc
+            df = self.frame[mask].reset_index(drop=True)
+            equity = df['pnl'].cumsum()
+            drawdown = equity - equity.cummax().clip(lower=0.0)  # szczyt liczony od kapitału startowego (0)
+            # Czas pod wodą: dni od ostatniego szczytu (przed pierwszym szczytem - od pierwszej transakcji)
+            peak_date = df['date'].where(drawdown >= 0).ffill().fillna(df['date'].min())
+            gross_profit = df['win_pnl'].rolling(window, min_periods=1).sum()
+            gross_loss = df['loss_pnl'].rolling(window, min_periods=1).sum()
+            curve = pd.DataFrame({
+                'date': df['date'], 'equity': equity, 'drawdown': drawdown, 'dd_days': (df['date'] - peak_date).dt.days,
+                'win_rate': df['is_win'].rolling(window, min_periods=1).mean() * 100,
+                'profit_factor': gross_profit / gross_loss.where(gross_loss > 0)})
+            summary = {'max_drawdown': 0.0, 'max_dd_days': 0, 'current_drawdown': 0.0, 'current_dd_days': 0,
+                       'rolling_win_rate': 0.0, 'rolling_profit_factor': 0.0}
+            if len(curve):
+                last = curve.iloc[-1]
+                pf = last['profit_factor']
+                summary.update({
+                    'max_drawdown': float(drawdown.min()), 'max_dd_days': int(curve['dd_days'].max()),
+                    'current_drawdown': float(last['drawdown']), 'current_dd_days': int(last['dd_days']),
+                    'rolling_win_rate': float(last['win_rate']),
+                    # Brak strat w oknie: PF nieskończony (jak w finish_stats) albo 0 gdy okno bez zysków
+                    'rolling_profit_factor': float(pf) if pd.notna(pf) else (float('inf') if gross_profit.iloc[-1] > 0 else 0.0)})
+            self._cache[key] = (curve, summary)
+        return self._cache[key]
+
+
+def downsample_minmax(frame, columns, max_points):
+    # Min/max per kubełek: ~max_points punktów, a szczyty i dołki (drawdowny) zostają na wykresie
+    n = len(frame)
+    if n <= max_points:
+        return frame
+    buckets = pd.Series(np.arange(n) * (max_points // (2 * len(columns))) // n)
+    keep = [np.array([0, n - 1])]
+    for col in columns:
+        grouped = pd.Series(frame[col].to_numpy()).fillna(0.0).groupby(buckets)
+        keep += [grouped.idxmin().to_numpy(), grouped.idxmax().to_numpy()]
+    return frame.iloc[np.unique(np.concatenate(keep))]
+
+
+# --- ANALIZA KONFLUENCJI (maski bitowe) ---
+CONFLUENCE_TIMEFRAMES = ["30s", "1m", "2m", "3m", "4m", "5m", "15m", "30m", "1h", "4h", "d"]
+CONFLUENCE_TYPES = ["Liq Sweep", "SMT", "FVG", "iFVG", "CISD", "EQ"]
+# Słownik z formularzy (etykieta "5m - FVG" jak w dj/bt_temp_conf); etykiety spoza niego dostają kolejne bity
+CONFLUENCE_VOCAB = [f"{tf} - {conf}" for tf in CONFLUENCE_TIMEFRAMES for conf in CONFLUENCE_TYPES]
+CONFLUENCE_LABEL = re.compile(r'"([^"]*)"')
+CONFLUENCE_NONE = "(brak)"
+
+
+def confluence_raw(t):
+    # Surowy tekst JSON (pole mogło już zostać zdekodowane do listy)
+    return t.confluences if isinstance(t.confluences, str) else json.dumps(t.confluences)
+
+
+class ConfluenceEngine:
+    # Konfluencje transakcji jako maska bitowa nad słownikiem: n x words słów uint64 (66 etykiet z formularzy
+    # nie mieści się w jednym). Kombinacje = groupby po słowach maski; pojedyncze konfluencje = macierz bitów
+    # (unpackbits) przemnożona przez kolumny sum - bez dekodowania JSON-a wiersz po wierszu.
+    # Kolumny sum z wspólnej TradeFrame; maski trzymane per trade_id (row_of) i łatane w apply(old, new).
+    uses_frame = True
+
+    def __init__(self, trades, frame):
+        self.source = frame
+        # Różnych list konfluencji jest kilkaset, transakcji - tysiące: etykiety wyciągamy tylko z unikalnych tekstów
+        raw_codes, uniques = pd.factorize(pd.Series([confluence_raw(t) for t in trades], dtype=object))
+        labels = pd.Series(uniques, dtype=object).str.extractall(CONFLUENCE_LABEL)[0]
+        self.vocab = CONFLUENCE_VOCAB + sorted(set(labels.unique()) - set(CONFLUENCE_VOCAB))
+        self.code_of = {label: i for i, label in enumerate(self.vocab)}
+        self.words = (len(self.vocab) + 63) // 64
+        unique_masks = np.zeros((len(uniques), self.words), dtype='<u8')  # little-endian: bit i = bajt i // 8
+        if len(labels):
+            codes = pd.Categorical(labels, categories=self.vocab).codes.astype(np.int64)
+            rows = labels.index.get_level_values(0).to_numpy()
+            bits = np.left_shift(np.uint64(1), (codes % 64).astype(np.uint64))
+            np.bitwise_or.at(unique_masks, (rows, codes // 64), bits)
+        self.masks = unique_masks[raw_codes] if len(uniques) else np.zeros((len(trades), self.words), dtype='<u8')
+        self.row_of = {t.trade_id: i for i, t in enumerate(trades)}
+        self.free = []  # wiersze masek po usuniętych transakcjach, do ponownego użycia
+        self._aligned = None
+        self._cache = {}
+
+    def _mask(self, t):
+        labels = CONFLUENCE_LABEL.findall(confluence_raw(t))
+        for label in labels:
+            if label not in self.code_of:
+                self.code_of[label] = len(self.vocab)
+                self.vocab.append(label)
+        if len(self.vocab) > self.words * 64:
+            self.masks = np.hstack([self.masks, np.zeros((len(self.masks), 1), dtype='<u8')])
+            self.words += 1
+        mask = np.zeros(self.words, dtype='<u8')
+        for label in labels:
+            code = self.code_of[label]
+            mask[code // 64] |= np.uint64(1) << np.uint64(code % 64)
+        return mask
+
+    def apply(self, old, new):
+        if old is not None and new is None:
+            row = self.row_of.pop(old.trade_id)
+            self.masks[row] = 0
+            self.free.append(row)
+        elif new is not None:
+            mask = self._mask(new)
+            row = self.row_of.get(new.trade_id)
+            if row is None:
+                if self.free:
+                    row = self.free.pop()
+                else:
+                    row = len(self.masks)
+                    self.masks = np.vstack([self.masks, np.zeros((1, self.words), dtype='<u8')])
+                self.row_of[new.trade_id] = row
+            self.masks[row] = mask
+        self._aligned = None
+        for t in (old, new):
+            if t is not None:
+                self._cache = {k: v for k, v in self._cache.items()
+                               if k[1] != t.is_backtest or k[2] not in (None, str(t.account_type))}
+
+    @property
+    def frame(self):
+        return self.source.frame
+
+    def _frame_masks(self):
+        # Maski w kolejności wierszy ramki
+        if self._aligned is None:
+            self._aligned = self.masks[self.frame['trade_id'].map(self.row_of).to_numpy(np.int64)]
+        return self._aligned
+
+    def _rows(self, is_bt, acc):
+        mask = (self.frame['is_backtest'] == is_bt) & self.frame['is_valid']
+        if acc is not None:
+            mask &= self.frame['account_type'] == acc
+        return mask.to_numpy()
+
+    @staticmethod
+    def _finish(sums):
+        out = pd.DataFrame(index=sums.index)
+        out['trades'] = sums['trades'].astype(int)
+        out['win_rate'] = sums['wins'] / sums['trades'] * 100
+        out['expectancy'] = sums['pnl'] / sums['trades']
+        out['avg_rr'] = sums['rr'] / sums['trades']
+        out['net_pnl'] = sums['pnl']
+        return out.sort_values(['trades', 'net_pnl'], ascending=False)
+
+    def per_confluence(self, is_bt, acc=None):
+        key = ('single', is_bt, acc)
+        if key not in self._cache:
+            rows = self._rows(is_bt, acc)
+            df = self.frame[rows]
+            bits = np.unpackbits(self._frame_masks()[rows].view(np.uint8), axis=1, bitorder='little')[:, :len(self.vocab)]
+            values = np.column_stack([np.ones(len(df)), df['is_win'], df['pnl'], df['rr']]).astype(float)
+            sums = pd.DataFrame(bits.T.astype(float) @ values, index=pd.Index(self.vocab, name="Confluence"),
+                                columns=['trades', 'wins', 'pnl', 'rr'])
+            self._cache[key] = self._finish(sums[sums['trades'] > 0])
+        return self._cache[key]
+
+    def _label(self, words):
+        bits = np.unpackbits(np.array(words, dtype='<u8').view(np.uint8), bitorder='little')[:len(self.vocab)]
+        return " + ".join(self.vocab[i] for i in np.flatnonzero(bits)) or CONFLUENCE_NONE
+
+    def combinations(self, is_bt, acc=None):
+        key = ('combo', is_bt, acc)
+        if key not in self._cache:
+            rows = self._rows(is_bt, acc)
+            cols = [f"m{w}" for w in range(self.words)]
+            df = pd.DataFrame(self._frame_masks()[rows], columns=cols).assign(
+                wins=self.frame['is_win'].to_numpy()[rows], pnl=self.frame['pnl'].to_numpy()[rows],
+                rr=self.frame['rr'].to_numpy()[rows])
+            sums = df.groupby(cols, sort=False).agg(trades=('pnl', 'size'), wins=('wins', 'sum'), pnl=('pnl', 'sum'),
+                                                    rr=('rr', 'sum'))
+            labels = [self._label(words if isinstance(words, tuple) else (words,)) for words in sums.index]
+            sums.index = pd.Index(labels, name="Combination")
+            self._cache[key] = self._finish(sums)
+        return self._cache[key]
+
+    def snapshot(self):
+        bits = np.unpackbits(self.masks.view(np.uint8), axis=1, bitorder='little')
+        return {trade_id: sorted(self.vocab[i] for i in np.flatnonzero(bits[row]))
+                for trade_id, row in self.row_of.items()}
+
+
+if VERIFY_AGGREGATES:
+    mismatched = trade_store.check_derived()
+    if mismatched:
+        trade_store.reset_derived()
+        st.error(f"Agregaty przyrostowe rozjechały się z przeliczeniem od zera: {', '.join(mismatched)} - przebudowano.")
+
+all_trades = trade_store.trades()
+daily_index = trade_store.derived('daily_index', DailyIndex)
 
 
 # --- FUNKCJE CALLBACK ---
@@ -422,19 +2434,65 @@ def change_menu(opt):
         del st.session_state.history_filter_date
 
 
-def go_to_edit_mode(index):
-    st.session_state.editing_index = index
-    if st.session_state.all_trades[index].get('is_backtest', False):
+def go_to_edit_mode(trade_id):
+    trade = st.session_state.trade_store.get(trade_id)
+    if trade is None:
+        # Usunięta (albo skompaktowana) w innej karcie / na innym urządzeniu od wyrenderowania przycisku
+        st.session_state.editing_id = None
+        st.error("Tej transakcji już nie ma - została usunięta. Odśwież dane 🔄.")
+        return
+    st.session_state.editing_id = trade_id
+    if trade.is_backtest:
         st.session_state.menu_nav = "⏪ Backtesting"
         st.session_state.bt_nav_section = "Trade Entry"
     else:
         st.session_state.menu_nav = "📝 Daily Journal"
 
 
-def delete_trade(index):
-    if 0 <= index < len(st.session_state.all_trades):
-        st.session_state.all_trades.pop(index)
-        save_all_data(st.session_state.all_trades)
+def edited_trade_missing(form_edit_key):
+    # Edytowana transakcja zniknęła po otwarciu formularza (usunięta w innej karcie / na innym urządzeniu).
+    # Kończymy edycję zamiast zapisać formularz po cichu jako nową transakcję; wpisane dane zostają w formularzu.
+    trade_id = st.session_state.get('editing_id')
+    if trade_id is None or trade_id in st.session_state.trade_store:
+        return False
+    st.session_state.editing_id = None
+    st.session_state[form_edit_key] = None  # bez tego formularz wyczyściłby dodane konfluencje
+    st.error("Edytowanej transakcji już nie ma - została usunięta. Dane zostały w formularzu: "
+             "💾 ponownie zapisze je jako nową transakcję.")
+    return True
+
+
+def delete_trade(trade_id):
+    store = st.session_state.trade_store
+    removed = store.remove(trade_id)
+    if removed is not None:
+        # Nagrobek dostaje nową wersję, żeby usunięcie było widoczne dla odświeżania innych urządzeń
+        write_queue.submit('delete', [replace(removed, updated_at=new_version())], store,
+                          {trade_id: removed.updated_at})
+        publish_dataset(removed=[trade_id])
+
+
+def resolve_conflict(trade_id, keep_mine):
+    conflict = write_queue.resolve(trade_id, keep_mine)
+    if conflict is None:
+        return
+    op, mine, theirs, _ = conflict
+    if keep_mine:
+        if op != 'delete':
+            publish_dataset([mine])
+        return
+    # Wersja ze źródła zastępuje lokalną zmianę
+    store = st.session_state.trade_store
+    if theirs is None:
+        store.remove(trade_id)
+        publish_dataset(removed=[trade_id])
+        return
+    theirs = theirs.copy()
+    if trade_id in store:
+        store.update(trade_id, theirs)
+    else:
+        store.add(theirs)
+    publish_dataset([theirs])
 
 
 def go_to_history_for_day(target_date):
@@ -460,8 +2518,198 @@ def back_to_dashboard():
     st.session_state.menu_nav = "📊 Dashboard"
 
 
+# --- CACHE OBRAZKÓW (linki HTF/LTF) ---
+IMAGE_CACHE_DIR = storage_setting("image_cache_dir", ".image_cache")
+IMAGE_CACHE_MAX_BYTES = int(storage_setting("image_cache_mb", 200)) * 1024 * 1024
+IMAGE_FETCH_TIMEOUT = 10  # s
+IMAGE_FETCH_WORKERS = 4
+IMAGE_RENDER_WAIT = 1.0  # s; łącznie na wszystkie podglądy jednej sekcji - reszta dochodzi w tle
+IMAGE_BROKEN_RETRY = 7 * 24 * 3600  # s; zepsute linki (4xx, nie-obrazek) próbujemy ponownie dopiero po tygodniu
+IMAGE_TRANSIENT_RETRY = 60  # s; timeout / 5xx / brak sieci - krótka przerwa, bez zapisu w broken.json
+THUMB_WIDTH = 480
+TRADINGVIEW_SNAPSHOT = re.compile(r"tradingview\.com/x/([A-Za-z0-9]+)")
+
+
+def normalize_image_url(link):
+    img_url = link if link.startswith("http") else "https://" + link
+    # Link do strony snapshotu TradingView -> bezpośredni plik PNG
+    m = TRADINGVIEW_SNAPSHOT.search(img_url)
+    if m:
+        snap_id = m.group(1)
+        img_url = f"https://s3.tradingview.com/snapshots/{snap_id[0].lower()}/{snap_id}.png"
+    return img_url
+
+
+def is_permanent_http_error(error):
+    # 4xx poza timeoutem i limitem zapytań; 5xx, timeouty i brak sieci mijają same
+    return isinstance(error, urllib.error.HTTPError) and 400 <= error.code < 500 and error.code not in (408, 429)
+
+
+class ImageCache:
+    # Każdy link pobieramy raz: oryginał i miniatura leżą na dysku, eviction LRU po czasie modyfikacji
+    # (odświeżanym przy każdym odczycie). Trwale zepsute linki zapamiętujemy w broken.json, chwilowe błędy
+    # tylko w pamięci na IMAGE_TRANSIENT_RETRY. Pobrania idą w puli wątków (submit), nie w wątku skryptu.
+    def __init__(self, root, max_bytes):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+        self.sizes = {e.path: e.stat().st_size for e in os.scandir(root) if e.name.endswith(('.img', '.jpg'))}
+        self.broken_path = os.path.join(root, "broken.json")
+        try:
+            with open(self.broken_path) as f:
+                self.broken = json.load(f)
+        except (OSError, ValueError):
+            self.broken = {}
+        self.failed = {}  # url -> czas chwilowego błędu
+        self.pending = {}  # (url, thumbnail) -> Future trwającego pobrania
+        self.executor = concurrent.futures.ThreadPoolExecutor(IMAGE_FETCH_WORKERS, thread_name_prefix="image-fetch")
+
+    def _paths(self, url):
+        key = hashlib.sha1(url.encode()).hexdigest()
+        return os.path.join(self.root, key + ".img"), os.path.join(self.root, key + "_thumb.jpg")
+
+    def _read(self, path):
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+        except OSError:
+            return None
+        os.utime(path)
+        return data
+
+    def _write(self, path, data):
+        with open(path, 'wb') as f:
+            f.write(data)
+        self.sizes[path] = len(data)
+        total = sum(self.sizes.values())
+        if total <= self.max_bytes:
+            return
+        for old in sorted(self.sizes, key=lambda p: os.path.getmtime(p) if os.path.exists(p) else 0):
+            if old == path:
+                continue
+            total -= self.sizes.pop(old)
+            try:
+                os.remove(old)
+            except OSError:
+                pass
+            if total <= self.max_bytes:
+                break
+
+    def _mark_broken(self, url, permanent):
+        if not permanent:
+            self.failed[url] = time.time()
+            return
+        self.broken[url] = time.time()
+        with open(self.broken_path, 'w') as f:
+            json.dump(self.broken, f)
+
+    def is_broken(self, url):
+        now = time.time()
+        return (now - self.broken.get(url, -math.inf) < IMAGE_BROKEN_RETRY
+                or now - self.failed.get(url, -math.inf) < IMAGE_TRANSIENT_RETRY)
+
+    def _fetch(self, url):
+        req = urllib.request.Request(url, headers={"User-Agent": "Mozilla/5.0 (NQPaneksu Journal)"})
+        with urllib.request.urlopen(req, timeout=IMAGE_FETCH_TIMEOUT) as resp:
+            return resp.read()
+
+    def _thumbnail(self, data):
+        img = Image.open(io.BytesIO(data))
+        img.thumbnail((THUMB_WIDTH, THUMB_WIDTH * 4))
+        out = io.BytesIO()
+        img.convert("RGB").save(out, format="JPEG", quality=82, optimize=True)
+        return out.getvalue()
+
+    def get(self, url, thumbnail=False):
+        if self.is_broken(url):
+            return None
+        full_path, thumb_path = self._paths(url)
+        with self.lock:
+            data = self._read(thumb_path if thumbnail else full_path)
+            if data is not None:
+                return data
+            full = self._read(full_path)
+        if full is None:
+            try:
+                full = self._fetch(url)
+                Image.open(io.BytesIO(full)).verify()  # strona HTML zamiast obrazka też jest zepsutym linkiem
+            except Exception as e:
+                # Pobrana odpowiedź, która nie jest obrazkiem, to błąd trwały - tak jak 4xx
+                with self.lock:
+                    self._mark_broken(url, permanent=full is not None or is_permanent_http_error(e))
+                return None
+            with self.lock:
+                self._write(full_path, full)
+                self.broken.pop(url, None)
+                self.failed.pop(url, None)
+        if not thumbnail:
+            return full
+        try:
+            thumb = self._thumbnail(full)
+        except Exception:
+            return full
+        with self.lock:
+            self._write(thumb_path, thumb)
+        return thumb
+
+    def submit(self, url, thumbnail=False):
+        # Future z wynikiem get(); ten sam link w trakcie pobierania nie jest zlecany drugi raz
+        key = (url, thumbnail)
+        with self.lock:
+            future = self.pending.get(key)
+            if future is not None:
+                return future
+            future = self.pending[key] = self.executor.submit(self.get, url, thumbnail)
+        future.add_done_callback(lambda done: self._finished(key, done))
+        return future
+
+    def _finished(self, key, future):
+        with self.lock:
+            if self.pending.get(key) is future:
+                del self.pending[key]
+
+
+@st.cache_resource
+def get_image_cache():
+    return ImageCache(IMAGE_CACHE_DIR, IMAGE_CACHE_MAX_BYTES)
+
+
+def render_chart_image(img_url, data, full_size):
+    if data is None:
+        st.error("Nie udało się załadować podglądu (błędny link).")
+        st.markdown(f"🔗 [Otwórz link ręcznie]({img_url})")
+        return
+    st.image(data, use_container_width=True)
+    if not full_size:
+        st.markdown(f"<div style='font-size:0.75rem;text-align:right;margin-top:-8px;'><a href='{html.escape(img_url)}' target='_blank'>🔍 Pełny rozmiar</a></div>",
+                    unsafe_allow_html=True)
+
+
+@st.fragment(run_every=1)
+def render_pending_image(img_url, full_size):
+    # Podgląd, który nie zdążył w IMAGE_RENDER_WAIT: sprawdzany co 1 s, po pobraniu (albo błędzie) jeden pełny
+    # rerun - strona bierze obrazek już z dysku i nie wstawia fragmentu (koniec odpytywania)
+    if get_image_cache().submit(img_url, thumbnail=not full_size).done():
+        st.rerun()
+    st.caption(f"⏳ Ładowanie podglądu… [otwórz link]({img_url})")
+
+
+def render_chart_links(links, full_size=False):
+    # Pobieranie w puli wątków; skrypt czeka na całą sekcję najwyżej IMAGE_RENDER_WAIT, więc martwy host nie blokuje strony
+    cache = get_image_cache()
+    urls = [normalize_image_url(link) for link in links]
+    futures = [cache.submit(url, thumbnail=not full_size) for url in urls]
+    concurrent.futures.wait(futures, timeout=IMAGE_RENDER_WAIT)
+    for img_url, future in zip(urls, futures):
+        if future.done():
+            render_chart_image(img_url, future.result(), full_size)
+        else:
+            render_pending_image(img_url, full_size)
+
+
 # Ujednolicony rendering zawartości transakcji (odporny na zepsute linki, całkowicie bez filtra http)
-def render_trade_content(t):
+def render_trade_content(t, full_size=False):
     if str(t.get('notes', '')).strip(): st.info(f"**📝 Notes:**\n{t['notes']}")
     cm1, cm2 = st.columns(2)
     if str(t.get('model_mistakes', '')).strip(): cm1.error(f"**🚫 Model Mistakes:**\n{t['model_mistakes']}")
@@ -475,24 +2723,12 @@ def render_trade_content(t):
         valid_htf = [str(l).strip() for l in t.get('htf_links', []) if str(l).strip()]
         if valid_htf:
             st.markdown("#### 🏛️ HTF Links")
-            for link in valid_htf:
-                img_url = link if link.startswith("http") else "https://" + link
-                try:
-                    st.image(img_url, use_container_width=True)
-                except Exception:
-                    st.error("Nie udało się załadować podglądu (błędny link).")
-                    st.markdown(f"🔗 [Otwórz link ręcznie]({img_url})")
+            render_chart_links(valid_htf, full_size)
     with c_ltf:
         valid_ltf = [str(l).strip() for l in t.get('ltf_links', []) if str(l).strip()]
         if valid_ltf:
             st.markdown("#### ⚡ LTF Links")
-            for link in valid_ltf:
-                img_url = link if link.startswith("http") else "https://" + link
-                try:
-                    st.image(img_url, use_container_width=True)
-                except Exception:
-                    st.error("Nie udało się załadować podglądu (błędny link).")
-                    st.markdown(f"🔗 [Otwórz link ręcznie]({img_url})")
+            render_chart_links(valid_ltf, full_size)
 
     # Kompatybilność wsteczna (stare notatki)
     if t.get('general_notes') or t.get('htf_desc') or t.get('ltf_desc') or t.get('mood'):
@@ -532,11 +2768,362 @@ def render_trade_details(t):
         acc_label = t.get('account_type', 'Funded') if not t.get('is_backtest') else "Backtesting"
         st.caption(f"🕒 {t['time']} | 🔄 {t['trade_type']} | 🎯 {t['outcome']} | 💼 {acc_label} | RR: {t.get('rr', 0.0)}")
 
-        render_trade_content(t)
+        render_trade_content(t, full_size=True)
+
+
+def render_headline_metrics(stats, show_days=False):
+    cols = st.columns(7 if show_days else 6)
+    cols[0].metric("Net P&L", f"{stats['net_pnl']:+.1f} $")
+    cols[1].metric("Win Rate", f"{stats['win_rate']:.1f}%")
+    cols[2].metric("Avg Win", f"{stats['avg_win']:+.1f} $")
+    cols[3].metric("Avg Loss", f"{-stats['avg_loss'] or 0.0:+.1f} $")
+    pf_display = "∞" if stats['profit_factor'] == float('inf') else f"{stats['profit_factor']:.2f}"
+    cols[4].metric("Profit Factor", pf_display)
+    cols[5].metric("Trades", int(stats['trades']))
+    if show_days:
+        cols[6].metric("Days", int(stats['days']))
+
+
+def render_stats_breakdown(engine, is_bt, acc, key_prefix):
+    with st.expander("📊 Breakdown"):
+        dim_label = st.radio("Group by", list(STAT_DIMENSIONS), horizontal=True, label_visibility="collapsed",
+                             key=f"{key_prefix}_breakdown_dim")
+        table = engine.breakdown(STAT_DIMENSIONS[dim_label], is_bt, acc)
+        table = table[['net_pnl', 'trades', 'win_rate', 'avg_win', 'avg_loss', 'profit_factor', 'rr']].rename(columns={
+            'net_pnl': "Net P&L", 'trades': "Trades", 'win_rate': "Win Rate %", 'avg_win': "Avg Win",
+            'avg_loss': "Avg Loss", 'profit_factor': "Profit Factor", 'rr': "RR"})
+        st.dataframe(table.style.format(precision=2), use_container_width=True)
+
+
+def render_equity_analytics(engine, is_bt, acc, key_prefix):
+    with st.expander("📈 Equity & Drawdown"):
+        window = st.radio("Rolling window", EQUITY_WINDOWS, index=1, horizontal=True, key=f"{key_prefix}_equity_window",
+                          format_func=lambda w: f"{w} trades")
+        curve, summary = engine.curve(is_bt, acc, window)
+        if curve.empty:
+            st.info("Brak transakcji do narysowania krzywej kapitału.")
+            return
+        pf = summary['rolling_profit_factor']
+        cols = st.columns(5)
+        cols[0].metric("Max Drawdown", f"${summary['max_drawdown']:,.2f}")
+        cols[1].metric("Max DD Duration", f"{summary['max_dd_days']} d")
+        cols[2].metric("Current DD", f"${summary['current_drawdown']:,.2f}", f"{summary['current_dd_days']} d",
+                       delta_color="off")
+        cols[3].metric(f"Win Rate ({window})", f"{summary['rolling_win_rate']:.1f}%")
+        cols[4].metric(f"Profit Factor ({window})", "∞" if pf == float('inf') else f"{pf:.2f}")
+        chart = downsample_minmax(curve, ['equity', 'drawdown'], EQUITY_MAX_POINTS)
+        st.line_chart(chart, x='date', y=['equity', 'drawdown'], color=[current_theme['accent'], "#f43f5e"])
+        rolling = downsample_minmax(curve, ['win_rate', 'profit_factor'], EQUITY_MAX_POINTS)
+        cols = st.columns(2)
+        cols[0].caption(f"Rolling win rate % ({window})")
+        cols[0].line_chart(rolling, x='date', y='win_rate', color=current_theme['accent'], height=200)
+        cols[1].caption(f"Rolling profit factor ({window})")
+        cols[1].line_chart(rolling, x='date', y='profit_factor', color="#1fd6a5", height=200)
+
+
+def render_confluence_analytics(engine, is_bt, acc, key_prefix):
+    with st.expander("🧩 Confluences"):
+        c_mode, c_min = st.columns([3, 1])
+        mode = c_mode.radio("View", ["Per confluence", "Combinations"], horizontal=True, label_visibility="collapsed",
+                            key=f"{key_prefix}_conf_mode")
+        min_trades = c_min.number_input("Min trades", min_value=1, value=1, step=1, key=f"{key_prefix}_conf_min")
+        table = engine.per_confluence(is_bt, acc) if mode == "Per confluence" else engine.combinations(is_bt, acc)
+        table = table[table['trades'] >= min_trades]
+        if table.empty:
+            st.info("Brak transakcji z konfluencjami.")
+            return
+        table = table.rename(columns={'trades': "Trades", 'win_rate': "Win Rate %", 'expectancy': "Expectancy $",
+                                      'avg_rr': "Avg RR", 'net_pnl': "Net P&L"})
+        st.dataframe(table.style.format(precision=2), use_container_width=True)
+
+
+def render_backtest_import():
+    st.subheader("📥 Import")
+    st.caption("CSV albo Parquet w układzie kolumn arkusza (date, asset, direction, pnl, rr, confluences, ...); "
+               "wymagane: date i pnl. Wiersze trafiają do backtestu, powtórzone transakcje są pomijane.")
+    upload = st.file_uploader("Plik", type=["csv", "parquet"], key="bt_import_file")
+    if not st.button("📥 IMPORTUJ", use_container_width=True, key="bt_import_run", disabled=upload is None):
+        return
+    bar = st.progress(0.0, text="Wczytywanie…")
+    result = parse_import_file(upload, upload.name, st.session_state.trade_store.trades(), lambda done, r: bar.progress(
+        done, text=f"{r.rows} wierszy · {len(r.added)} nowych · {r.duplicates} duplikatów"))
+    if result.error:
+        # Zapis jest na końcu, więc przerwany import niczego nie zostawia w dzienniku
+        st.error(f"Import przerwany, nic nie zapisano: {result.error}")
+    else:
+        if result.added:
+            add_trades(result.added)
+        bar.progress(1.0, text="Gotowe")
+        st.success(f"Zaimportowano {len(result.added)} z {result.rows} wierszy · duplikaty: {result.duplicates} · "
+                   f"odrzucone (data / pnl / kierunek): {result.rejected}")
+    if result.warnings:
+        with st.expander(f"⚠️ Ostrzeżenia ({len(result.warnings)})"):
+            st.text("\n".join(result.warnings))
+
+
+def sync_status_html():
+    pending, failures, last_error, conflicts = write_queue.status()
+    if failures:
+        return (f"<div title='{html.escape(last_error or '')}' style='font-size:0.78rem;color:#f43f5e;text-align:right;margin-top:10px;'>"
+                f"⚠️ Błąd zapisu · ponawiam ({pending})</div>")
+    if conflicts:
+        # Zapis odrzucony przez kontrolę wersji - nie jest "zapisany", dopóki użytkownik nie wybierze wersji
+        return (f"<div title='Wybierz wersję w panelu konfliktu' style='font-size:0.78rem;color:#f59e0b;text-align:right;margin-top:10px;'>"
+                f"⚔️ Konflikt zapisu ({conflicts})</div>")
+    if pending:
+        return (f"<div style='font-size:0.78rem;color:{current_theme['text_secondary']};text-align:right;margin-top:10px;'>"
+                f"⏳ Zapisywanie… ({pending})</div>")
+    return f"<div style='font-size:0.78rem;color:{current_theme['text_secondary']};text-align:right;margin-top:10px;'>✅ Zapisano</div>"
+
+
+@st.fragment(run_every=2)
+def render_live_sync_status():
+    # Odświeżany co 2 s, dopóki kolejka zapisu ma zaległe operacje. Po opróżnieniu jeden pełny rerun: nagłówek
+    # nie wstawia już fragmentu (koniec odpytywania), a strona pokazuje wynik zapisu, np. panel konfliktu.
+    pending, failures, _, _ = write_queue.status()
+    if not pending and not failures:
+        st.rerun()
+    st.markdown(sync_status_html(), unsafe_allow_html=True)
+
+
+HISTORY_PAGE_SIZES = [10, 25, 50, 100]
+
+
+# --- KOMPONENT KALENDARZA ---
+# Cały miesiąc (albo heatmapa roku) to jeden blok HTML; kliknięcie dnia wraca do Pythona jednym kanałem (trigger "day")
+CALENDAR_JS = """
+export default function(component) {
+    const { data, parentElement, setTriggerValue } = component;
+    parentElement.innerHTML = data.html;
+    parentElement.onclick = (event) => {
+        const cell = event.target.closest('[data-date]');
+        if (cell) setTriggerValue('day', cell.dataset.date);
+    };
+}
+"""
+calendar_component = st.components.v2.component("journal_calendar", js=CALENDAR_JS, isolate_styles=False)
+CALENDAR_WEEKDAYS = ["Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun"]
+
+
+def calendar_colors(value):
+    # (tło, ramka, kolor PnL) dla zielonej / czerwonej karty
+    dark = st.session_state.theme == "Dark"
+    if value > 0:
+        return ("rgba(31, 214, 165, 0.12)" if dark else "#dcfce7"), ("#1fd6a5" if dark else "#059669"), (
+            "#1fd6a5" if dark else "#065f46")
+    return ("rgba(244, 63, 94, 0.12)" if dark else "#fee2e2"), ("#f43f5e" if dark else "#e11d48"), (
+        "#f43f5e" if dark else "#9f1239")
+
+
+def calendar_day_html(curr_date, agg, is_bt):
+    dark = st.session_state.theme == "Dark"
+    bg_c, bor_c, txt_c, pnl_c = current_theme['bg_card'], current_theme['border'], current_theme['text_primary'], \
+        current_theme['text_secondary']
+    pnl_disp, badge = "", ""
+
+    if agg['entries']:
+        day_pnl, day_rr = agg['pnl'], agg['rr']
+        if agg['trades'] > 0:
+            if is_bt:
+                b_bg, b_txt = ("#2d2d3a", "#ccc") if dark else ("#e0e7ff", "#4338ca")
+            else:
+                b_bg, b_txt = ("#1d1e30", "#a78bfa") if dark else ("#ede9fe", "#5b21b6")
+            badge = f"<span style='font-size:0.75em;color:{b_txt};background:{b_bg};padding:1px 4px;border-radius:4px;'>{agg['trades']}x</span>"
+
+        rr_line = f"<br><span style='font-size:0.85em;color:{txt_c};font-weight:normal;'>RR: {day_rr:.2f}</span>"
+        if agg['no_trade'] and day_pnl == 0:
+            bg_c, bor_c, pnl_c = ("rgba(142, 142, 147, 0.15)" if dark else "#f3f4f6"), "#8e8e93", "#8e8e93"
+            pnl_disp = "⚪ No Trade"
+        elif day_pnl > 0:
+            bg_c, bor_c, pnl_c = calendar_colors(day_pnl)
+            pnl_disp = f"🟢 +{day_pnl:.1f} ${rr_line}"
+        elif day_pnl < 0:
+            bg_c, bor_c, pnl_c = calendar_colors(day_pnl)
+            pnl_disp = f"🔴 {day_pnl:.1f} ${rr_line}"
+        elif day_rr > 0:
+            bg_c, bor_c, pnl_c = calendar_colors(day_rr)
+            pnl_disp = f"🟢 {day_pnl:.1f} $<br><span style='font-size:0.85em;color:{txt_c};font-weight:normal;'>RR: +{day_rr:.2f}</span>"
+        elif day_rr < 0:
+            bg_c, bor_c, pnl_c = calendar_colors(day_rr)
+            pnl_disp = f"🔴 {day_pnl:.1f} ${rr_line}"
+        else:
+            bg_c, bor_c, pnl_c = "rgba(142, 142, 147, 0.15)", "#8e8e93", "#8e8e93"
+            pnl_disp = f"⚪ {day_pnl:.1f} ${rr_line}"
+
+    return f"""<div class="day-card" data-date="{curr_date.isoformat()}" style="background-color: {bg_c}; border-color: {bor_c};"><div style="display:flex;justify-content:space-between;align-items:flex-start;"><div style="font-weight:bold;font-size:0.95em;color:{txt_c};">{curr_date.day}</div><div>{badge}</div></div><div style="font-weight:bold;font-size:0.85em;color:{pnl_c};text-align:center;line-height:1.1;margin-top:-5px;">{pnl_disp}</div></div>"""
+
+
+def calendar_week_html(target_date, agg):
+    bg_c, bor_c, txt_c, pnl_c = current_theme['bg_card'], current_theme['border'], current_theme['text_primary'], \
+        current_theme['text_secondary']
+    if agg['pnl'] != 0:
+        bg_c, bor_c, pnl_c = calendar_colors(agg['pnl'])
+    return f"""<div class="day-card" data-date="{target_date.isoformat()}" style="background-color: {bg_c}; border-color: {bor_c}; justify-content: center; align-items: center;"><div class="weekly-summary-title" style="color: {txt_c};">Weekly PnL</div><div class="weekly-summary-value" style="color: {pnl_c}; text-align: center;">{agg['pnl']:+.1f} $<br><span style="font-size: 0.85em; color: {txt_c}; font-weight: normal;">RR: {agg['rr']:.2f}</span></div></div>"""
+
+
+def month_calendar_html(view_year, view_month, is_bt, acc=None):
+    cells = [f"<div class='cal-head'>{d}</div>" for d in CALENDAR_WEEKDAYS]
+    for week in calendar.monthcalendar(view_year, view_month):
+        ref_day = next(d for d in week if d != 0)
+        week_start_date = date(view_year, view_month, ref_day) - timedelta(days=week.index(ref_day))
+        for i, day in enumerate(week[:6]):
+            if day == 0:
+                cells.append("<div></div>")
+            else:
+                curr_date = date(view_year, view_month, day)
+                cells.append(calendar_day_html(curr_date, daily_index.day(curr_date, is_bt, acc), is_bt))
+        # Niedziela = podsumowanie tygodnia; kliknięcie otwiera niedzielę (również spoza miesiąca)
+        cells.append(calendar_week_html(week_start_date + timedelta(days=6),
+                                        daily_index.week(week_start_date, is_bt, acc)))
+    return f"<div class='cal-grid'>{''.join(cells)}</div>"
+
+
+def open_calendar_day(key, is_backtest):
+    picked = st.session_state[key].get('day')
+    if picked:
+        go_to_day_view(datetime.strptime(picked, '%Y-%m-%d').date(), is_backtest)
+
+
+def mount_calendar(html_block, is_bt, key):
+    calendar_component(data={"html": html_block}, key=key, on_day_change=lambda: open_calendar_day(key, is_bt))
+
+
+def render_month_calendar(view_year, view_month, is_bt, acc=None, key="calendar"):
+    mount_calendar(month_calendar_html(view_year, view_month, is_bt, acc), is_bt, key)
+
+
+# --- HEATMAPA ROCZNA ---
+HEATMAP_CELL = 12
+HEATMAP_GAP = 3
+HEATMAP_LEVELS = 4
+
+
+class YearHeatmap:
+    # Dzienne sumy z wspólnej TradeFrame; SVG roku cache'owany per (rok, typ, motyw), więc przełączanie lat
+    # to tylko odczyt gotowego napisu. Po zmianie transakcji sumy liczone od nowa przy następnym odczycie,
+    # a z cache wypadają tylko jej lata (wszystkie - gdy zmieni się wspólna skala).
+    uses_frame = True
+
+    def __init__(self, trades, frame):
+        self.source = frame
+        self.daily, self.scale = {}, {}
+        self._touched = set()  # (rok, is_backtest) zmienione od ostatniego przeliczenia
+        self._cache = {}
+        self._aggregate()
+
+    def _aggregate(self):
+        frame = self.source.frame.dropna(subset=['date'])
+        frame = frame.assign(day=frame['date'].dt.normalize())
+        for is_bt in (False, True):
+            daily = frame[frame['is_backtest'] == is_bt].groupby('day').agg(
+                pnl=('pnl', 'sum'), trades=('is_valid', 'sum'), entries=('pnl', 'size'))
+            self.daily[is_bt] = daily
+            # Wspólna skala dla wszystkich lat: 90. percentyl |PnL| dni z wynikiem
+            abs_pnl = daily['pnl'].abs()
+            abs_pnl = abs_pnl[abs_pnl > 0]
+            scale = float(abs_pnl.quantile(0.9)) if len(abs_pnl) else 1.0
+            if self.scale.get(is_bt, scale) != scale:
+                self._cache = {k: v for k, v in self._cache.items() if k[1] != is_bt}
+            self.scale[is_bt] = scale
+        self._cache = {k: v for k, v in self._cache.items() if k[:2] not in self._touched}
+        self._touched = set()
+        self._dirty = False
+
+    def apply(self, old, new):
+        self._dirty = True
+        for t in (old, new):
+            if t is not None and t.date is not None:
+                self._touched.add((t.date.year, t.is_backtest))
+
+    def _refresh(self):
+        if self._dirty:
+            self._aggregate()
+
+    def snapshot(self):
+        self._refresh()
+        return {is_bt: daily.round(6).to_dict('index') for is_bt, daily in self.daily.items()}
+
+    def svg(self, year, is_bt):
+        self._refresh()
+        key = (year, is_bt, st.session_state.theme)
+        if key not in self._cache:
+            self._cache[key] = self._render(year, is_bt)
+        return self._cache[key]
+
+    def _render(self, year, is_bt):
+        dark = st.session_state.theme == "Dark"
+        days = pd.date_range(date(year, 1, 1), date(year, 12, 31))
+        year_days = self.daily[is_bt].reindex(days)
+        pnl = year_days['pnl'].fillna(0.0).to_numpy()
+        trades = year_days['trades'].fillna(0).to_numpy().astype(int)
+        active = year_days['entries'].notna().to_numpy()
+
+        # Binning wektorowo: kolumna = tydzień (od poniedziałku), wiersz = dzień tygodnia, poziom = |PnL| / skala
+        weekday = days.weekday.to_numpy()
+        week_col = (np.arange(len(days)) + weekday[0]) // 7
+        level = np.clip(np.ceil(np.abs(pnl) / self.scale[is_bt] * HEATMAP_LEVELS), 1, HEATMAP_LEVELS).astype(int)
+
+        greens = ["#0e4d3c", "#13795c", "#18a57c", "#1fd6a5"] if dark else ["#bbf7d0", "#6ee7b7", "#10b981", "#047857"]
+        reds = ["#5c1a2a", "#8f1f3a", "#c2284b", "#f43f5e"] if dark else ["#fecdd3", "#fda4af", "#f43f5e", "#be123c"]
+        empty_c = current_theme['bg_card']
+        neutral_c = "#8e8e93"
+        colors = np.where(~active, empty_c,
+                          np.where(pnl > 0, np.take(greens, level - 1),
+                                   np.where(pnl < 0, np.take(reds, level - 1), neutral_c)))
+
+        step = HEATMAP_CELL + HEATMAP_GAP
+        left, top = 30, 16
+        x = left + week_col * step
+        y = top + weekday * step
+        cells = []
+        for d, cx, cy, color, is_active, day_pnl, n in zip(days, x, y, colors, active, pnl, trades):
+            if is_active:
+                iso = d.date().isoformat()
+                cells.append(f"<rect data-date='{iso}' x='{cx}' y='{cy}' width='{HEATMAP_CELL}' height='{HEATMAP_CELL}' rx='2' fill='{color}'>"
+                             f"<title>{iso}: {day_pnl:+.1f} $ · {n}x</title></rect>")
+            else:
+                cells.append(f"<rect x='{cx}' y='{cy}' width='{HEATMAP_CELL}' height='{HEATMAP_CELL}' rx='2' fill='{color}' "
+                             f"stroke='{current_theme['border']}'/>")
+
+        txt_c = current_theme['text_secondary']
+        labels = [f"<text x='{left + week_col[d.dayofyear - 1] * step}' y='{top - 5}'>{calendar.month_abbr[d.month]}</text>"
+                  for d in pd.date_range(date(year, 1, 1), periods=12, freq='MS')]
+        labels += [f"<text x='0' y='{top + row * step + HEATMAP_CELL - 2}'>{CALENDAR_WEEKDAYS[row]}</text>" for row in (0, 2, 4)]
+        width = left + (int(week_col[-1]) + 1) * step
+        height = top + 7 * step
+        return (f"<svg class='cal-heatmap' viewBox='0 0 {width} {height}' width='100%' "
+                f"style='font-size:9px;fill:{txt_c};'>{''.join(labels)}{''.join(cells)}</svg>")
+
+
+def render_year_heatmap(heatmap, year, is_bt):
+    year_agg = daily_index.year(year, is_bt)
+    summary = f"{year_agg['pnl']:+.1f} $ · RR: {year_agg['rr']:.2f} · {year_agg['trades']}x" if year_agg['entries'] else "—"
+    st.markdown(
+        f"<h4 style='color: {current_theme['accent']}; margin: 10px 0 4px 0;'>{year} "
+        f"<span style='font-size:0.75em;color:{current_theme['text_secondary']};'>{summary}</span></h4>",
+        unsafe_allow_html=True)
+    mount_calendar(heatmap.svg(year, is_bt), is_bt, key=f"yc_heatmap_{year}")
+
+
+NOTES_CHUNK = 10
+
+
+def render_search_truncation(index, query):
+    for token, count in index.truncated(query):
+        st.caption(f"⚠️ „{token}” pasuje do {count} słów - szukano wśród {SEARCH_MAX_EXPANSIONS} najczęstszych. "
+                   f"Wpisz dłuższy fragment, żeby zawęzić wyniki.")
+
+
+def load_more_history(step):
+    st.session_state.history_visible += step
+
+
+def load_more_notes():
+    st.session_state.notes_visible += NOTES_CHUNK
 
 
 # --- UI: TOP NAVBAR & WŁASNE MENU ---
-head_col1, head_col2 = st.columns([20, 1])
+head_col1, head_col_status, head_col_refresh, head_col2 = st.columns([17, 2, 1, 1])
 with head_col1:
     st.markdown(
         f"""<div style='display:flex;align-items:center;gap:10px;margin-top:-8px;margin-bottom:2px;'>
@@ -544,6 +3131,17 @@ with head_col1:
             <h2 style='margin:0;font-size:1.35rem;font-weight:800;letter-spacing:-0.5px;color:{current_theme['text_primary']};line-height:1;'>NQPaneksu <span style='color:{current_theme['accent']};'>Journal</span></h2>
         </div>""",
         unsafe_allow_html=True)
+with head_col_status:
+    queued, write_failures, _, write_conflict_count = write_queue.status()
+    if queued or write_failures:
+        render_live_sync_status()
+    elif write_conflict_count:
+        st.markdown(sync_status_html(), unsafe_allow_html=True)
+    if AUTO_REFRESH:
+        render_auto_refresh()
+with head_col_refresh:
+    last_latency = f" (ostatni odczyt: {repository.last_load.latency:.2f} s)" if repository.last_load else ""
+    st.button("🔄", key="refresh_data", help=f"Odśwież dane z arkusza{last_latency}", on_click=refresh_data)
 with head_col2:
     btn_icon = "☀️" if st.session_state.theme == "Dark" else "🌙"
     if st.button(btn_icon, key="theme_toggle"):
@@ -563,14 +3161,39 @@ for i, option in enumerate(menu_options):
 
 menu = st.session_state.menu_nav
 
+load_result = st.session_state.get('load_result')
+if load_result is not None and not load_result.ok:
+    fallback = ("Pokazuję ostatnią wczytaną wersję." if trade_store.complete else
+                "Widoczne są tylko zmiany z tej sesji - zapisy trafią do arkusza bez nadpisywania istniejących wierszy.")
+    st.error(f"Nie udało się wczytać dziennika ({load_result.attempts} próby, {load_result.latency:.1f} s): "
+             f"{load_result.error}. {fallback} Spróbuj ponownie przyciskiem 🔄.")
+write_conflicts = write_queue.conflict_list()
+if write_conflicts:
+    st.warning(f"⚠️ Konflikt zapisu ({len(write_conflicts)}): te transakcje zmieniono w międzyczasie na innym urządzeniu "
+               f"lub w innej karcie. Wybierz, która wersja ma zostać.")
+    for conflict_id, (conflict_op, mine, theirs, _) in write_conflicts:
+        c_info, c_mine, c_theirs = st.columns([6, 1.5, 1.5])
+        mine_desc = "usunięcie" if conflict_op == 'delete' else f"{mine['pnl']:+.1f} $ · {mine['outcome']}"
+        theirs_desc = "usunięta" if theirs is None else f"{theirs['pnl']:+.1f} $ · {theirs['outcome']}"
+        c_info.markdown(f"**{mine['date']} · {mine['asset']} · {mine['direction']}** — "
+                        f"moja wersja: {mine_desc}; w arkuszu: {theirs_desc}")
+        c_mine.button("Zachowaj moją", key=f"conflict_mine_{conflict_id}", on_click=resolve_conflict,
+                      args=(conflict_id, True), use_container_width=True)
+        c_theirs.button("Weź z arkusza", key=f"conflict_theirs_{conflict_id}", on_click=resolve_conflict,
+                        args=(conflict_id, False), use_container_width=True)
+last_load = repository.last_load
+if last_load is not None and last_load.warnings:
+    with st.expander(f"⚠️ Błędne wartości w danych ({len(last_load.warnings)}) - przyjęto wartości domyślne"):
+        st.code("\n".join(last_load.warnings), language=None)
+
 # --- DAY VIEW ---
 if st.session_state.get('day_view_date'):
     dv_date = st.session_state.day_view_date
     dv_is_bt = st.session_state.get('day_view_is_backtest', False)
-    dv_trades = [t for t in all_trades if t['date'] == str(dv_date) and t.get('is_backtest', False) == dv_is_bt]
-    dv_pnl = sum(t['pnl'] for t in dv_trades)
-    dv_rr = sum(t.get('rr', 0.0) for t in dv_trades)
-    dv_valid = [t for t in dv_trades if t.get('direction') != 'No Trade']
+    dv_agg = daily_index.day(dv_date, dv_is_bt)
+    dv_trades = [trade_store.get(tid) for tid in dv_agg['ids']]
+    dv_pnl = dv_agg['pnl']
+    dv_rr = dv_agg['rr']
 
     back_col, title_col = st.columns([1, 5])
     back_col.button("← Wróć", key="dv_back", use_container_width=True,
@@ -584,7 +3207,7 @@ if st.session_state.get('day_view_date'):
         pnl_sign = "+" if dv_pnl > 0 else ""
         st.markdown(
             f"<div style='display:flex;gap:24px;padding:10px 14px;background:{current_theme['bg_card']};border:1px solid {current_theme['border']};border-radius:10px;margin-bottom:16px;'>"
-            f"<span style='color:{current_theme['text_secondary']};font-size:0.85em;'>Trades: <b style='color:{current_theme['text_primary']};'>{len(dv_valid)}</b></span>"
+            f"<span style='color:{current_theme['text_secondary']};font-size:0.85em;'>Trades: <b style='color:{current_theme['text_primary']};'>{dv_agg['trades']}</b></span>"
             f"<span style='color:{current_theme['text_secondary']};font-size:0.85em;'>Net P&L: <b style='color:{pnl_color};'>{pnl_sign}{dv_pnl:.1f} $</b></span>"
             f"<span style='color:{current_theme['text_secondary']};font-size:0.85em;'>RR: <b style='color:{current_theme['text_primary']};'>{dv_rr:.2f}</b></span>"
             f"</div>",
@@ -594,191 +3217,69 @@ if st.session_state.get('day_view_date'):
             st.divider()
     else:
         st.info("Brak wpisów na ten dzień.")
+    reconcile_cold_start()
     st.stop()
 
 # --- DASHBOARD ---
 if menu == "📊 Dashboard":
     c_t, c_f, c_y, c_m = st.columns([1.5, 2.5, 1, 1])
-    c_t.markdown(f"<h3 style='margin-top:-12px;font-size:1.05rem;font-weight:700;letter-spacing:-0.2px;'>📊 Dashboard</h3>", unsafe_allow_html=True)
+    c_t.markdown("<h3 style='margin-top:-12px;font-size:1.05rem;font-weight:700;letter-spacing:-0.2px;'>📊 Dashboard</h3>", unsafe_allow_html=True)
     account_filter = c_f.radio("Filter", ["All", "Funded", "Evaluation"], horizontal=True, label_visibility="collapsed")
     view_year = c_y.selectbox("Year", range(2000, 2031), index=range(2000, 2031).index(datetime.now().year),
                               label_visibility="collapsed")
     view_month = c_m.selectbox("Month", range(1, 13), index=datetime.now().month - 1, label_visibility="collapsed")
 
     if all_trades:
-        base_trades = [t for t in all_trades if not t.get('is_backtest', False)]
-        if account_filter == "All":
-            filtered_trades = base_trades
-        else:
-            filtered_trades = [t for t in base_trades if t.get('account_type', 'Funded') == account_filter]
-
-        df = pd.DataFrame(filtered_trades)
-
-        if not df.empty:
-            df['date'] = pd.to_datetime(df['date'])
-            total_pnl = df['pnl'].sum()
-            total_valid = len(df[df['direction'] != 'No Trade'])
-            wins_df = df[df['pnl'] > 0]
-            losses_df = df[df['pnl'] < 0]
-            wins_count = len(wins_df)
-            losses_count = len(losses_df)
-            gross_profit = wins_df['pnl'].sum()
-            gross_loss = abs(losses_df['pnl'].sum())
-
-            wr = (wins_count / total_valid * 100) if total_valid > 0 else 0
-            avg_win = (gross_profit / wins_count) if wins_count > 0 else 0
-            avg_loss = (gross_loss / losses_count) if losses_count > 0 else 0
-            profit_factor = (gross_profit / gross_loss) if gross_loss > 0 else (
-                float('inf') if gross_profit > 0 else 0.0)
-
-            c1, c2, c3, c4, c5, c6 = st.columns(6)
-            c1.metric("Net P&L", f"{total_pnl:+.1f} $")
-            c2.metric("Win Rate", f"{wr:.1f}%")
-            c3.metric("Avg Win", f"{avg_win:+.1f} $")
-            c4.metric("Avg Loss", f"{-avg_loss:+.1f} $")
-            pf_display = "∞" if profit_factor == float('inf') else f"{profit_factor:.2f}"
-            c5.metric("Profit Factor", pf_display)
-            c6.metric("Trades", total_valid)
+        stats_engine = trade_store.derived('stats_engine', StatsEngine)
+        cal_acc = None if account_filter == "All" else account_filter
+        stats = stats_engine.headline(False, cal_acc)
+
+        if stats['entries'] > 0:
+            render_headline_metrics(stats)
+            render_stats_breakdown(stats_engine, False, cal_acc, "dash")
+            render_equity_analytics(trade_store.derived('equity_engine', EquityEngine), False, cal_acc, "dash")
+            render_confluence_analytics(trade_store.derived('confluence_engine', ConfluenceEngine), False, cal_acc, "dash")
         else:
             st.info(f"Brak danych dla wybranego filtru: {account_filter}")
 
         st.markdown("<div style='height: 10px;'></div>", unsafe_allow_html=True)
-        cal = calendar.monthcalendar(view_year, view_month)
-
-        cols = st.columns(7)
-        days_header = ["Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun"]
-        for i, d in enumerate(days_header):
-            cols[i].markdown(
-                f"<center><b style='color:{current_theme['text_secondary']}; font-size: 0.85em;'>{d}</b></center>",
-                unsafe_allow_html=True)
-
-        for week in cal:
-            ref_day = next((d for d in week if d != 0), None)
-            weekly_pnl = 0.0
-            weekly_rr = 0.0
-            week_end_date = None
-            if ref_day:
-                ref_date = date(view_year, view_month, ref_day)
-                day_idx = week.index(ref_day)
-                week_start_date = ref_date - timedelta(days=day_idx)
-                week_end_date = week_start_date + timedelta(days=6)
-                week_trades = [t for t in filtered_trades if
-                               week_start_date <= datetime.strptime(t['date'], '%Y-%m-%d').date() <= week_end_date]
-                weekly_pnl = sum(t['pnl'] for t in week_trades)
-                weekly_rr = sum(t.get('rr', 0.0) for t in week_trades)
-
-            cols = st.columns(7)
-            for i, day in enumerate(week):
-                if i == 6:
-                    bg_c, bor_c, txt_c, pnl_c = current_theme['bg_card'], current_theme['border'], current_theme[
-                        'text_primary'], current_theme['text_secondary']
-                    if weekly_pnl > 0:
-                        bg_c, bor_c, pnl_c = (
-                            "rgba(31, 214, 165, 0.12)" if st.session_state.theme == "Dark" else "#dcfce7"), (
-                            "#1fd6a5" if st.session_state.theme == "Dark" else "#059669"), (
-                            "#1fd6a5" if st.session_state.theme == "Dark" else "#065f46")
-                    elif weekly_pnl < 0:
-                        bg_c, bor_c, pnl_c = (
-                            "rgba(244, 63, 94, 0.12)" if st.session_state.theme == "Dark" else "#fee2e2"), (
-                            "#f43f5e" if st.session_state.theme == "Dark" else "#e11d48"), (
-                            "#f43f5e" if st.session_state.theme == "Dark" else "#9f1239")
-
-                    card_html = f"""<div class="day-card" style="background-color: {bg_c}; border-color: {bor_c}; justify-content: center; align-items: center;"><div class="weekly-summary-title" style="color: {txt_c};">Weekly PnL</div><div class="weekly-summary-value" style="color: {pnl_c}; text-align: center;">{weekly_pnl:+.1f} $<br><span style="font-size: 0.85em; color: {txt_c}; font-weight: normal;">RR: {weekly_rr:.2f}</span></div></div>"""
-                    cols[i].markdown(card_html, unsafe_allow_html=True)
-
-                    curr_date_sunday = date(view_year, view_month, day) if day != 0 else (
-                        week_end_date if ref_day else None)
-                    if curr_date_sunday:
-                        cols[i].button(" ", key=f"nav_sun_{i}_{day}_{view_month}", use_container_width=True,
-                                       on_click=go_to_day_view, args=(curr_date_sunday,))
-                else:
-                    if day == 0:
-                        cols[i].write("")
-                    else:
-                        curr_date = date(view_year, view_month, day)
-                        day_trades = [t for t in filtered_trades if t['date'] == str(curr_date)]
-                        day_pnl = sum([t['pnl'] for t in day_trades])
-                        day_rr = sum([t.get('rr', 0.0) for t in day_trades])
-                        has_no_trade = any(t['direction'] == 'No Trade' for t in day_trades)
-                        valid_trades_count = sum(1 for t in day_trades if t['direction'] != 'No Trade')
-
-                        bg_c, bor_c, txt_c, pnl_c = current_theme['bg_card'], current_theme['border'], current_theme[
-                            'text_primary'], current_theme['text_secondary']
-                        pnl_disp, badge = "", ""
-
-                        if day_trades:
-                            if valid_trades_count > 0:
-                                b_bg = "#1d1e30" if st.session_state.theme == "Dark" else "#ede9fe"
-                                b_txt = "#a78bfa" if st.session_state.theme == "Dark" else "#5b21b6"
-                                badge = f"<span style='font-size:0.75em;color:{b_txt};background:{b_bg};padding:1px 4px;border-radius:4px;'>{valid_trades_count}x</span>"
-
-                            if has_no_trade and day_pnl == 0:
-                                bg_c, bor_c, pnl_c, pnl_disp = (
-                                    "rgba(142, 142, 147, 0.15)" if st.session_state.theme == "Dark" else "#f3f4f6"), "#8e8e93", "#8e8e93", "⚪ No Trade"
-                            elif day_pnl > 0:
-                                bg_c, bor_c, pnl_c, pnl_disp = (
-                                    "rgba(31, 214, 165, 0.12)" if st.session_state.theme == "Dark" else "#dcfce7"), (
-                                    "#1fd6a5" if st.session_state.theme == "Dark" else "#059669"), (
-                                    "#1fd6a5" if st.session_state.theme == "Dark" else "#065f46"), f"🟢 +{day_pnl:.1f} $<br><span style='font-size:0.85em;color:{txt_c};font-weight:normal;'>RR: {day_rr:.2f}</span>"
-                            elif day_pnl < 0:
-                                bg_c, bor_c, pnl_c, pnl_disp = (
-                                    "rgba(244, 63, 94, 0.12)" if st.session_state.theme == "Dark" else "#fee2e2"), (
-                                    "#f43f5e" if st.session_state.theme == "Dark" else "#e11d48"), (
-                                    "#f43f5e" if st.session_state.theme == "Dark" else "#9f1239"), f"🔴 {day_pnl:.1f} $<br><span style='font-size:0.85em;color:{txt_c};font-weight:normal;'>RR: {day_rr:.2f}</span>"
-                            elif day_rr > 0:
-                                bg_c, bor_c, pnl_c, pnl_disp = (
-                                    "rgba(31, 214, 165, 0.12)" if st.session_state.theme == "Dark" else "#dcfce7"), (
-                                    "#1fd6a5" if st.session_state.theme == "Dark" else "#059669"), (
-                                    "#1fd6a5" if st.session_state.theme == "Dark" else "#065f46"), f"🟢 {day_pnl:.1f} $<br><span style='font-size:0.85em;color:{txt_c};font-weight:normal;'>RR: +{day_rr:.2f}</span>"
-                            elif day_rr < 0:
-                                bg_c, bor_c, pnl_c, pnl_disp = (
-                                    "rgba(244, 63, 94, 0.12)" if st.session_state.theme == "Dark" else "#fee2e2"), (
-                                    "#f43f5e" if st.session_state.theme == "Dark" else "#e11d48"), (
-                                    "#f43f5e" if st.session_state.theme == "Dark" else "#9f1239"), f"🔴 {day_pnl:.1f} $<br><span style='font-size:0.85em;color:{txt_c};font-weight:normal;'>RR: {day_rr:.2f}</span>"
-                            else:
-                                bg_c, bor_c, pnl_c, pnl_disp = "rgba(142, 142, 147, 0.15)", "#8e8e93", "#8e8e93", f"⚪ {day_pnl:.1f} $<br><span style='font-size:0.85em;color:{txt_c};font-weight:normal;'>RR: {day_rr:.2f}</span>"
-
-                        card_html = f"""<div class="day-card" style="background-color: {bg_c}; border-color: {bor_c};"><div style="display:flex;justify-content:space-between;align-items:flex-start;"><div style="font-weight:bold;font-size:0.95em;color:{txt_c};">{day}</div><div>{badge}</div></div><div style="font-weight:bold;font-size:0.85em;color:{pnl_c};text-align:center;line-height:1.1;margin-top:-5px;">{pnl_disp}</div></div>"""
-                        cols[i].markdown(card_html, unsafe_allow_html=True)
-
-                        cols[i].button(" ", key=f"nav_{curr_date}", use_container_width=True,
-                                       on_click=go_to_day_view, args=(curr_date,))
+        render_month_calendar(view_year, view_month, False, cal_acc, key="dash_calendar")
     else:
         st.info("Brak danych.")
 
 # --- DAILY JOURNAL ---
 elif menu == "📝 Daily Journal":
-    st.markdown(f"<h3 style='margin-top:-12px;font-size:1.05rem;font-weight:700;letter-spacing:-0.2px;'>📝 Daily Trade Entry</h3>", unsafe_allow_html=True)
+    st.markdown("<h3 style='margin-top:-12px;font-size:1.05rem;font-weight:700;letter-spacing:-0.2px;'>📝 Daily Trade Entry</h3>", unsafe_allow_html=True)
 
-    if 'editing_index' not in st.session_state: st.session_state.editing_index = None
-    curr = all_trades[st.session_state.editing_index] if st.session_state.editing_index is not None and not all_trades[
-        st.session_state.editing_index].get('is_backtest') else None
+    if 'editing_id' not in st.session_state: st.session_state.editing_id = None
+    curr = trade_store.get(st.session_state.editing_id) if st.session_state.editing_id is not None else None
+    if curr and curr.get('is_backtest'): curr = None
 
-    if 'dj_current_edit_idx' not in st.session_state or st.session_state.dj_current_edit_idx != st.session_state.editing_index:
-        st.session_state.dj_current_edit_idx = st.session_state.editing_index
+    if 'dj_current_edit_id' not in st.session_state or st.session_state.dj_current_edit_id != st.session_state.editing_id:
+        st.session_state.dj_current_edit_id = st.session_state.editing_id
         st.session_state.dj_temp_conf = curr.get('confluences', []).copy() if curr else []
 
     st.subheader("📌 Trade Details")
     r1c1, r1c2, r1c3, r1c4 = st.columns(4)
-    asset = r1c1.selectbox("Asset", ["NQ", "MNQ", "ES", "MES", "XAUUSD"],
-                           index=0 if not curr else ["NQ", "MNQ", "ES", "MES", "XAUUSD"].index(curr['asset']),
+    asset = r1c1.selectbox("Asset", ASSET_OPTIONS,
+                           index=0 if not curr else option_index(ASSET_OPTIONS, curr['asset']),
                            key="dj_asset")
-    direction = r1c2.selectbox("Direction", ["Long", "Short", "Both", "No Trade"],
-                               index=0 if not curr else ["Long", "Short", "Both", "No Trade"].index(
-                                   curr.get('direction', 'Long')), key="dj_dir")
+    direction = r1c2.selectbox("Direction", DIRECTION_OPTIONS,
+                               index=0 if not curr else option_index(DIRECTION_OPTIONS, curr['direction']),
+                               key="dj_dir")
     tt_l = ["Internal -> External", "External -> Internal", "Internal -> Internal", "External -> External", "-"]
     trade_type = r1c3.selectbox("Type", tt_l, index=0 if not curr or curr.get('trade_type') not in tt_l else tt_l.index(
         curr['trade_type']), key="dj_tt")
-    acc_type_idx = 0 if not curr else ["Funded", "Evaluation"].index(curr.get('account_type', 'Funded'))
+    acc_type_idx = 0 if not curr else option_index(["Funded", "Evaluation"], curr['account_type'])
     account_type = r1c4.selectbox("Account Type", ["Funded", "Evaluation"], index=acc_type_idx, key="dj_acc")
 
     r2c1, r2c2, r2c3, r2c4, r2c5 = st.columns(5)
     trade_date = r2c1.date_input("Date",
-                                 date.today() if not curr else datetime.strptime(curr['date'], '%Y-%m-%d').date(),
+                                 date.today() if not curr or not curr['date'] else curr['date'],
                                  key="dj_date")
     exec_time = r2c2.text_input("Time", value="" if not curr else curr['time'], key="dj_time")
-    outcome = r2c3.selectbox("Outcome", ["Win", "Loss", "Breakeven", "No Trade"],
-                             index=0 if not curr else ["Win", "Loss", "Breakeven", "No Trade"].index(curr['outcome']),
+    outcome = r2c3.selectbox("Outcome", OUTCOME_OPTIONS,
+                             index=0 if not curr else option_index(OUTCOME_OPTIONS, curr['outcome']),
                              key="dj_out")
     pnl_val = r2c4.number_input("PnL ($)", value=0.0 if not curr else float(curr['pnl']), key="dj_pnl")
     rr_val = r2c5.number_input("RR", value=0.0 if not curr else float(curr.get('rr', 0.0)), key="dj_rr")
@@ -794,9 +3295,8 @@ elif menu == "📝 Daily Journal":
     st.divider()
     st.subheader("🧩 Confluences")
     cc1, cc2, cc3 = st.columns([2, 2, 1])
-    sel_tf = cc1.selectbox("Timeframe", ["30s", "1m", "2m", "3m", "4m", "5m", "15m", "30m", "1h", "4h", "d"],
-                           key="dj_sel_tf")
-    sel_conf = cc2.selectbox("Confluence", ["Liq Sweep", "SMT", "FVG", "iFVG", "CISD", "EQ"], key="dj_sel_conf")
+    sel_tf = cc1.selectbox("Timeframe", CONFLUENCE_TIMEFRAMES, key="dj_sel_tf")
+    sel_conf = cc2.selectbox("Confluence", CONFLUENCE_TYPES, key="dj_sel_conf")
 
     if cc3.button("➕ Add", use_container_width=True, key="dj_add_conf"):
         st.session_state.dj_temp_conf.append(f"{sel_tf} - {sel_conf}")
@@ -822,7 +3322,8 @@ elif menu == "📝 Daily Journal":
 
     st.divider()
 
-    if st.button("💾 SAVE RECORD", use_container_width=True, key="dj_save"):
+    save = st.button("💾 SAVE RECORD", use_container_width=True, key="dj_save")
+    if save and not edited_trade_missing('dj_current_edit_id'):
         new_data = {
             "date": str(trade_date), "asset": asset, "direction": direction, "time": exec_time,
             "trade_type": trade_type, "account_type": account_type,
@@ -836,13 +3337,12 @@ elif menu == "📝 Daily Journal":
             "general_notes": "", "mood": "", "interfered": "No", "interfered_how": "",
             "htf_desc": "", "htf_keypoints": "", "ltf_desc": "", "ltf_keypoints": ""
         }
-        if st.session_state.editing_index is not None:
-            st.session_state.all_trades[st.session_state.editing_index] = new_data
-            st.session_state.editing_index = None
+        if curr is not None:
+            replace_trade(curr['trade_id'], new_data)
+            st.session_state.editing_id = None
         else:
-            st.session_state.all_trades.append(new_data)
+            add_trade(new_data)
 
-        save_all_data(st.session_state.all_trades)
         st.session_state.dj_temp_conf = []
         st.success("Zapisano!")
         st.session_state.navigate_to_history = True
@@ -850,16 +3350,12 @@ elif menu == "📝 Daily Journal":
 
 # --- BACKTESTING ---
 elif menu == "⏪ Backtesting":
-    bt_section_idx = 1 if st.session_state.get('bt_nav_section') == "Trade Entry" else 0
-
-    bt_trades = [t for t in all_trades if t.get('is_backtest', True)]
-    df_bt = pd.DataFrame(bt_trades)
-    if not df_bt.empty:
-        df_bt['date'] = pd.to_datetime(df_bt['date'])
+    bt_sections = ["Dashboard", "Trade Entry", "Import"]
+    bt_section_idx = option_index(bt_sections, st.session_state.get('bt_nav_section'))
 
     c_t, c_r, c_y, c_m = st.columns([1.5, 2.5, 1, 1])
-    c_t.markdown(f"<h3 style='margin-top:-12px;font-size:1.05rem;font-weight:700;letter-spacing:-0.2px;'>⏪ Backtesting</h3>", unsafe_allow_html=True)
-    bt_menu = c_r.radio("Sekcja:", ["Dashboard", "Trade Entry"], horizontal=True, index=bt_section_idx,
+    c_t.markdown("<h3 style='margin-top:-12px;font-size:1.05rem;font-weight:700;letter-spacing:-0.2px;'>⏪ Backtesting</h3>", unsafe_allow_html=True)
+    bt_menu = c_r.radio("Sekcja:", bt_sections, horizontal=True, index=bt_section_idx,
                         label_visibility="collapsed", key="bt_main_nav")
     st.session_state.bt_nav_section = bt_menu
 
@@ -870,146 +3366,36 @@ elif menu == "⏪ Backtesting":
                                    key="bt_cal_m")
 
     if bt_menu == "Dashboard":
-        if not df_bt.empty:
-            total_pnl = df_bt['pnl'].sum()
-            total_valid = len(df_bt[df_bt['direction'] != 'No Trade'])
-            wins_df = df_bt[df_bt['pnl'] > 0]
-            losses_df = df_bt[df_bt['pnl'] < 0]
-            wins_count = len(wins_df)
-            losses_count = len(losses_df)
-
-            gross_profit = wins_df['pnl'].sum()
-            gross_loss = abs(losses_df['pnl'].sum())
-
-            wr = (wins_count / total_valid * 100) if total_valid > 0 else 0
-            avg_win = (gross_profit / wins_count) if wins_count > 0 else 0
-            avg_loss = (gross_loss / losses_count) if losses_count > 0 else 0
-            profit_factor = (gross_profit / gross_loss) if gross_loss > 0 else (
-                float('inf') if gross_profit > 0 else 0.0)
-
-            unique_days = df_bt['date'].nunique()
-
-            c1, c2, c3, c4, c5, c6, c7 = st.columns(7)
-            c1.metric("Net P&L", f"{total_pnl:+.1f} $")
-            c2.metric("Win Rate", f"{wr:.1f}%")
-            c3.metric("Avg Win", f"{avg_win:+.1f} $")
-            c4.metric("Avg Loss", f"{-avg_loss:+.1f} $")
-            pf_display = "∞" if profit_factor == float('inf') else f"{profit_factor:.2f}"
-            c5.metric("Profit Factor", pf_display)
-            c6.metric("Trades", total_valid)
-            c7.metric("Days", unique_days)
+        stats_engine = trade_store.derived('stats_engine', StatsEngine)
+        bt_stats = stats_engine.headline(True)
+        if bt_stats['entries'] > 0:
+            render_headline_metrics(bt_stats, show_days=True)
+            render_stats_breakdown(stats_engine, True, None, "bt")
+            render_equity_analytics(trade_store.derived('equity_engine', EquityEngine), True, None, "bt")
+            render_confluence_analytics(trade_store.derived('confluence_engine', ConfluenceEngine), True, None, "bt")
 
             st.markdown("<div style='height: 10px;'></div>", unsafe_allow_html=True)
-            cal = calendar.monthcalendar(view_year, view_month)
-
-            cols = st.columns(7)
-            days_header = ["Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun"]
-            for i, d in enumerate(days_header):
-                cols[i].markdown(
-                    f"<center><b style='color:{current_theme['text_secondary']}; font-size: 0.85em;'>{d}</b></center>",
-                    unsafe_allow_html=True)
-
-            for week in cal:
-                ref_day = next((d for d in week if d != 0), None)
-                weekly_pnl = 0.0
-                weekly_rr = 0.0
-                week_end_date = None
-                if ref_day:
-                    ref_date = date(view_year, view_month, ref_day)
-                    day_idx = week.index(ref_day)
-                    week_start_date = ref_date - timedelta(days=day_idx)
-                    week_end_date = week_start_date + timedelta(days=6)
-                    week_trades = [t for t in bt_trades if
-                                   week_start_date <= datetime.strptime(t['date'], '%Y-%m-%d').date() <= week_end_date]
-                    weekly_pnl = sum(t['pnl'] for t in week_trades)
-                    weekly_rr = sum(t.get('rr', 0.0) for t in week_trades)
-
-                cols = st.columns(7)
-                for i, day in enumerate(week):
-                    if i == 6:
-                        bg_c, bor_c, txt_c, pnl_c = current_theme['bg_card'], current_theme['border'], current_theme[
-                            'text_primary'], current_theme['text_secondary']
-                        if weekly_pnl > 0:
-                            bg_c, bor_c, pnl_c = (
-                                "rgba(31, 214, 165, 0.12)" if st.session_state.theme == "Dark" else "#dcfce7"), (
-                                "#1fd6a5" if st.session_state.theme == "Dark" else "#059669"), (
-                                "#1fd6a5" if st.session_state.theme == "Dark" else "#065f46")
-                        elif weekly_pnl < 0:
-                            bg_c, bor_c, pnl_c = (
-                                "rgba(244, 63, 94, 0.12)" if st.session_state.theme == "Dark" else "#fee2e2"), (
-                                "#f43f5e" if st.session_state.theme == "Dark" else "#e11d48"), (
-                                "#f43f5e" if st.session_state.theme == "Dark" else "#9f1239")
-
-                        card_html = f"""<div class="day-card" style="background-color: {bg_c}; border-color: {bor_c}; justify-content: center; align-items: center;"><div class="weekly-summary-title" style="color: {txt_c};">Weekly PnL</div><div class="weekly-summary-value" style="color: {pnl_c}; text-align: center;">{weekly_pnl:+.1f} $<br><span style="font-size: 0.85em; color: {txt_c}; font-weight: normal;">RR: {weekly_rr:.2f}</span></div></div>"""
-                        cols[i].markdown(card_html, unsafe_allow_html=True)
-
-                        curr_date_sunday = date(view_year, view_month, day) if day != 0 else (
-                            week_end_date if ref_day else None)
-                        if curr_date_sunday:
-                            cols[i].button(" ", key=f"nav_sun_bt_{i}_{day}_{view_month}", use_container_width=True,
-                                           on_click=go_to_day_view, args=(curr_date_sunday, True))
-                    else:
-                        if day == 0:
-                            cols[i].write("")
-                        else:
-                            curr_date = date(view_year, view_month, day)
-                            day_trades = [t for t in bt_trades if t['date'] == str(curr_date)]
-                            day_pnl = sum([t['pnl'] for t in day_trades])
-                            day_rr = sum([t.get('rr', 0.0) for t in day_trades])
-                            has_no_trade = any(t['direction'] == 'No Trade' for t in day_trades)
-                            valid_trades_count = sum(1 for t in day_trades if t['direction'] != 'No Trade')
-
-                            bg_c, bor_c, txt_c, pnl_c = current_theme['bg_card'], current_theme['border'], \
-                            current_theme['text_primary'], current_theme['text_secondary']
-                            pnl_disp, badge = "", ""
-
-                            if day_trades:
-                                if valid_trades_count > 0:
-                                    b_bg = "#2d2d3a" if st.session_state.theme == "Dark" else "#e0e7ff"
-                                    b_txt = "#ccc" if st.session_state.theme == "Dark" else "#4338ca"
-                                    badge = f"<span style='font-size:0.75em;color:{b_txt};background:{b_bg};padding:1px 4px;border-radius:4px;'>{valid_trades_count}x</span>"
-
-                                if has_no_trade and day_pnl == 0:
-                                    bg_c, bor_c, pnl_c, pnl_disp = (
-                                        "rgba(142, 142, 147, 0.15)" if st.session_state.theme == "Dark" else "#f3f4f6"), "#8e8e93", "#8e8e93", "⚪ No Trade"
-                                elif day_pnl > 0:
-                                    bg_c, bor_c, pnl_c, pnl_disp = (
-                                        "rgba(31, 214, 165, 0.12)" if st.session_state.theme == "Dark" else "#dcfce7"), (
-                                        "#1fd6a5" if st.session_state.theme == "Dark" else "#059669"), (
-                                        "#1fd6a5" if st.session_state.theme == "Dark" else "#065f46"), f"🟢 +{day_pnl:.1f} $<br><span style='font-size:0.85em;color:{txt_c};font-weight:normal;'>RR: {day_rr:.2f}</span>"
-                                elif day_pnl < 0:
-                                    bg_c, bor_c, pnl_c, pnl_disp = (
-                                        "rgba(244, 63, 94, 0.12)" if st.session_state.theme == "Dark" else "#fee2e2"), (
-                                        "#f43f5e" if st.session_state.theme == "Dark" else "#e11d48"), (
-                                        "#f43f5e" if st.session_state.theme == "Dark" else "#9f1239"), f"🔴 {day_pnl:.1f} $<br><span style='font-size:0.85em;color:{txt_c};font-weight:normal;'>RR: {day_rr:.2f}</span>"
-                                else:
-                                    bg_c, bor_c, pnl_c, pnl_disp = "rgba(142, 142, 147, 0.15)", "#8e8e93", "#8e8e93", f"⚪ {day_pnl:.1f} $<br><span style='font-size:0.85em;color:{txt_c};font-weight:normal;'>RR: {day_rr:.2f}</span>"
-
-                            card_html = f"""<div class="day-card" style="background-color: {bg_c}; border-color: {bor_c};"><div style="display:flex;justify-content:space-between;align-items:flex-start;"><div style="font-weight:bold;font-size:0.95em;color:{txt_c};">{day}</div><div>{badge}</div></div><div style="font-weight:bold;font-size:0.85em;color:{pnl_c};text-align:center;line-height:1.1;margin-top:-5px;">{pnl_disp}</div></div>"""
-                            cols[i].markdown(card_html, unsafe_allow_html=True)
-
-                            cols[i].button(" ", key=f"nav_bt_{curr_date}", use_container_width=True,
-                                           on_click=go_to_day_view, args=(curr_date, True))
+            render_month_calendar(view_year, view_month, True, key="bt_calendar")
         else:
             st.info("Brak danych z Backtestingu.")
 
     elif bt_menu == "Trade Entry":
-        if 'editing_index' not in st.session_state: st.session_state.editing_index = None
-        curr = all_trades[st.session_state.editing_index] if st.session_state.editing_index is not None and all_trades[
-            st.session_state.editing_index].get('is_backtest') else None
+        if 'editing_id' not in st.session_state: st.session_state.editing_id = None
+        curr = trade_store.get(st.session_state.editing_id) if st.session_state.editing_id is not None else None
+        if curr and not curr.get('is_backtest'): curr = None
 
-        if 'bt_current_edit_idx' not in st.session_state or st.session_state.bt_current_edit_idx != st.session_state.editing_index:
-            st.session_state.bt_current_edit_idx = st.session_state.editing_index
+        if 'bt_current_edit_id' not in st.session_state or st.session_state.bt_current_edit_id != st.session_state.editing_id:
+            st.session_state.bt_current_edit_id = st.session_state.editing_id
             st.session_state.bt_temp_conf = curr.get('confluences', []).copy() if curr else []
 
         st.subheader("📌 Trade Details")
         r1c1, r1c2, r1c3, r1c4 = st.columns(4)
-        asset = r1c1.selectbox("Asset", ["NQ", "MNQ", "ES", "MES", "XAUUSD"],
-                               index=0 if not curr else ["NQ", "MNQ", "ES", "MES", "XAUUSD"].index(curr['asset']),
+        asset = r1c1.selectbox("Asset", ASSET_OPTIONS,
+                               index=0 if not curr else option_index(ASSET_OPTIONS, curr['asset']),
                                key="bt_asset")
-        direction = r1c2.selectbox("Direction", ["Long", "Short", "Both", "No Trade"],
-                                   index=0 if not curr else ["Long", "Short", "Both", "No Trade"].index(
-                                       curr.get('direction', 'Long')), key="bt_dir")
+        direction = r1c2.selectbox("Direction", DIRECTION_OPTIONS,
+                                   index=0 if not curr else option_index(DIRECTION_OPTIONS, curr['direction']),
+                                   key="bt_dir")
         tt_l = ["Internal -> External", "External -> Internal", "Internal -> Internal", "External -> External", "-"]
         trade_type = r1c3.selectbox("Type", tt_l,
                                     index=0 if not curr or curr.get('trade_type') not in tt_l else tt_l.index(
@@ -1018,12 +3404,12 @@ elif menu == "⏪ Backtesting":
 
         r2c1, r2c2, r2c3, r2c4, r2c5 = st.columns(5)
         trade_date = r2c1.date_input("Date",
-                                     date.today() if not curr else datetime.strptime(curr['date'], '%Y-%m-%d').date(),
+                                     date.today() if not curr or not curr['date'] else curr['date'],
                                      key="bt_date")
         exec_time = r2c2.text_input("Time", value="" if not curr else curr['time'], key="bt_time")
-        outcome = r2c3.selectbox("Outcome", ["Win", "Loss", "Breakeven", "No Trade"],
-                                 index=0 if not curr else ["Win", "Loss", "Breakeven", "No Trade"].index(
-                                     curr['outcome']), key="bt_out")
+        outcome = r2c3.selectbox("Outcome", OUTCOME_OPTIONS,
+                                 index=0 if not curr else option_index(OUTCOME_OPTIONS, curr['outcome']),
+                                 key="bt_out")
         pnl_val = r2c4.number_input("PnL ($)", value=0.0 if not curr else float(curr['pnl']), key="bt_pnl")
         rr_val = r2c5.number_input("RR", value=0.0 if not curr else float(curr.get('rr', 0.0)), key="bt_rr")
 
@@ -1040,9 +3426,8 @@ elif menu == "⏪ Backtesting":
         st.divider()
         st.subheader("🧩 Confluences")
         cc1, cc2, cc3 = st.columns([2, 2, 1])
-        sel_tf = cc1.selectbox("Timeframe", ["30s", "1m", "2m", "3m", "4m", "5m", "15m", "30m", "1h", "4h", "d"],
-                               key="bt_sel_tf")
-        sel_conf = cc2.selectbox("Confluence", ["Liq Sweep", "SMT", "FVG", "iFVG", "CISD", "EQ"], key="bt_sel_conf")
+        sel_tf = cc1.selectbox("Timeframe", CONFLUENCE_TIMEFRAMES, key="bt_sel_tf")
+        sel_conf = cc2.selectbox("Confluence", CONFLUENCE_TYPES, key="bt_sel_conf")
 
         if cc3.button("➕ Add", use_container_width=True, key="bt_add_conf"):
             st.session_state.bt_temp_conf.append(f"{sel_tf} - {sel_conf}")
@@ -1068,7 +3453,8 @@ elif menu == "⏪ Backtesting":
 
         st.divider()
 
-        if st.button("💾 SAVE BACKTEST RECORD", use_container_width=True, key="bt_save"):
+        save = st.button("💾 SAVE BACKTEST RECORD", use_container_width=True, key="bt_save")
+        if save and not edited_trade_missing('bt_current_edit_id'):
             new_data = {
                 "date": str(trade_date), "asset": asset, "direction": direction, "time": exec_time,
                 "trade_type": trade_type, "account_type": account_type,
@@ -1082,198 +3468,137 @@ elif menu == "⏪ Backtesting":
                 "general_notes": "", "mood": "", "interfered": "No", "interfered_how": "",
                 "htf_desc": "", "htf_keypoints": "", "ltf_desc": "", "ltf_keypoints": ""
             }
-            if st.session_state.editing_index is not None:
-                st.session_state.all_trades[st.session_state.editing_index] = new_data
-                st.session_state.editing_index = None
+            if curr is not None:
+                replace_trade(curr['trade_id'], new_data)
+                st.session_state.editing_id = None
             else:
-                st.session_state.all_trades.append(new_data)
+                add_trade(new_data)
 
-            save_all_data(st.session_state.all_trades)
             st.session_state.bt_temp_conf = []
             st.success("Zapisano Backtest!")
             st.session_state.navigate_to_history = True
             st.rerun()
 
+    elif bt_menu == "Import":
+        render_backtest_import()
+
 # --- TRADES HISTORY ---
 elif menu == "📜 Trades History":
-    st.markdown(f"<h3 style='margin-top:-12px;font-size:1.05rem;font-weight:700;letter-spacing:-0.2px;'>📜 Trade History</h3>", unsafe_allow_html=True)
+    st.markdown("<h3 style='margin-top:-12px;font-size:1.05rem;font-weight:700;letter-spacing:-0.2px;'>📜 Trade History</h3>", unsafe_allow_html=True)
 
     preset_date = st.session_state.get('history_filter_date')
     if preset_date:
         st.button("⬅️ Back to Dashboard", use_container_width=True, on_click=back_to_dashboard)
 
     if all_trades:
-        df = pd.DataFrame(all_trades)
-        df['date'] = pd.to_datetime(df['date'])
-        df['original_index'] = df.index
+        history_index = trade_store.derived('history_index', HistoryIndex)
+
+        c_q, c_qf = st.columns([3, 1])
+        search_query = c_q.text_input("🔎 Szukaj w notatkach", key="history_search",
+                                      placeholder="np. FOMO, SMT, sweep…").strip()
+        search_field = c_qf.selectbox("Pole", [SEARCH_ALL_FIELDS] + list(SEARCH_FIELDS), key="history_search_field")
 
         with st.expander("🔍 Filter & Sort Options", expanded=bool(preset_date)):
             c_f1, c_f2, c_f3, c_f4 = st.columns(4)
-            sel_asset = c_f1.multiselect("Asset", options=df['asset'].unique())
-            sel_outcome = c_f2.multiselect("Outcome", options=df['outcome'].unique())
+            sel_asset = c_f1.multiselect("Asset", options=history_index.options('asset'))
+            sel_outcome = c_f2.multiselect("Outcome", options=history_index.options('outcome'))
+            sel_account = c_f3.multiselect("Account Type", options=history_index.options('account_type'))
 
-            if 'account_type' in df.columns:
-                sel_account = c_f3.multiselect("Account Type", options=df['account_type'].unique())
-            else:
-                sel_account = []
-
-            min_date, max_date = df['date'].min().date(), df['date'].max().date()
+            min_date, max_date = history_index.date_bounds() or (date.today(), date.today())
             default_val = (preset_date, preset_date) if preset_date else (min_date, max_date)
             sel_date = c_f4.date_input("Date Range", value=default_val)
             st.markdown("---")
-            sort_opt = st.selectbox("Sort By",
-                                    ["Date (Newest)", "Date (Oldest)", "PnL (High -> Low)", "PnL (Low -> High)"])
-
-        if sel_asset: df = df[df['asset'].isin(sel_asset)]
-        if sel_outcome: df = df[df['outcome'].isin(sel_outcome)]
-        if sel_account: df = df[df['account_type'].isin(sel_account)]
+            c_s1, c_s2 = st.columns([3, 1])
+            # Przy wyszukiwaniu domyślnie trafność (nowa lista opcji = nowy widget z pierwszą opcją)
+            sort_opt = c_s1.selectbox("Sort By", (["Relevance"] if search_query else []) + list(HISTORY_SORTS))
+            page_size = c_s2.selectbox("Per page", HISTORY_PAGE_SIZES, index=1, key="history_page_size")
 
         if isinstance(sel_date, tuple):
-            if len(sel_date) == 2:
-                df = df[(df['date'].dt.date >= sel_date[0]) & (df['date'].dt.date <= sel_date[1])]
-            elif len(sel_date) == 1:
-                df = df[df['date'].dt.date == sel_date[0]]
-        elif isinstance(sel_date, date):
-            df = df[df['date'].dt.date == sel_date]
-
-        if sort_opt == "Date (Newest)":
-            df = df.sort_values(by='date', ascending=False)
-        elif sort_opt == "Date (Oldest)":
-            df = df.sort_values(by='date', ascending=True)
-        elif sort_opt == "PnL (High -> Low)":
-            df = df.sort_values(by='pnl', ascending=False)
-        elif sort_opt == "PnL (Low -> High)":
-            df = df.sort_values(by='pnl', ascending=True)
+            # W trakcie wybierania zakresu date_input zwraca jedną datę
+            date_from, date_to = (sel_date[0], sel_date[-1]) if sel_date else (None, None)
+        else:
+            date_from, date_to = sel_date, sel_date
+        filters = {'asset': sel_asset, 'outcome': sel_outcome, 'account_type': sel_account}
+        positions = history_index.query(filters, date_from, date_to,
+                                        "Date (Newest)" if sort_opt == "Relevance" else sort_opt)
+        if search_query:
+            notes_index = trade_store.derived('notes_index', NotesIndex)
+            render_search_truncation(notes_index, search_query)
+            hits = notes_index.search(search_query, SEARCH_FIELDS.get(search_field))
+            search_rank = {tid: rank for rank, tid in enumerate(hits)}
+            positions = [pos for pos in positions if history_index.ids[pos] in search_rank]
+            if sort_opt == "Relevance":
+                positions.sort(key=lambda pos: search_rank[history_index.ids[pos]])
+
+        # Zmiana filtrów lub sortowania wraca do pierwszej strony
+        history_sig = (tuple(sel_asset), tuple(sel_outcome), tuple(sel_account), str(sel_date), sort_opt, page_size,
+                       search_query, search_field)
+        if st.session_state.get('history_sig') != history_sig:
+            st.session_state.history_sig = history_sig
+            st.session_state.history_visible = page_size
+
+        visible_idx = [int(pos) for pos in positions[:st.session_state.history_visible]]
 
         st.divider()
-        st.write(f"Showing **{len(df)}** trades.")
+        st.write(f"Showing **{len(visible_idx)}** of **{len(positions)}** trades.")
 
-        for _, row in df.iterrows():
-            t = all_trades[int(row['original_index'])]
-            idx = int(row['original_index'])
+        for idx in visible_idx:
+            t = all_trades[idx]
+            tid = t['trade_id']
             acc_label = f" | 💼 {t.get('account_type', 'Funded')} | RR: {t.get('rr', 0.0)}"
 
             pnl_sign = "🟢" if float(t['pnl']) > 0 else ("🔴" if float(t['pnl']) < 0 else "⚪")
-            with st.expander(
-                    f"{pnl_sign}  #{idx + 1} · {t['date']} · {t['asset']} · {t.get('direction', 'Long')} · {t['pnl']:+.1f} ${acc_label}"):
-                b1, b2, _ = st.columns([1, 1, 4])
-                b1.button(f"✏️ Edit #{idx + 1}", key=f"ed_{idx}", on_click=go_to_edit_mode, args=(idx,),
-                          use_container_width=True)
-                b2.button(f"🗑️ Delete", key=f"del_{idx}", on_click=delete_trade, args=(idx,), use_container_width=True)
-
-                render_trade_content(t)
+            # on_change="rerun": zawartość (notatki, obrazki) renderujemy tylko dla otwartego wiersza
+            row_exp = st.expander(
+                f"{pnl_sign}  #{idx + 1} · {t['date']} · {t['asset']} · {t.get('direction', 'Long')} · {t['pnl']:+.1f} ${acc_label}",
+                key=f"hx_{tid}", on_change="rerun")
+            if row_exp.open:
+                with row_exp:
+                    b1, b2, _ = st.columns([1, 1, 4])
+                    b1.button(f"✏️ Edit #{idx + 1}", key=f"ed_{tid}", on_click=go_to_edit_mode, args=(tid,),
+                              use_container_width=True)
+                    b2.button("🗑️ Delete", key=f"del_{tid}", on_click=delete_trade, args=(tid,),
+                              use_container_width=True)
+
+                    render_trade_content(t)
+
+        remaining = len(positions) - len(visible_idx)
+        if remaining > 0:
+            st.button(f"⬇️ Load more ({remaining} left)", key="history_load_more", use_container_width=True,
+                      on_click=load_more_history, args=(page_size,))
     else:
         st.info("Brak tradów w historii.")
 
 # --- YEARLY CALENDAR ---
 elif menu == "🗓️ Yearly Calendar":
-    c_t, c_y, c_type = st.columns([1.5, 1, 2.5])
-    c_t.markdown(f"<h3 style='margin-top:-12px;font-size:1.05rem;font-weight:700;letter-spacing:-0.2px;'>🗓️ Yearly Calendar</h3>", unsafe_allow_html=True)
-    view_year = c_y.selectbox("Select Year", range(2000, 2031), index=range(2000, 2031).index(datetime.now().year),
-                              label_visibility="collapsed", key="yc_view_year")
+    c_t, c_y, c_type, c_mode = st.columns([1.5, 1.5, 1.75, 1.25])
+    c_t.markdown("<h3 style='margin-top:-12px;font-size:1.05rem;font-weight:700;letter-spacing:-0.2px;'>🗓️ Yearly Calendar</h3>", unsafe_allow_html=True)
+    yc_mode = c_mode.radio("Mode:", ["Months", "Heatmap"], horizontal=True, label_visibility="collapsed",
+                           key="yc_mode")
+    if yc_mode == "Heatmap":
+        view_years = c_y.multiselect("Select Years", range(2000, 2031), default=[datetime.now().year],
+                                     label_visibility="collapsed", key="yc_view_years")
+    else:
+        view_year = c_y.selectbox("Select Year", range(2000, 2031), index=range(2000, 2031).index(datetime.now().year),
+                                  label_visibility="collapsed", key="yc_view_year")
     yc_type = c_type.radio("Type:", ["Live Trading", "Backtesting"], horizontal=True, label_visibility="collapsed",
                            key="yc_type")
 
-    if all_trades:
+    if all_trades and yc_mode == "Heatmap":
+        is_bt = True if yc_type == "Backtesting" else False
+        heatmap = trade_store.derived('year_heatmap', YearHeatmap)
+        for year in sorted(view_years, reverse=True):
+            render_year_heatmap(heatmap, year, is_bt)
+    elif all_trades:
         is_bt = True if yc_type == "Backtesting" else False
-        filtered_trades = [t for t in all_trades if t.get('is_backtest', False) == is_bt]
 
         for view_month in range(1, 13):
+            month_agg = daily_index.month(view_year, view_month, is_bt)
+            month_pnl_html = f" <span style='font-size:0.75em;color:{current_theme['text_secondary']};'>{month_agg['pnl']:+.1f} $ · RR: {month_agg['rr']:.2f}</span>" if month_agg['entries'] else ""
             st.markdown(
-                f"<h4 style='text-align: center; color: {current_theme['accent']}; margin-top: 20px;'>{calendar.month_name[view_month]} {view_year}</h4>",
+                f"<h4 style='text-align: center; color: {current_theme['accent']}; margin-top: 20px;'>{calendar.month_name[view_month]} {view_year}{month_pnl_html}</h4>",
                 unsafe_allow_html=True)
-            cal = calendar.monthcalendar(view_year, view_month)
-
-            cols = st.columns(7)
-            days_header = ["Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun"]
-            for i, d in enumerate(days_header):
-                cols[i].markdown(
-                    f"<center><b style='color:{current_theme['text_secondary']}; font-size: 0.85em;'>{d}</b></center>",
-                    unsafe_allow_html=True)
-
-            for week in cal:
-                ref_day = next((d for d in week if d != 0), None)
-                weekly_pnl = 0.0
-                weekly_rr = 0.0
-                week_end_date = None
-                if ref_day:
-                    ref_date = date(view_year, view_month, ref_day)
-                    day_idx = week.index(ref_day)
-                    week_start_date = ref_date - timedelta(days=day_idx)
-                    week_end_date = week_start_date + timedelta(days=6)
-                    week_trades = [t for t in filtered_trades if
-                                   week_start_date <= datetime.strptime(t['date'], '%Y-%m-%d').date() <= week_end_date]
-                    weekly_pnl = sum(t['pnl'] for t in week_trades)
-                    weekly_rr = sum(t.get('rr', 0.0) for t in week_trades)
-
-                cols = st.columns(7)
-                for i, day in enumerate(week):
-                    if i == 6:
-                        bg_c, bor_c, txt_c, pnl_c = current_theme['bg_card'], current_theme['border'], current_theme[
-                            'text_primary'], current_theme['text_secondary']
-                        if weekly_pnl > 0:
-                            bg_c, bor_c, pnl_c = (
-                                "rgba(31, 214, 165, 0.12)" if st.session_state.theme == "Dark" else "#dcfce7"), (
-                                "#1fd6a5" if st.session_state.theme == "Dark" else "#059669"), (
-                                "#1fd6a5" if st.session_state.theme == "Dark" else "#065f46")
-                        elif weekly_pnl < 0:
-                            bg_c, bor_c, pnl_c = (
-                                "rgba(244, 63, 94, 0.12)" if st.session_state.theme == "Dark" else "#fee2e2"), (
-                                "#f43f5e" if st.session_state.theme == "Dark" else "#e11d48"), (
-                                "#f43f5e" if st.session_state.theme == "Dark" else "#9f1239")
-
-                        card_html = f"""<div class="day-card" style="background-color: {bg_c}; border-color: {bor_c}; justify-content: center; align-items: center;"><div class="weekly-summary-title" style="color: {txt_c};">Weekly PnL</div><div class="weekly-summary-value" style="color: {pnl_c}; text-align: center;">{weekly_pnl:+.1f} $<br><span style="font-size: 0.85em; color: {txt_c}; font-weight: normal;">RR: {weekly_rr:.2f}</span></div></div>"""
-                        cols[i].markdown(card_html, unsafe_allow_html=True)
-
-                        curr_date_sunday = date(view_year, view_month, day) if day != 0 else (
-                            week_end_date if ref_day else None)
-                        if curr_date_sunday:
-                            cols[i].button(" ", key=f"nav_sun_yc_{i}_{day}_{view_month}_{view_year}",
-                                           use_container_width=True, on_click=go_to_day_view,
-                                           args=(curr_date_sunday, is_bt))
-                    else:
-                        if day == 0:
-                            cols[i].write("")
-                        else:
-                            curr_date = date(view_year, view_month, day)
-                            day_trades = [t for t in filtered_trades if t['date'] == str(curr_date)]
-                            day_pnl = sum([t['pnl'] for t in day_trades])
-                            day_rr = sum([t.get('rr', 0.0) for t in day_trades])
-                            has_no_trade = any(t['direction'] == 'No Trade' for t in day_trades)
-                            valid_trades_count = sum(1 for t in day_trades if t['direction'] != 'No Trade')
-
-                            bg_c, bor_c, txt_c, pnl_c = current_theme['bg_card'], current_theme['border'], \
-                            current_theme['text_primary'], current_theme['text_secondary']
-                            pnl_disp, badge = "", ""
-
-                            if day_trades:
-                                if valid_trades_count > 0:
-                                    b_bg = "#2d2d3a" if st.session_state.theme == "Dark" else "#e0e7ff"
-                                    b_txt = "#ccc" if st.session_state.theme == "Dark" else "#4338ca"
-                                    badge = f"<span style='font-size:0.75em;color:{b_txt};background:{b_bg};padding:1px 4px;border-radius:4px;'>{valid_trades_count}x</span>"
-
-                                if has_no_trade and day_pnl == 0:
-                                    bg_c, bor_c, pnl_c, pnl_disp = (
-                                        "rgba(142, 142, 147, 0.15)" if st.session_state.theme == "Dark" else "#f3f4f6"), "#8e8e93", "#8e8e93", "⚪ No Trade"
-                                elif day_pnl > 0:
-                                    bg_c, bor_c, pnl_c, pnl_disp = (
-                                        "rgba(31, 214, 165, 0.12)" if st.session_state.theme == "Dark" else "#dcfce7"), (
-                                        "#1fd6a5" if st.session_state.theme == "Dark" else "#059669"), (
-                                        "#1fd6a5" if st.session_state.theme == "Dark" else "#065f46"), f"🟢 +{day_pnl:.1f} $<br><span style='font-size:0.85em;color:{txt_c};font-weight:normal;'>RR: {day_rr:.2f}</span>"
-                                elif day_pnl < 0:
-                                    bg_c, bor_c, pnl_c, pnl_disp = (
-                                        "rgba(244, 63, 94, 0.12)" if st.session_state.theme == "Dark" else "#fee2e2"), (
-                                        "#f43f5e" if st.session_state.theme == "Dark" else "#e11d48"), (
-                                        "#f43f5e" if st.session_state.theme == "Dark" else "#9f1239"), f"🔴 {day_pnl:.1f} $<br><span style='font-size:0.85em;color:{txt_c};font-weight:normal;'>RR: {day_rr:.2f}</span>"
-                                else:
-                                    bg_c, bor_c, pnl_c, pnl_disp = "rgba(142, 142, 147, 0.15)", "#8e8e93", "#8e8e93", f"⚪ {day_pnl:.1f} $<br><span style='font-size:0.85em;color:{txt_c};font-weight:normal;'>RR: {day_rr:.2f}</span>"
-
-                            card_html = f"""<div class="day-card" style="background-color: {bg_c}; border-color: {bor_c};"><div style="display:flex;justify-content:space-between;align-items:flex-start;"><div style="font-weight:bold;font-size:0.95em;color:{txt_c};">{day}</div><div>{badge}</div></div><div style="font-weight:bold;font-size:0.85em;color:{pnl_c};text-align:center;line-height:1.1;margin-top:-5px;">{pnl_disp}</div></div>"""
-                            cols[i].markdown(card_html, unsafe_allow_html=True)
-
-                            cols[i].button(" ", key=f"nav_yc_{curr_date}_{view_month}_{view_year}",
-                                           use_container_width=True, on_click=go_to_day_view,
-                                           args=(curr_date, is_bt))
+            render_month_calendar(view_year, view_month, is_bt, key=f"yc_calendar_{view_month}")
             st.markdown("<hr style='margin: 30px 0; border-color: " + current_theme['border'] + ";'>",
                         unsafe_allow_html=True)
     else:
@@ -1281,35 +3606,38 @@ elif menu == "🗓️ Yearly Calendar":
 
 # --- TRADE NOTES ---
 elif menu == "📓 Trade Notes":
-    st.markdown(f"<h3 style='margin-top:-12px;font-size:1.05rem;font-weight:700;letter-spacing:-0.2px;'>📓 Trade Notes</h3>", unsafe_allow_html=True)
+    st.markdown("<h3 style='margin-top:-12px;font-size:1.05rem;font-weight:700;letter-spacing:-0.2px;'>📓 Trade Notes</h3>", unsafe_allow_html=True)
 
     notes_type = st.radio("Wybierz typ wpisów:", ["Live Trading", "Backtesting"], horizontal=True)
 
     if all_trades:
         is_bt_filter = True if notes_type == "Backtesting" else False
-        filtered_trades = [t for t in all_trades if t.get('is_backtest', False) == is_bt_filter]
-
-        trades_with_notes = [
-            t for t in filtered_trades
-            if str(t.get('notes', '')).strip()
-               or str(t.get('model_mistakes', '')).strip()
-               or str(t.get('mental_mistakes', '')).strip()
-               or t.get('confluences')
-               or str(t.get('general_notes', '')).strip()
-               or str(t.get('htf_desc', '')).strip()
-               or str(t.get('ltf_desc', '')).strip()
-               or any(str(link).strip() for link in t.get('htf_links', []))
-               or any(str(link).strip() for link in t.get('ltf_links', []))
-        ]
-
-        trades_with_notes = sorted(trades_with_notes, key=lambda x: x.get('date', ''), reverse=True)
+        c_q, c_qf = st.columns([3, 1])
+        notes_query = c_q.text_input("🔎 Szukaj w notatkach", key="notes_search",
+                                     placeholder="np. FOMO, SMT, sweep…").strip()
+        notes_field = c_qf.selectbox("Pole", [SEARCH_ALL_FIELDS] + list(SEARCH_FIELDS), key="notes_search_field")
+        if notes_query:
+            # Wyniki od najtrafniejszych zamiast od najnowszych
+            notes_index = trade_store.derived('notes_index', NotesIndex)
+            render_search_truncation(notes_index, notes_query)
+            notes_feed = [tid for tid in notes_index.search(notes_query, SEARCH_FIELDS.get(notes_field))
+                          if trade_store.get(tid).is_backtest == is_bt_filter]
+        else:
+            notes_feed = trade_store.derived('notes_feed', build_notes_feed)[is_bt_filter]
+
+        notes_sig = (notes_type, notes_query, notes_field)
+        if st.session_state.get('notes_feed_sig') != notes_sig:
+            st.session_state.notes_feed_sig = notes_sig
+            st.session_state.notes_visible = NOTES_CHUNK
 
         st.divider()
-        if trades_with_notes:
-            st.write(f"Wyświetlam **{len(trades_with_notes)}** wpisów z notatkami.")
+        if notes_feed:
+            visible_ids = notes_feed[:st.session_state.notes_visible]
+            st.write(f"Wyświetlam **{len(visible_ids)}** z **{len(notes_feed)}** wpisów z notatkami.")
             st.markdown("<div style='height: 20px;'></div>", unsafe_allow_html=True)
 
-            for t in trades_with_notes:
+            for tid in visible_ids:
+                t = trade_store.get(tid)
                 with st.container():
                     pnl_val_n = float(t.get('pnl', 0))
                     pnl_c = "#22d3a5" if pnl_val_n > 0 else ("#f43f5e" if pnl_val_n < 0 else "#6b6e8e")
@@ -1325,7 +3653,16 @@ elif menu == "📓 Trade Notes":
                     render_trade_content(t)
 
                     st.markdown("<hr style='border-color: " + current_theme['border'] + "; opacity:0.5;'>", unsafe_allow_html=True)
+
+            if len(notes_feed) > len(visible_ids):
+                st.button(f"⬇️ Więcej ({len(notes_feed) - len(visible_ids)})", key="notes_load_more",
+                          use_container_width=True, on_click=load_more_notes)
+        elif notes_query:
+            st.info(f"Brak wyników dla: {notes_query}.")
         else:
             st.info(f"Brak notatek dla kategorii: {notes_type}.")
     else:
-        st.info("Brak danych w dzienniku.")
\ No newline at end of file
+        st.info("Brak danych w dzienniku.")
+
+# Start ze snapshotu z dysku: uzgodnienie ze źródłem dopiero po wyrenderowaniu strony
+reconcile_cold_start()
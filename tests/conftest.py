@@ -0,0 +1,143 @@
+import ast
+import pathlib
+import re
+import types
+from dataclasses import replace
+
+import pandas as pd
+import pytest
+
+JOURNAL_PATH = pathlib.Path(__file__).resolve().parent.parent / "journal.py"
+A1_RANGE = re.compile(r"([A-Z]*)(\d+)(?::([A-Z]*)(\d*))?")
+
+
+def load_journal():
+    # journal.py to skrypt Streamlit - UI wykonuje się przy imporcie. Do testów ładujemy tylko importy, definicje
+    # funkcji / klas i stałe (NAZWY_WIELKIMI); połączenie, sesję i widoki (conn, trade_store, ...) podstawia test.
+    module = types.ModuleType("journal")
+    module.__file__ = str(JOURNAL_PATH)
+    tree = ast.parse(JOURNAL_PATH.read_text(encoding="utf-8"))
+    for node in tree.body:
+        if isinstance(node, ast.Assign):
+            if not all(isinstance(t, ast.Name) and t.id.isupper() for t in node.targets):
+                continue
+        elif not isinstance(node, (ast.Import, ast.ImportFrom, ast.FunctionDef, ast.ClassDef)):
+            continue
+        exec(compile(ast.Module([node], type_ignores=[]), str(JOURNAL_PATH), "exec"), module.__dict__)
+    return module
+
+
+@pytest.fixture(scope="session")
+def journal():
+    return load_journal()
+
+
+def column_index(letters):
+    index = 0
+    for ch in letters:
+        index = index * 26 + ord(ch) - ord('A') + 1
+    return index - 1
+
+
+class FakeWorksheet:
+    # Minimalny arkusz gspread: siatka wartości (wiersz 1 = nagłówek) i te metody, których używa zapis przyrostowy
+    def __init__(self, header, rows=()):
+        self.grid = [list(header)] + [list(row) for row in rows]
+        self.calls = []
+
+    @staticmethod
+    def _entered(value, option):
+        # USER_ENTERED jak w Sheets: wiodący apostrof znika, '=' staje się formułą
+        if option == "USER_ENTERED" and isinstance(value, str):
+            if value.startswith("'"):
+                return value[1:]
+            if value.startswith("="):
+                return "#FORMULA"
+        return value
+
+    def append_rows(self, values, value_input_option="RAW"):
+        self.calls.append(("append", len(values)))
+        self.grid.extend([self._entered(v, value_input_option) for v in row] for row in values)
+
+    def batch_update(self, data, value_input_option="RAW"):
+        self.calls.append(("batch_update", [item["range"] for item in data]))
+        for item in data:
+            start = int(A1_RANGE.fullmatch(item["range"]).group(2)) - 1
+            for offset, row in enumerate(item["values"]):
+                self.grid[start + offset] = [self._entered(v, value_input_option) for v in row]
+
+    def batch_get(self, ranges, **render_options):
+        self.calls.append(("batch_get", len(ranges)))
+        self.render_options = render_options
+        out = []
+        for a1 in ranges:
+            if a1[0].isdigit():  # "1:1" - całe wiersze
+                first, last = a1.split(":")
+                col_from, col_to, row_from, row_to = "A", "", int(first), int(last)
+            else:
+                col_from, row_from, col_to, row_to = A1_RANGE.fullmatch(a1).groups()
+                row_from, row_to = int(row_from), int(row_to) if row_to else len(self.grid)
+            lo, hi = column_index(col_from), column_index(col_to) + 1 if col_to else None
+            block = []
+            for row in self.grid[row_from - 1:row_to]:
+                cells = list(row[lo:hi])
+                while cells and cells[-1] == "":  # API pomija puste komórki na końcu wiersza...
+                    cells.pop()
+                block.append(cells)
+            while block and not block[-1]:  # ...i puste wiersze na końcu zakresu
+                block.pop()
+            out.append(block)
+        return out
+
+
+class FakeConnection:
+    # GSheetsConnection: pełny odczyt / zapis ramki i klient gspread z arkuszem
+    def __init__(self, ws):
+        self.ws = ws
+        self.client = types.SimpleNamespace(_select_worksheet=lambda: ws)
+        self.full_writes = 0
+
+    def read(self, ttl=0):
+        header, *rows = self.ws.grid
+        return pd.DataFrame([[str(v) for v in row] for row in rows], columns=header)
+
+    def update(self, data):
+        self.full_writes += 1
+        self.ws.grid = [list(data.columns)] + data.astype(object).values.tolist()
+
+
+@pytest.fixture
+def sheet(journal, monkeypatch):
+    # Arkusz z 30 transakcjami za SheetsRepository. Operacje biorą pozycje transakcji z listy startowej i zapisują
+    # przez write() z wersją bazową z tej listy; cell() / column() czytają siatkę, notes() to ponowny odczyt.
+    trades = [journal.Trade.from_row(dict(trade_id=f"t{i}", date=f"2026-03-{i % 28 + 1:02d}", asset="NQ", pnl=10 * i,
+                                          notes=f"note {i}", updated_at=journal.new_version())) for i in range(30)]
+    ws = FakeWorksheet(journal.SHEET_COLUMNS, [list(journal.serialize_trade(t).values()) for t in trades])
+    connection = FakeConnection(ws)
+    monkeypatch.setattr(journal, "conn", connection, raising=False)
+    repo = journal.SheetsRepository()
+
+    def edited(trade, **changes):
+        return replace(trade, updated_at=journal.new_version(), **changes)
+
+    def insert(**fields):
+        trade = edited(journal.Trade.from_row(dict(trade_id=journal.new_trade_id(), **fields)))
+        assert repo.write('insert', [trade], {trade.trade_id: None}) == {}
+
+    def update(positions, **changes):
+        bases = {trades[i].trade_id: trades[i].updated_at for i in positions}
+        for i in positions:
+            trades[i] = edited(trades[i], **changes)
+        assert repo.write('update', [trades[i] for i in positions], bases) == {}
+
+    def delete(positions):
+        bases = {trades[i].trade_id: trades[i].updated_at for i in positions}
+        assert repo.write('delete', [edited(trades[i]) for i in positions], bases) == {}
+
+    def column(col):
+        return [row[journal.SHEET_COLUMNS.index(col)] for row in ws.grid[1:]]
+
+    return types.SimpleNamespace(
+        repo=repo, ws=ws, conn=connection, trades=trades, edited=edited, insert=insert, update=update,
+        delete=delete, column=column, cell=lambda i, col: column(col)[i],
+        notes=lambda: [t.notes for t in repo.load().trades])
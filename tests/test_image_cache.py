@@ -0,0 +1,88 @@
+import io
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+from PIL import Image
+
+
+def png_bytes():
+    out = io.BytesIO()
+    Image.new("RGB", (800, 400), "teal").save(out, format="PNG")
+    return out.getvalue()
+
+
+class ImageHost(BaseHTTPRequestHandler):
+    # Lokalny host obrazków: /ok.png, /html (200, ale nie obrazek), /missing (404), /error (500), /slow (timeout)
+    image = png_bytes()
+    hits = {}
+
+    def do_GET(self):
+        ImageHost.hits[self.path] = ImageHost.hits.get(self.path, 0) + 1
+        if self.path == "/slow":
+            time.sleep(1)
+        status, body = {"/ok.png": (200, self.image), "/html": (200, b"<html>login</html>"),
+                        "/missing": (404, b""), "/error": (500, b"")}.get(self.path, (200, self.image))
+        try:
+            self.send_response(status)
+            self.end_headers()
+            self.wfile.write(body)
+        except OSError:
+            pass  # klient zrezygnował po timeoucie
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture(scope="module")
+def host():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), ImageHost)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+
+
+@pytest.fixture
+def cache(journal, tmp_path, monkeypatch):
+    monkeypatch.setattr(journal, "IMAGE_FETCH_TIMEOUT", 0.2)
+    ImageHost.hits.clear()
+    return journal.ImageCache(str(tmp_path), 10 * 1024 * 1024)
+
+
+def test_image_fetched_once_and_thumbnailed(journal, host, cache):
+    thumb = cache.get(f"{host}/ok.png", thumbnail=True)
+    assert Image.open(io.BytesIO(thumb)).width == journal.THUMB_WIDTH
+    assert cache.get(f"{host}/ok.png") == ImageHost.image
+    assert ImageHost.hits["/ok.png"] == 1
+
+
+@pytest.mark.parametrize("path", ["/missing", "/html"])
+def test_permanent_failure_is_persisted(journal, host, cache, tmp_path, path):
+    assert cache.get(host + path) is None
+    assert host + path in cache.broken
+    # Nowy proces pamięta zepsuty link z broken.json i nie pyta hosta ponownie
+    reopened = journal.ImageCache(str(tmp_path), 10 * 1024 * 1024)
+    assert reopened.get(host + path) is None
+    assert ImageHost.hits[path] == 1
+
+
+@pytest.mark.parametrize("path", ["/error", "/slow"])
+def test_transient_failure_is_retried_later(journal, host, cache, tmp_path, monkeypatch, path):
+    assert cache.get(host + path) is None
+    assert cache.broken == {} and host + path in cache.failed
+    assert journal.ImageCache(str(tmp_path), 10 * 1024 * 1024).is_broken(host + path) is False
+    assert cache.get(host + path) is None  # w oknie IMAGE_TRANSIENT_RETRY bez kolejnego zapytania
+    assert ImageHost.hits[path] == 1
+    monkeypatch.setattr(journal, "IMAGE_TRANSIENT_RETRY", 0)
+    cache.get(host + path)
+    assert ImageHost.hits[path] == 2
+
+
+def test_submit_does_not_block_on_slow_host(host, cache):
+    started = time.monotonic()
+    future = cache.submit(f"{host}/slow")
+    assert cache.submit(f"{host}/slow") is future
+    assert time.monotonic() - started < 0.1
+    assert future.result(timeout=5) is None
+    assert ImageHost.hits["/slow"] == 1
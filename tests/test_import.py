@@ -0,0 +1,58 @@
+import io
+
+import pandas as pd
+import pytest
+
+ROWS = [
+    dict(date="2026-05-04", asset="NQ", direction="Long", pnl="120", notes="ok"),
+    dict(date="", asset="NQ", direction="Long", pnl="50", notes="bez daty"),
+    dict(date="2026-05-05", asset="ES", direction="Short", pnl="x", notes="zły pnl"),
+    dict(date="2026-05-06", asset="ES", direction="Sideways", pnl="10", notes="zły kierunek"),
+    dict(date="2026-05-07", asset="ES", direction="", pnl="-40,5", notes="ok"),
+]
+
+
+def upload(rows, kind):
+    # Jak plik z st.file_uploader: strumień z atrybutami size / name
+    out = io.BytesIO()
+    frame = pd.DataFrame(rows)
+    if kind == "parquet":
+        frame.to_parquet(out, index=False)
+    else:
+        out.write(frame.to_csv(index=False).encode())
+    out.seek(0)
+    out.size, out.name = len(out.getvalue()), f"trades.{kind}"
+    return out
+
+
+@pytest.fixture(params=["csv", "parquet"])
+def kind(request, journal, monkeypatch):
+    monkeypatch.setattr(journal, "IMPORT_CHUNK", 2)  # kilka kawałków także dla małego pliku
+    return request.param
+
+
+def test_rows_without_date_bad_pnl_or_unknown_direction_are_rejected(journal, kind):
+    source = upload(ROWS, kind)
+    result = journal.parse_import_file(source, source.name, [])
+    assert result.error is None
+    assert (result.rows, result.rejected, result.duplicates) == (5, 3, 0)
+    assert [(t.notes, t.pnl, t.direction) for t in result.added] == [("ok", 120.0, "Long"), ("ok", -40.5, "Long")]
+    assert all(t.is_backtest and t.account_type == "Backtesting" for t in result.added)
+    assert result.warnings == ["Wiersz 4, pnl: 'x' - nie jest liczbą, wiersz odrzucony",
+                               "Wiersz 5, direction: 'Sideways' - nieznany kierunek, wiersz odrzucony"]
+
+
+def test_duplicates_skipped_against_journal_and_within_file(journal, kind):
+    first = upload(ROWS[:1], kind)
+    existing = journal.parse_import_file(first, first.name, []).added
+    source = upload([ROWS[0], ROWS[4], ROWS[4], dict(ROWS[4], notes="inna notatka")], kind)
+    result = journal.parse_import_file(source, source.name, existing)
+    assert (result.rows, result.duplicates, result.rejected) == (4, 2, 0)
+    assert [t.notes for t in result.added] == ["ok", "inna notatka"]
+    assert not {t.trade_id for t in result.added} & {t.trade_id for t in existing}
+
+
+def test_missing_required_column_stops_import(journal, kind):
+    source = upload([{k: v for k, v in ROWS[0].items() if k != 'pnl'}], kind)
+    result = journal.parse_import_file(source, source.name, [])
+    assert result.error == "Brak wymaganych kolumn: pnl" and result.added == []
@@ -0,0 +1,31 @@
+def test_versions_read_raw_values(sheet):
+    sheet.insert(date="2026-04-01")
+    assert sheet.ws.render_options["value_render_option"] == "UNFORMATTED_VALUE"
+
+
+def test_stale_update_is_rejected_as_conflict(journal, sheet):
+    old = sheet.trades[2]
+    # Inne urządzenie zmieniło ten wiersz po naszym odczycie
+    sheet.ws.grid[3] = list(journal.serialize_trade(sheet.edited(old, notes="remote")).values())
+    theirs = sheet.repo.write('update', [sheet.edited(old, notes="mine")], {old.trade_id: old.updated_at})
+    assert list(theirs) == [old.trade_id]
+    assert theirs[old.trade_id].notes == "remote"
+    assert sheet.cell(2, 'notes') == "remote"
+
+
+def test_delete_of_remotely_edited_row_is_conflict(journal, sheet):
+    old = sheet.trades[4]
+    sheet.ws.grid[5] = list(journal.serialize_trade(sheet.edited(old, pnl=1.5)).values())
+    theirs = sheet.repo.write('delete', [sheet.edited(old)], {old.trade_id: old.updated_at})
+    assert theirs[old.trade_id].pnl == 1.5
+    assert sheet.cell(4, 'deleted') is False
+
+
+def test_retried_write_is_not_a_conflict(sheet):
+    old = sheet.trades[6]
+    change = sheet.edited(old, notes="once")
+    bases = {old.trade_id: old.updated_at}
+    assert sheet.repo.write('update', [change], bases) == {}
+    calls = len(sheet.ws.calls)
+    assert sheet.repo.write('update', [change], bases) == {}
+    assert [c[0] for c in sheet.ws.calls[calls:]] == ["batch_get"]
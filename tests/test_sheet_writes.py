@@ -0,0 +1,47 @@
+import pytest
+
+
+def test_insert_appends_row(sheet):
+    sheet.insert(date="2026-04-01", notes="fresh")
+    assert sheet.ws.calls[-1] == ("append", 1)
+    assert sheet.conn.full_writes == 0
+    assert sheet.notes()[-1] == "fresh"
+
+
+def test_update_patches_single_row(sheet):
+    before = [list(row) for row in sheet.ws.grid]
+    sheet.update([3], notes="patched")
+    assert sheet.ws.calls[-1] == ("batch_update", ["A5"])
+    assert sheet.cell(3, 'notes') == "patched"
+    assert [row for i, row in enumerate(sheet.ws.grid) if i != 4] == [row for i, row in enumerate(before) if i != 4]
+    assert sheet.conn.full_writes == 0
+
+
+def test_adjacent_rows_patched_in_one_range(sheet):
+    sheet.update([5, 6, 7], notes="x")
+    assert sheet.ws.calls[-1] == ("batch_update", ["A7"])
+    assert [sheet.cell(i, 'notes') for i in (5, 6, 7)] == ["x"] * 3
+
+
+def test_delete_writes_tombstone(sheet):
+    sheet.delete([0])
+    assert len(sheet.ws.grid) == 31
+    assert sheet.cell(0, 'deleted') is True
+    assert "note 0" not in sheet.notes()
+    assert sheet.column('deleted').count(True) == 1
+
+
+def test_compaction_after_many_tombstones(journal, sheet):
+    for i in range(journal.COMPACT_MIN_TOMBSTONES):
+        sheet.delete([i])
+    assert sheet.conn.full_writes == 1
+    assert sheet.column('notes') == [f"note {i}" for i in range(journal.COMPACT_MIN_TOMBSTONES, 30)]
+    assert True not in sheet.column('deleted')
+
+
+@pytest.mark.parametrize("text", ["=1+1", "'quoted"])
+def test_text_round_trips_through_user_entered(sheet, text):
+    sheet.update([1], notes=text)
+    sheet.insert(date="2026-04-02", notes=text)
+    notes = sheet.notes()
+    assert notes[1] == notes[-1] == text
@@ -0,0 +1,58 @@
+import types
+
+import pytest
+
+
+@pytest.fixture
+def backend(journal, monkeypatch):
+    source = types.SimpleNamespace(name="gsheets")
+    monkeypatch.setattr(journal, "repository", source, raising=False)
+    return source
+
+
+@pytest.fixture
+def trades(journal):
+    return [
+        journal.Trade.from_row(dict(trade_id="a", date="2026-03-02", asset="NQ", direction="Short", pnl="-120,5",
+                                    rr=1.5, outcome="Loss", notes="ńapięcie, fomo",
+                                    htf_links="https://x/1|||https://x/2",
+                                    checklist='[true, false, true, false, false, false]',
+                                    confluences='["5m - FVG", "1h - OB"]', general_notes="stary wpis",
+                                    updated_at="2026-03-02T10:00:00.000001")),
+        journal.Trade.from_row(dict(trade_id="b", date="", asset="XAUUSD", direction="No Trade", is_backtest=True,
+                                    account_type="Backtesting", updated_at="2026-03-03T10:00:00.000001")),
+    ]
+
+
+def test_round_trip_keeps_every_field_and_version(journal, backend, trades, tmp_path):
+    path = str(tmp_path / "journal.arrow")
+    journal.write_snapshot(path, trades, "2026-03-03T10:00:00.000001")
+    loaded, version = journal.read_snapshot(path)
+    assert version == "2026-03-03T10:00:00.000001"
+    assert [journal.serialize_trade(t) for t in loaded] == [journal.serialize_trade(t) for t in trades]
+    assert loaded[0]['confluences'] == ["5m - FVG", "1h - OB"] and loaded[0]['general_notes'] == "stary wpis"
+    assert loaded[1].date is None and loaded[1].is_backtest
+    assert not (tmp_path / "journal.arrow.tmp").exists()
+
+
+def test_snapshot_of_other_backend_is_ignored(journal, backend, trades, tmp_path):
+    path = str(tmp_path / "journal.arrow")
+    journal.write_snapshot(path, trades, "v1")
+    backend.name = "sqlite"
+    assert journal.read_snapshot(path) is None
+
+
+def test_snapshot_with_old_columns_is_ignored(journal, backend, trades, tmp_path, monkeypatch):
+    path = str(tmp_path / "journal.arrow")
+    with monkeypatch.context() as m:
+        m.setattr(journal, "SNAPSHOT_COLUMNS", journal.SNAPSHOT_COLUMNS[:-1])
+        journal.write_snapshot(path, trades, "v1")
+    assert journal.read_snapshot(path) is None
+
+
+@pytest.mark.parametrize("content", [None, b"", b"not an arrow file"])
+def test_missing_or_broken_file_is_ignored(journal, backend, tmp_path, content):
+    path = tmp_path / "journal.arrow"
+    if content is not None:
+        path.write_bytes(content)
+    assert journal.read_snapshot(str(path)) is None
@@ -0,0 +1,99 @@
+import sqlite3
+from dataclasses import replace
+
+import pytest
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    return str(tmp_path / "journal.db")
+
+
+@pytest.fixture
+def trades(journal):
+    return [new_trade(journal, f"t{i}", pnl=10 * i, notes=f"note {i}") for i in range(6)]
+
+
+@pytest.fixture
+def repo(journal, db_path, trades):
+    repo = journal.SQLiteRepository(db_path)
+    assert repo.write('insert', trades, {t.trade_id: None for t in trades}) == {}
+    return repo
+
+
+def new_trade(journal, trade_id, **fields):
+    return journal.Trade.from_row(dict(trade_id=trade_id, date="2026-03-02", asset="NQ",
+                                       updated_at=journal.new_version(), **fields))
+
+
+def edited(journal, trade, **changes):
+    return replace(trade, updated_at=journal.new_version(), **changes)
+
+
+def test_insert_update_delete_round_trip(journal, repo, trades):
+    version = max(t.updated_at for t in trades)
+    assert repo.write('update', [edited(journal, trades[1], notes="edited")], {"t1": trades[1].updated_at}) == {}
+    assert repo.write('delete', [edited(journal, trades[2])], {"t2": trades[2].updated_at}) == {}
+    loaded = repo.load().trades
+    assert [t.trade_id for t in loaded] == ["t0", "t1", "t3", "t4", "t5"]
+    assert [t.notes for t in loaded][:2] == ["note 0", "edited"] and loaded[-1].pnl == 50.0
+    changed, live, latest = repo.changes_since(version)
+    assert [t.trade_id for t in changed] == ["t1"]
+    assert live == {"t0", "t1", "t3", "t4", "t5"} and latest == changed[0].updated_at
+
+
+def test_stale_update_and_delete_are_conflicts(journal, repo, trades):
+    old = trades[3]
+    remote = edited(journal, old, notes="remote")
+    repo.write('update', [remote], {"t3": old.updated_at})
+    theirs = repo.write('update', [edited(journal, old, notes="mine")], {"t3": old.updated_at})
+    assert list(theirs) == ["t3"] and theirs["t3"].notes == "remote"
+    theirs = repo.write('delete', [edited(journal, old)], {"t3": old.updated_at})
+    assert theirs["t3"].updated_at == remote.updated_at
+    assert {t.trade_id: t.notes for t in repo.load().trades}["t3"] == "remote"
+
+
+def test_update_of_row_deleted_elsewhere_is_conflict(journal, repo, trades):
+    old = trades[4]
+    repo.write('delete', [edited(journal, old)], {"t4": old.updated_at})
+    assert repo.write('update', [edited(journal, old, notes="mine")], {"t4": old.updated_at}) == {"t4": None}
+    assert "t4" not in {t.trade_id for t in repo.load().trades}
+
+
+def test_retried_write_is_not_a_conflict(journal, repo, trades):
+    old = trades[0]
+    change = edited(journal, old, notes="once")
+    assert repo.write('update', [change], {"t0": old.updated_at}) == {}
+    assert repo.write('update', [change], {"t0": old.updated_at}) == {}
+
+
+def test_conflicts_are_read_back_in_chunks(journal, repo, trades, monkeypatch):
+    monkeypatch.setattr(journal, "SQL_CHUNK", 2)
+    stale = {t.trade_id: t.updated_at for t in trades}
+    repo.write('update', [edited(journal, t, notes="remote") for t in trades], stale)
+    theirs = repo.write('update', [edited(journal, t, notes="mine") for t in trades], stale)
+    assert sorted(theirs) == [t.trade_id for t in trades]
+    assert {t.notes for t in theirs.values()} == {"remote"}
+
+
+def test_version_check_holds_the_write_lock(journal, repo, trades, db_path, monkeypatch):
+    # Inny proces próbuje zapisać wiersz dokładnie między odczytem wersji a naszym zapisem
+    other = sqlite3.connect(db_path, timeout=0)
+    read_versions = journal.SQLiteRepository._versions
+    blocked = []
+
+    def versions_then_race(self, trade_ids):
+        versions = read_versions(self, trade_ids)
+        try:
+            with other:
+                other.execute("UPDATE trades SET notes = 'other' WHERE trade_id = 't5'")
+        except sqlite3.OperationalError as e:
+            blocked.append(str(e))
+        return versions
+
+    monkeypatch.setattr(journal.SQLiteRepository, "_versions", versions_then_race)
+    old = trades[5]
+    assert repo.write('update', [edited(journal, old, notes="mine")], {"t5": old.updated_at}) == {}
+    other.close()
+    assert blocked == ["database is locked"]
+    assert {t.trade_id: t.notes for t in repo.load().trades}["t5"] == "mine"
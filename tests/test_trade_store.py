@@ -0,0 +1,159 @@
+import random
+from datetime import date, timedelta
+
+import numpy as np
+import pytest
+
+ASSETS = ["NQ", "ES", "MNQ"]
+WORDS = ["fvg", "smt", "fomo", "revenge", "sweep", "ob", "bos", "liquidity", "ńapięcie", ""]
+DERIVED = {'daily_index': 'DailyIndex', 'stats_engine': 'StatsEngine', 'notes_index': 'NotesIndex',
+           'trade_frame': 'TradeFrame', 'year_heatmap': 'YearHeatmap', 'equity_engine': 'EquityEngine',
+           'confluence_engine': 'ConfluenceEngine'}
+
+
+def random_trade(journal, rng, trade_id):
+    return journal.Trade.from_row(dict(
+        trade_id=trade_id,
+        date="" if rng.random() < 0.05 else str(date(2026, 1, 1) + timedelta(days=rng.randrange(120))),
+        asset=rng.choice(ASSETS),
+        direction=rng.choice(journal.DIRECTION_OPTIONS),
+        account_type=rng.choice(["Funded", "Evaluation", "Backtesting"]),
+        outcome=rng.choice(journal.OUTCOME_OPTIONS),
+        pnl=rng.choice([0, rng.randint(-500, 500), round(rng.uniform(-99, 99), 2)]),
+        rr=rng.choice([0, 1, -1, 2.5]),
+        is_backtest=rng.random() < 0.3,
+        notes=" ".join(rng.choice(WORDS) for _ in range(rng.randrange(4))),
+        model_mistakes=rng.choice(WORDS),
+        confluences=rng.choice(['', '["5m - FVG"]', '["1h - OB", "5m - BOS"]', f'["1m - SMT", "x{rng.randrange(90)}"]']),
+    ))
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_incremental_derived_matches_rebuild(journal, seed):
+    # Losowe add / update / remove: struktury pochodne nanoszone przyrostowo == zbudowane od zera
+    rng = random.Random(seed)
+    store = journal.TradeStore([random_trade(journal, rng, f"t{i}") for i in range(60)])
+    builders = {name: getattr(journal, cls) for name, cls in DERIVED.items()}
+    structures = {name: store.derived(name, build) for name, build in builders.items()}
+    next_id = 60
+    for step in range(250):
+        ids = list(store.by_id)
+        op = rng.random()
+        if op < 0.4 or not ids:
+            store.add(random_trade(journal, rng, f"t{next_id}"))
+            next_id += 1
+        elif op < 0.75:
+            trade_id = rng.choice(ids)
+            store.update(trade_id, random_trade(journal, rng, trade_id))
+        else:
+            store.remove(rng.choice(ids))
+        if step % 10 == 0:
+            assert store.check_derived() == [], f"seed {seed}, krok {step}"
+            # Ten sam obiekt: zmiany naniesione przez apply(old, new), a nie przebudowa
+            assert all(store.derived(name, builders[name]) is structures[name] for name in builders)
+    assert store.check_derived() == []
+
+
+def test_large_delta_rebuilds(journal):
+    rng = random.Random(7)
+    store = journal.TradeStore([random_trade(journal, rng, f"t{i}") for i in range(10)])
+    before = store.derived('daily_index', journal.DailyIndex)
+    for i in range(journal.DERIVED_MAX_DELTA + 1):
+        store.add(random_trade(journal, rng, f"n{i}"))
+    after = store.derived('daily_index', journal.DailyIndex)
+    assert after is not before
+    assert after.snapshot() == journal.DailyIndex(store.trades()).snapshot()
+
+
+def test_stats_tables_match_rebuild(journal):
+    rng = random.Random(11)
+    store = journal.TradeStore([random_trade(journal, rng, f"t{i}") for i in range(40)])
+    engine = store.derived('stats_engine', journal.StatsEngine)
+    engine.headline(False)
+    engine.breakdown('asset', False, 'Funded')
+    for i in range(30):
+        trade_id = rng.choice(list(store.by_id))
+        store.update(trade_id, random_trade(journal, rng, trade_id))
+    engine = store.derived('stats_engine', journal.StatsEngine)
+    fresh = journal.StatsEngine(store.trades(), journal.TradeFrame(store.trades()))
+    for is_bt in (False, True):
+        for acc in (None, 'Funded', 'Evaluation', 'Backtesting'):
+            assert engine.headline(is_bt, acc) == pytest.approx(fresh.headline(is_bt, acc), nan_ok=True)
+            for dimension in journal.STAT_DIMENSIONS.values():
+                left, right = engine.breakdown(dimension, is_bt, acc), fresh.breakdown(dimension, is_bt, acc)
+                assert list(left.index) == list(right.index)
+                np.testing.assert_allclose(left.to_numpy(float), right.to_numpy(float), atol=1e-9, equal_nan=True)
+
+
+def test_notes_search_after_edits(journal):
+    rng = random.Random(3)
+    store = journal.TradeStore([random_trade(journal, rng, f"t{i}") for i in range(30)])
+    index = store.derived('notes_index', journal.NotesIndex)
+    store.update("t0", journal.Trade.from_row(dict(trade_id="t0", date="2026-02-01", notes="unikalnysłowo")))
+    store.update("t1", journal.Trade.from_row(dict(trade_id="t1", date="2026-02-02", notes="usuwanesłowo fvg")))
+    assert store.derived('notes_index', journal.NotesIndex).search("usuwane") == ["t1"]
+    store.remove("t1")
+    index = store.derived('notes_index', journal.NotesIndex)
+    assert index.search("unikalny") == ["t0"]
+    assert index.search("usuwanesłowo") == []
+    assert "t1" not in index.search("fvg")
+    fresh = journal.NotesIndex(store.trades())
+    for query in ["fvg", "sw", "fomo smt", "ńap"]:
+        assert sorted(index.search(query)) == sorted(fresh.search(query))
+
+
+def test_equity_curve_after_edits(journal):
+    rng = random.Random(5)
+    store = journal.TradeStore([random_trade(journal, rng, f"t{i}") for i in range(80)])
+    engine = store.derived('equity_engine', journal.EquityEngine)
+    engine.curve(False)
+    frame = store.derived('trade_frame', journal.TradeFrame)
+    for i in range(20):
+        trade_id = rng.choice(list(store.by_id))
+        store.update(trade_id, random_trade(journal, rng, trade_id))
+    store.remove(rng.choice(list(store.by_id)))
+    store.add(random_trade(journal, rng, "new"))
+    # Ramka łatana, nie budowana od nowa: silnik i ramka to te same obiekty
+    assert store.derived('equity_engine', journal.EquityEngine) is engine
+    assert store.derived('trade_frame', journal.TradeFrame) is frame
+    fresh = journal.EquityEngine(store.trades(), journal.TradeFrame(store.trades()))
+    for is_bt in (False, True):
+        for acc in (None, 'Funded', 'Backtesting'):
+            left, right = engine.curve(is_bt, acc), fresh.curve(is_bt, acc)
+            assert left[1] == pytest.approx(right[1], nan_ok=True)
+            assert left[0].equals(right[0])
+
+
+def test_confluence_tables_after_edits(journal):
+    rng = random.Random(9)
+    store = journal.TradeStore([random_trade(journal, rng, f"t{i}") for i in range(60)])
+    engine = store.derived('confluence_engine', journal.ConfluenceEngine)
+    engine.per_confluence(False)
+    for i in range(40):
+        trade_id = rng.choice(list(store.by_id))
+        store.update(trade_id, random_trade(journal, rng, trade_id))
+    store.remove(rng.choice(list(store.by_id)))
+    store.add(random_trade(journal, rng, "new"))
+    assert store.derived('confluence_engine', journal.ConfluenceEngine) is engine
+    fresh = journal.ConfluenceEngine(store.trades(), journal.TradeFrame(store.trades()))
+    for is_bt in (False, True):
+        for acc in (None, 'Funded'):
+            for table in ('per_confluence', 'combinations'):
+                left = getattr(engine, table)(is_bt, acc).sort_index()
+                right = getattr(fresh, table)(is_bt, acc).sort_index()
+                assert list(left.index) == list(right.index)
+                np.testing.assert_allclose(left.to_numpy(float), right.to_numpy(float), equal_nan=True)
+
+
+def test_short_prefix_keeps_most_frequent_terms(journal):
+    # Więcej terminów z prefiksem niż SEARCH_MAX_EXPANSIONS: zostają najczęstsze, a zawężenie jest zgłaszane
+    limit = journal.SEARCH_MAX_EXPANSIONS
+    trades = [journal.Trade.from_row(dict(trade_id=f"r{i}", date="2026-01-02", notes=f"a{i:04d}")) for i in range(limit + 50)]
+    trades += [journal.Trade.from_row(dict(trade_id=f"c{i}", date="2026-01-03", notes="zzz azzz")) for i in range(3)]
+    index = journal.NotesIndex(trades)
+    hits = index.search("a")
+    assert len(hits) == limit + 2  # "azzz" (3 transakcje) i limit - 1 rzadkich terminów
+    assert {"c0", "c1", "c2"} <= set(hits)
+    assert index.truncated("a zzz") == [("a", limit + 51)]
+    assert index.truncated("a0001") == []
+    assert index.search("a0249") == ["r249"]
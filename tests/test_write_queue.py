@@ -0,0 +1,91 @@
+import time
+from dataclasses import replace
+
+import pytest
+
+
+class Backend:
+    # Repozytorium-atrapa: zapisuje wywołania write(); on_write może rzucić wyjątek albo zwrócić konflikty
+    def __init__(self, on_write=None):
+        self.calls = []
+        self.on_write = on_write
+
+    def write(self, op, trades, bases=None):
+        self.calls.append((op, [(t.trade_id, t.notes) for t in trades], dict(bases)))
+        return self.on_write(len(self.calls)) if self.on_write else {}
+
+
+@pytest.fixture
+def queue(journal, monkeypatch):
+    monkeypatch.setattr(journal, "WRITE_DEBOUNCE", 0.1)
+    monkeypatch.setattr(journal, "WRITE_MAX_BACKOFF", 0)
+    return lambda backend: journal.WriteQueue(backend)
+
+
+def trade(journal, trade_id, **fields):
+    return journal.Trade.from_row(dict(trade_id=trade_id, date="2026-03-02", updated_at=journal.new_version(),
+                                       **fields))
+
+
+def settle(queue, timeout=5):
+    deadline = time.monotonic() + timeout
+    while queue.status()[:2] != (0, 0):
+        assert time.monotonic() < deadline, queue.status()
+        time.sleep(0.01)
+
+
+@pytest.mark.parametrize("prev, op, merged", [
+    (None, 'update', 'update'), ('insert', 'update', 'insert'), ('insert', 'delete', None),
+    ('update', 'update', 'update'), ('update', 'delete', 'delete'),
+])
+def test_coalesce_op(journal, prev, op, merged):
+    assert journal.coalesce_op(prev, op) == merged
+
+
+def test_burst_of_changes_is_one_write_per_op(journal, queue):
+    backend = Backend()
+    q = queue(backend)
+    a, b, c = trade(journal, "a"), trade(journal, "b"), trade(journal, "c")
+    q.submit('insert', [a], None)
+    q.submit('update', [replace(a, notes="a2")], None, {"a": a.updated_at})
+    q.submit('insert', [b], None)
+    q.submit('delete', [b], None, {"b": b.updated_at})
+    q.submit('update', [replace(c, notes="c2")], None, {"c": c.updated_at})
+    q.submit('delete', [c], None, {"c": "newer"})
+    settle(q)
+    # b wstawiony i usunięty przed zapisem - do źródła nie idzie nic; c zachowuje bazę z pierwszej zmiany
+    assert backend.calls == [('insert', [("a", "a2")], {"a": None}), ('delete', [("c", "")], {"c": c.updated_at})]
+
+
+def test_failed_write_is_retried_under_newer_changes(journal, queue):
+    a = trade(journal, "a")
+
+    def offline_once(call):
+        if call == 1:
+            # Użytkownik edytuje dalej, zanim nieudany zapis wróci do kolejki
+            q.submit('update', [replace(a, notes="second")], None, {"a": "first"})
+            raise ConnectionError("offline")
+        return {}
+
+    backend = Backend(offline_once)
+    q = queue(backend)
+    q.submit('update', [replace(a, notes="first")], None, {"a": a.updated_at})
+    settle(q)
+    assert backend.calls == [('update', [("a", "first")], {"a": a.updated_at}),
+                             ('update', [("a", "second")], {"a": a.updated_at})]
+    assert q.status() == (0, 0, None, 0)
+
+
+def test_rejected_change_waits_for_resolution(journal, queue):
+    a = trade(journal, "a")
+    theirs = replace(a, notes="theirs", updated_at=journal.new_version())
+    backend = Backend(lambda call: {"a": theirs} if call == 1 else {})
+    q = queue(backend)
+    mine = replace(a, notes="mine", updated_at=journal.new_version())
+    q.submit('update', [mine], None, {"a": a.updated_at})
+    settle(q)
+    assert q.status()[3] == 1 and q.unsynced_ids() == {"a"}
+    q.resolve("a", keep_mine=True)
+    settle(q)
+    assert backend.calls[-1] == ('update', [("a", "mine")], {"a": theirs.updated_at})
+    assert q.unsynced_ids() == set()